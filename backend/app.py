@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '1'
-from flask import Flask, request, jsonify
+import json
+import math
+import base64
+import time
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, jsonify, Response, stream_with_context, make_response, url_for
 from flask_cors import CORS
 import logging
 from utils.bcolors import bcolors
@@ -10,19 +17,307 @@ from utils.bcolors import bcolors
 from utils.utility import load_status_page
 
 # Load the ensemble models
-from utils.ensemble import load_ensemble, get_prediction
+from utils.ensemble import load_ensemble, get_prediction, iter_predictions, count_slices, backend_paths
+from utils.ensemble import ensemble_predict_batch, get_compact_prediction, get_series_prediction, warm_up, PipelineConfig
+from utils.ensemble import iter_studies, iter_series, render_slice
+from utils.ensemble import iter_series_predictions, get_compact_series_prediction
+from utils.upscale import IMAGE_FORMATS
+from utils.maskcodec import MASK_FORMATS
 
-# Load the upscale function
-from utils.upscale import upscale_overlays
+# Confidence-gated cascade over the ensemble members
+from utils.cascade import CascadeEnsemble, TrackedCascade, member_cost
+
+# Cheap pass estimating the slice range of the gland
+from utils.triage import SliceTriage
+
+# Micro-batching across concurrent requests
+from utils.scheduler import InferenceScheduler
+
+# Cache of per-study predictions
+from utils.cache import PredictionCache, model_fingerprint
+
+# Header-only inspection of uploads
+from utils.ingest import UploadRequest
+
+# Zipped series and single-slice instances grouped into volumes
+from utils.series import expand_uploads, group_series, upload_headers, is_archive, ArchiveTooLargeError
+
+# Global memory and slice budget of in-flight predictions
+from utils.admission import AdmissionController, AdmissionRejected, estimate_cost
+
+# Study masks kept after inference and their overlays rendered slice by slice
+from utils.studies import StudyStore, TileCache
+
+# Background jobs for large studies
+from utils.jobs import JobManager, BufferedUpload, QueueFullError
+
+# Prometheus metrics and per-request stage timing
+from utils.metrics import REGISTRY, REQUESTS, REQUEST_SECONDS, begin_request, end_request, current_request
 
 # Basic configuration
 API_KEY = "mysecureapikey"  # Replace with a secure key
+PREDICT_BATCH_SIZE = int(os.environ.get('PREDICT_BATCH_SIZE', 32))  # Max slices per model call
+BACKGROUND_LOADING = os.environ.get('BACKGROUND_LOADING', '0') == '1'  # Serve /health while the models load
+PARALLEL_LOADING = os.environ.get('PARALLEL_LOADING', '1') == '1'  # Load the ensemble members concurrently
+# Powers of two up to PREDICT_BATCH_SIZE by default, so the scheduler pads a batch to at most twice its size
+DEFAULT_WARMUP_BATCH_SIZES = ",".join(str(min(2 ** i, PREDICT_BATCH_SIZE))
+                                      for i in range(max(PREDICT_BATCH_SIZE - 1, 1).bit_length() + 1))
+WARMUP_BATCH_SIZES = [int(n) for n in os.environ.get('WARMUP_BATCH_SIZES', DEFAULT_WARMUP_BATCH_SIZES).split(',')
+                      if n.strip()]  # Dummy batches run before ready, the only sizes the scheduler runs
+READY_RETRY_AFTER = 5  # Seconds clients are told to wait while the models load
+FUSED_ENSEMBLE = os.environ.get('FUSED_ENSEMBLE', '0') == '1'  # Run the ensemble as one compiled graph
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'keras')  # 'keras' or 'tflite' (see convert.py)
+TFLITE_QUANTIZATION = os.environ.get('TFLITE_QUANTIZATION', 'float16')  # Which converted artifacts to load
+TFLITE_THREADS = int(os.environ.get('TFLITE_THREADS', 0)) or None  # Interpreter threads, 0 lets TFLite decide
+CASCADE_ENABLED = os.environ.get('CASCADE_ENABLED', '0') == '1'  # Run the other members only on unclear slices
+CASCADE_BAND = float(os.environ.get('CASCADE_BAND', 0.1))  # Probabilities within this of 0/1 are confident
+CASCADE_MAX_UNCERTAIN = float(os.environ.get('CASCADE_MAX_UNCERTAIN', 0.001))  # Uncertain pixel share still short-circuited
+CASCADE_MAX_REGION = int(os.environ.get('CASCADE_MAX_REGION', 0))  # Predicted pixels still short-circuited
+TRIAGE_ENABLED = os.environ.get('TRIAGE_ENABLED', '0') == '1'  # Infer only the slice range containing the gland
+TRIAGE_STRIDE = int(os.environ.get('TRIAGE_STRIDE', 2))  # Every n-th slice goes through the triage pass
+TRIAGE_MARGIN = int(os.environ.get('TRIAGE_MARGIN', 2))  # Slices kept on both sides of the estimated range
+TRIAGE_MIN_PIXELS = int(os.environ.get('TRIAGE_MIN_PIXELS', 20))  # Predicted pixels marking a slice as positive
+TRIAGE_MIN_DEPTH = int(os.environ.get('TRIAGE_MIN_DEPTH', 8))  # Shorter volumes are not triaged
+OVERLAY_SCALE = int(os.environ.get('OVERLAY_SCALE', 2))  # Upscaling factor of the rendered overlays
+POSTPROCESS_MODE = os.environ.get('POSTPROCESS_MODE', '2d')  # Largest component per slice ('2d') or volume ('3d')
+CACHE_MAX_MB = int(os.environ.get('CACHE_MAX_MB', 256))  # In-memory prediction cache size, 0 disables it
+CACHE_DIR = os.environ.get('CACHE_DIR')  # Optional on-disk cache tier that survives restarts
+MAX_REQUEST_SLICES = int(os.environ.get('MAX_REQUEST_SLICES', 2000))  # Slices accepted per request
+MAX_REQUEST_MB = int(os.environ.get('MAX_REQUEST_MB', 2048))  # Decoded float32 volume size accepted per request
+UPLOAD_MEMORY_MB = int(os.environ.get('UPLOAD_MEMORY_MB', 64))  # Larger requests are spooled to a temporary file
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', '1') == '1'  # Budget in-flight /predict work
+ADMISSION_MAX_MB = int(os.environ.get('ADMISSION_MAX_MB', 4096))  # Estimated memory of all admitted requests
+ADMISSION_MAX_SLICES = int(os.environ.get('ADMISSION_MAX_SLICES', 4000))  # Slices of all admitted requests
+ADMISSION_MAX_WAITING = int(os.environ.get('ADMISSION_MAX_WAITING', 8))  # Requests queued for capacity before 429
+ADMISSION_MAX_WAIT = float(os.environ.get('ADMISSION_MAX_WAIT', 10))  # Seconds a request may wait before 429
+ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', 2))  # Retry-After of 429 responses
+STUDY_TTL = int(os.environ.get('STUDY_TTL', 900))  # Seconds a stored study (?store=1) is kept after its last access
+STUDY_STORE_MB = int(os.environ.get('STUDY_STORE_MB', 512))  # In-memory size of the stored studies
+STUDY_DIR = os.environ.get('STUDY_DIR')  # Optional disk tier, lets every pre-fork worker serve every study
+TILE_CACHE_MB = int(os.environ.get('TILE_CACHE_MB', 128))  # Rendered slice overlays kept in memory
+TILE_MAX_SCALE = int(os.environ.get('TILE_MAX_SCALE', 8))  # Largest ?scale of a slice request
+TILE_MAX_RANGE = int(os.environ.get('TILE_MAX_RANGE', 32))  # Slices returned by one range request
+TILE_PREFETCH = int(os.environ.get('TILE_PREFETCH', 2))  # Neighbours rendered ahead on each side by default
+TILE_PREFETCH_MAX = 8  # Largest ?prefetch of a slice request
+TILE_PREFETCH_WORKERS = int(os.environ.get('TILE_PREFETCH_WORKERS', 2))  # Threads rendering prefetched slices
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 1))  # Inference workers for the /jobs API
+JOB_MAX_QUEUED = int(os.environ.get('JOB_MAX_QUEUED', 16))  # Pending + running jobs before rejecting
+JOB_TTL = int(os.environ.get('JOB_TTL', 600))  # Seconds finished jobs are kept
+JOB_MAX_WAIT = 30  # Longest allowed long-poll, in seconds
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'  # Stage timers and the /metrics endpoint
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'  # Add a Server-Timing header to responses
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', '0') == '1'  # Batch slices across concurrent requests
+SCHEDULER_MAX_WAIT_MS = float(os.environ.get('SCHEDULER_MAX_WAIT_MS', 5))  # Max wait for a batch to fill
+PIPELINE_ENABLED = os.environ.get('PIPELINE_ENABLED', '0') == '1'  # Overlap decode/preprocess/infer/render
+PIPELINE = PipelineConfig(
+    decode_workers=int(os.environ.get('PIPELINE_DECODE_WORKERS', 2)),
+    preprocess_workers=int(os.environ.get('PIPELINE_PREPROCESS_WORKERS', 2)),
+    infer_workers=int(os.environ.get('PIPELINE_INFER_WORKERS', 1)),
+    render_workers=int(os.environ.get('PIPELINE_RENDER_WORKERS', 2)),
+    queue_size=int(os.environ.get('PIPELINE_QUEUE_SIZE', 4)),
+) if PIPELINE_ENABLED else None
 
 app = Flask('prostate_segmentation_server')
+app.request_class = UploadRequest  # Uploads pixel_view can map without copying
+UploadRequest.max_memory = UPLOAD_MEMORY_MB * 1024 * 1024
 logging.basicConfig(level=logging.INFO)
+REGISTRY.enabled = METRICS_ENABLED
+
+def load_models():
+    # The cascade needs the members separately, so it takes precedence over fusing
+    models = load_ensemble(fused=FUSED_ENSEMBLE and not CASCADE_ENABLED, backend=INFERENCE_BACKEND,
+                           quantization=TFLITE_QUANTIZATION, num_threads=TFLITE_THREADS, parallel=PARALLEL_LOADING)
+    if CASCADE_ENABLED and models:
+        return CascadeEnsemble(models, band=CASCADE_BAND, max_uncertain_fraction=CASCADE_MAX_UNCERTAIN,
+                               max_region_pixels=CASCADE_MAX_REGION)
+    return models
+
+def triage_models(models):
+    # The triage pass runs the cheapest member alone, or the engine when members are not reachable
+    members = getattr(models, 'members', models)
+    if isinstance(members, (list, tuple)) and members:
+        return [min(members, key=member_cost)]
+    return None
+
+def cache_namespace(models, triage=None):
+    # Predictions are keyed by pixel data, model set and preprocessing parameters
+    namespace = model_fingerprint(backend_paths(INFERENCE_BACKEND, TFLITE_QUANTIZATION))
+    if isinstance(models, CascadeEnsemble):
+        namespace += ":" + models.signature
+    if triage is not None:
+        namespace += ":" + triage.signature
+    return namespace
+
+# Set up by initialize(): the ensemble (array of models), the engine requests run on
+# (the shared scheduler when enabled, otherwise the models), the triage and the cache
+model = None
+scheduler = None
+engine = None
+triage = None
+cache = None
+
+# Startup progress reported by /ready; requests needing the models wait for models_ready
+startup = {"status": "loading", "error": None, "load_seconds": None, "warmup_seconds": None}
+models_ready = threading.Event()
+
+def initialize():
+    """
+    Load the ensemble, build the engine around it and warm it up on a dummy
+    batch of every WARMUP_BATCH_SIZES size, then mark the server ready.
+    """
+    global model, scheduler, engine, triage, cache
+    start = time.perf_counter()
+    loaded = load_models()
+    if not loaded:
+        startup.update(status="failed", error="No ensemble member could be loaded")
+        print(bcolors.FAIL + "[Startup] No ensemble member could be loaded" + bcolors.ENDC)
+        return
+    startup["load_seconds"] = round(time.perf_counter() - start, 3)
+
+    model = loaded
+    if SCHEDULER_ENABLED:
+        scheduler = InferenceScheduler(lambda batch: ensemble_predict_batch(model, batch, PREDICT_BATCH_SIZE),
+                                       max_batch_size=PREDICT_BATCH_SIZE, max_wait_ms=SCHEDULER_MAX_WAIT_MS,
+                                       batch_sizes=WARMUP_BATCH_SIZES)
+    engine = scheduler if scheduler is not None else model
+
+    if TRIAGE_ENABLED:
+        triage = SliceTriage(triage_models(model), stride=TRIAGE_STRIDE, margin=TRIAGE_MARGIN,
+                             min_pixels=TRIAGE_MIN_PIXELS, min_depth=TRIAGE_MIN_DEPTH)
 
-# Load the ensemble models (array of models)
-model = load_ensemble()
+    if CACHE_MAX_MB > 0 or CACHE_DIR:
+        cache = PredictionCache(max_bytes=CACHE_MAX_MB * 1024 * 1024, disk_dir=CACHE_DIR,
+                                namespace=cache_namespace(model, triage))
+
+    # The cascade may not reach its later members on dummy input, so warm them one by one
+    startup["status"] = "warming"
+    start = time.perf_counter()
+    warm_up(model.members if isinstance(model, CascadeEnsemble) else model, WARMUP_BATCH_SIZES, PREDICT_BATCH_SIZE)
+    startup["warmup_seconds"] = round(time.perf_counter() - start, 3)
+
+    startup["status"] = "ready"
+    models_ready.set()
+    print(bcolors.OKGREEN + f"[Startup] Models loaded in {startup['load_seconds']}s, "
+          f"warmed up in {startup['warmup_seconds']}s" + bcolors.ENDC)
+
+def initialize_in_background():
+    try:
+        initialize()
+    except Exception as e:
+        startup.update(status="failed", error=str(e))
+        print(bcolors.FAIL + f"[Startup] Loading the models failed: {e}" + bcolors.ENDC)
+
+if BACKGROUND_LOADING:
+    threading.Thread(target=initialize_in_background, name="model-loader", daemon=True).start()
+else:
+    initialize()
+
+def request_engine():
+    """
+    Models for one request: a per-request view of the cascade, so the slices it
+    short-circuited can be reported, otherwise the shared engine.
+    """
+    if isinstance(engine, CascadeEnsemble):
+        return engine.track()
+    return engine
+
+def request_triage():
+    # Per-request view of the triage, so the slices it skipped can be reported
+    return triage.track() if triage is not None else None
+
+def usage_report(models, slice_triage):
+    # Extra response fields describing the cascade's and triage's work on this request
+    report = {}
+    if isinstance(models, TrackedCascade):
+        report["cascade"] = models.usage.to_dict()
+    if slice_triage is not None:
+        report["triage"] = slice_triage.usage.to_dict()
+    return report
+
+def run_job(job):
+    # Executed by a job worker, reports progress slice by slice
+    job.update(slices_total=count_slices(job.files))
+    models = request_engine()
+    job_triage = request_triage()
+    results = []
+    for result in iter_predictions(job.files, models, max_batch_size=PREDICT_BATCH_SIZE,
+                                   scale_factor=OVERLAY_SCALE, cache=cache, pipeline=PIPELINE,
+                                   postprocess=POSTPROCESS_MODE, triage=job_triage):
+        results.append(result)
+        job.update(slices_done=len(results))
+    # The pipelined path yields files in completion order
+    results.sort(key=lambda r: (r["file_index"], r["slice_index"]))
+    return {"overlays": [r["overlay"] for r in results], **usage_report(models, job_triage)}
+
+jobs = JobManager(run_job, workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED, ttl=JOB_TTL)
+
+# The budget is per process: serve.py splits it between its workers
+admission = None
+if ADMISSION_ENABLED:
+    admission = AdmissionController(ADMISSION_MAX_MB * 1024 * 1024, ADMISSION_MAX_SLICES,
+                                    max_waiting=ADMISSION_MAX_WAITING, max_wait=ADMISSION_MAX_WAIT,
+                                    retry_after=ADMISSION_RETRY_AFTER)
+
+studies = StudyStore(ttl=STUDY_TTL, max_bytes=STUDY_STORE_MB * 1024 * 1024, disk_dir=STUDY_DIR)
+tiles = TileCache(max_bytes=TILE_CACHE_MB * 1024 * 1024)
+prefetcher = ThreadPoolExecutor(max_workers=TILE_PREFETCH_WORKERS, thread_name_prefix="tile-prefetch")
+prefetching = set()  # Tiles queued on the prefetcher
+prefetch_lock = threading.Lock()
+
+def collect_stats():
+    """
+    Cache, scheduler, job, cascade and triage statistics for /metrics,
+    read when the endpoint is scraped.
+    """
+    metrics = []
+    if cache is not None:
+        stats = cache.stats()
+        metrics.append(("segmentation_cache_lookups_total", "counter", "Prediction cache lookups by result.",
+                        {(("result", result),): stats[key] for result, key in
+                         (("hit", "hits"), ("disk_hit", "disk_hits"), ("miss", "misses"))}))
+        metrics.append(("segmentation_cache_evictions_total", "counter", "Prediction cache evictions.",
+                        {(): stats["evictions"]}))
+        metrics.append(("segmentation_cache_bytes", "gauge", "Size of the in-memory prediction cache.",
+                        {(): stats["bytes"]}))
+    if scheduler is not None:
+        stats = scheduler.stats()
+        metrics.append(("segmentation_scheduler_batches_total", "counter", "Batches run by the scheduler.",
+                        {(): stats["batches"]}))
+        metrics.append(("segmentation_scheduler_queued", "gauge", "Chunks waiting for the scheduler.",
+                        {(): stats["queued"]}))
+    metrics.append(("segmentation_jobs", "gauge", "Background jobs by status.",
+                    {(("status", status),): count for status, count in jobs.stats()["jobs"].items()}))
+    if isinstance(model, CascadeEnsemble):
+        stats = model.usage.to_dict()
+        metrics.append(("segmentation_cascade_slices_total", "counter", "Slices seen by the cascade by path.",
+                        {(("path", "short_circuit"),): stats["short_circuited"],
+                         (("path", "ensemble"),): stats["ensemble_slices"]}))
+    if triage is not None:
+        stats = triage.usage.to_dict()
+        metrics.append(("segmentation_triage_skipped_slices_total", "counter", "Slices skipped by the triage.",
+                        {(): stats["skipped_slices"]}))
+    if admission is not None:
+        stats = admission.stats()
+        metrics.append(("segmentation_admission_in_flight_bytes", "gauge",
+                        "Estimated memory of the admitted /predict requests.", {(): stats["in_flight_bytes"]}))
+        metrics.append(("segmentation_admission_in_flight_slices", "gauge",
+                        "Slices of the admitted /predict requests.", {(): stats["in_flight_slices"]}))
+        metrics.append(("segmentation_admission_waiting", "gauge", "Requests waiting for capacity.",
+                        {(): stats["waiting"]}))
+        metrics.append(("segmentation_admission_rejected_total", "counter", "Requests rejected by status code.",
+                        {(("status", status),): count for status, count in stats["rejected"].items()}))
+    stats = studies.stats()
+    metrics.append(("segmentation_studies_stored", "gauge", "Studies held in memory for slice requests.",
+                    {(): stats["studies"]}))
+    metrics.append(("segmentation_studies_bytes", "gauge", "Memory of the stored studies.", {(): stats["bytes"]}))
+    stats = tiles.stats()
+    metrics.append(("segmentation_tile_lookups_total", "counter", "Rendered slice cache lookups by result.",
+                    {(("result", "hit"),): stats["hits"], (("result", "miss"),): stats["misses"]}))
+    metrics.append(("segmentation_tile_cache_bytes", "gauge", "Size of the rendered slice cache.",
+                    {(): stats["bytes"]}))
+    return metrics
+
+REGISTRY.add_collector(collect_stats)
 
 # Simple HTML template for server status page
 STATUS_PAGE = load_status_page()
@@ -46,6 +341,57 @@ CORS(app)
 #            app.logger.warning("Unauthorized access attempt.")
 #            abort(401, description="Unauthorized: Invalid API key")
 
+@app.before_request
+def start_request_timing():
+    # Clients may pass their own X-Request-ID to correlate logs
+    begin_request(request.headers.get('X-Request-ID'))
+
+@app.after_request
+def finish_request_timing(response):
+    timing = current_request()
+    if timing is None:
+        return response
+    endpoint = request.endpoint or "unknown"
+    if METRICS_ENABLED:
+        REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+        REQUEST_SECONDS.observe(time.perf_counter() - timing.start, endpoint=endpoint)
+    response.headers['X-Request-ID'] = timing.id
+    # Streamed bodies are produced after the headers are sent
+    if SERVER_TIMING and not response.is_streamed:
+        response.headers['Server-Timing'] = timing.server_timing()
+    end_request()
+    return response
+
+@app.route("/metrics")
+def metrics():
+    # Prometheus text exposition format
+    if not METRICS_ENABLED:
+        return jsonify({"enabled": False}), 404
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route("/health")
+def health():
+    # Liveness: the process is serving, unless loading the models failed for good
+    if startup["status"] == "failed":
+        return jsonify({"status": "failed", "error": startup["error"]}), 500
+    return jsonify({"status": "ok"}), 200
+
+@app.route("/ready")
+def ready():
+    # Readiness: the models are loaded and warmed up
+    return jsonify({"ready": models_ready.is_set(), **startup}), 200 if models_ready.is_set() else 503
+
+def not_ready():
+    """
+    503 response for requests that need the models while they are loading,
+    None once the server is ready.
+    """
+    if models_ready.is_set():
+        return None
+    response = jsonify({"error": "Models are not ready", "status": startup["status"]})
+    response.headers['Retry-After'] = str(READY_RETRY_AFTER)
+    return response, 503
+
 @app.route("/")
 def index():
     # A cute page which says the status of the server
@@ -57,6 +403,10 @@ def index():
 
 @app.route("/predict", methods=["POST"])
 def predict_segmentation():
+    unavailable = not_ready()
+    if unavailable is not None:
+        return unavailable
+
     if 'files' not in request.files:
         return jsonify({"error": "No image files uploaded"}), 400
 
@@ -64,26 +414,537 @@ def predict_segmentation():
     if len(files) == 0:
         return jsonify({"error": "No files selected"}), 400
 
-    print(bcolors.OKBLUE + f"Received {len(files)} files" + bcolors.ENDC)
+    print(bcolors.OKBLUE + f"[{current_request().id}] Received {len(files)} files" + bcolors.ENDC)
+
+    # Compact masks (?format=rle|bitpack) instead of rendered overlays
+    mask_format = request.args.get('format', 'png').lower()
+    if mask_format not in MASK_FORMATS and mask_format != 'png':
+        return jsonify({"error": f"Unknown format '{mask_format}'"}), 400
+
+    # With ?store=1 nothing is rendered until the viewer requests a slice
+    slices, decoded_bytes, cost = upload_cost(files, overlays=mask_format == 'png' and not wants_store())
+    rejected = budget_exceeded(slices, decoded_bytes)
+    if rejected is not None:
+        return rejected
+
+    # Reserved before zipped series are expanded, their members were counted from the archive
+    ticket, rejected = admit(slices, cost)
+    if rejected is not None:
+        return rejected
+
+    # Zipped series or ?group=series: instances are assembled into one volume per series
+    if wants_series(files):
+        return run_admitted(ticket, series_predictions, files, mask_format)
+    return run_admitted(ticket, dispatch_prediction, files, mask_format)
+
+def dispatch_prediction(files, mask_format):
+    if wants_store():
+        return stored_predictions(files)
+    if wants_stream():
+        return stream_predictions(files)
+    if mask_format in MASK_FORMATS:
+        return compact_predictions(files, mask_format)
 
     # Get the prediction from the ensemble model
+    models = request_engine()
+    predict_triage = request_triage()
     try:
-        overlays = get_prediction(files, model)
+        overlays = get_prediction(files, models, max_batch_size=PREDICT_BATCH_SIZE,
+                                  scale_factor=OVERLAY_SCALE, cache=cache, pipeline=PIPELINE,
+                                  postprocess=POSTPROCESS_MODE, triage=predict_triage)
     except Exception as e:
         print(bcolors.FAIL + f"Prediction failed: {e}" + bcolors.ENDC)
         return jsonify({"error": "Prediction failed"}), 500
 
-    print(bcolors.OKGREEN + f"Prediction completed" + bcolors.ENDC)
+    print(bcolors.OKGREEN + f"[{current_request().id}] Prediction completed" + bcolors.ENDC)
+
+    return jsonify({"overlays": overlays, **usage_report(models, predict_triage)}), 200
+
+def admit(slices, cost):
+    """
+    Wait for the request's share of the admission budget.
+    Returns (ticket, None), or (None, 413/429 response) when it is rejected.
+    """
+    if admission is None:
+        return None, None
+    try:
+        return admission.acquire(cost, slices), None
+    except AdmissionRejected as e:
+        print(bcolors.WARNING + f"[{current_request().id}] Not admitted ({e.status}): {e.reason}, "
+              f"{slices} slices, {cost // (1024 * 1024)} MB" + bcolors.ENDC)
+        response = jsonify({"error": e.reason, "slices": slices, "estimated_mb": cost // (1024 * 1024),
+                            "max_mb": ADMISSION_MAX_MB, "max_slices": ADMISSION_MAX_SLICES})
+        if e.retry_after is not None:
+            response.headers['Retry-After'] = str(e.retry_after)
+        return None, (response, e.status)
+
+def run_admitted(ticket, view, *args):
+    """
+    Run view(*args) holding ticket until the response is closed, so
+    streamed responses keep their share until the last line is sent.
+    """
+    if ticket is None:
+        return view(*args)
+    try:
+        response = make_response(view(*args))
+    except BaseException:
+        ticket.release()
+        raise
+    response.call_on_close(ticket.release)
+    return response
+
+def upload_cost(files, overlays=True):
+    """
+    (slices, decoded bytes, estimated peak memory) of the DICOM uploads and
+    the members of zipped series, read from their headers only.
+    """
+    slices = 0
+    decoded_bytes = 0
+    cost = 0
+    for header in upload_headers(files):
+        slices += header.frames
+        decoded_bytes += header.decoded_bytes
+        cost += estimate_cost(header.frames, header.rows, header.columns, OVERLAY_SCALE, overlays)
+    return slices, decoded_bytes, cost
+
+def check_upload_budget(files):
+    """
+    Reject uploads whose headers describe more slices or decoded data than
+    allowed, before any pixel data is decoded. Returns an error response or None.
+    """
+    slices, decoded_bytes, _ = upload_cost(files)
+    return budget_exceeded(slices, decoded_bytes)
+
+def budget_exceeded(slices, decoded_bytes):
+    """
+    413 response when slices or decoded_bytes exceed the request limits, else None.
+    """
+    if slices > MAX_REQUEST_SLICES or decoded_bytes > MAX_REQUEST_MB * 1024 * 1024:
+        print(bcolors.WARNING + f"Upload rejected: {slices} slices, {decoded_bytes // (1024 * 1024)} MB" + bcolors.ENDC)
+        return jsonify({
+            "error": "Upload too large",
+            "slices": slices,
+            "max_slices": MAX_REQUEST_SLICES,
+            "max_mb": MAX_REQUEST_MB,
+        }), 413
+    return None
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    unavailable = not_ready()
+    if unavailable is not None:
+        return unavailable
+
+    if 'files' not in request.files:
+        return jsonify({"error": "No image files uploaded"}), 400
+
+    files = request.files.getlist('files')
+    if len(files) == 0:
+        return jsonify({"error": "No files selected"}), 400
+
+    rejected = check_upload_budget(files)
+    if rejected is not None:
+        return rejected
+
+    # Uploads are buffered because the request ends before the job runs
+    try:
+        job = jobs.submit([BufferedUpload.from_storage(f) for f in files])
+    except QueueFullError as e:
+        print(bcolors.WARNING + f"Job rejected: {e}" + bcolors.ENDC)
+        return jsonify({"error": "Too many queued jobs, retry later"}), 503
+
+    print(bcolors.OKBLUE + f"Queued job {job.id} with {len(files)} files" + bcolors.ENDC)
+    return jsonify(job.to_dict()), 202
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    # Long-poll: ?wait=<seconds> blocks until the job progresses
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = math.nan
+    if math.isnan(wait):
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+    wait = min(max(wait, 0.0), JOB_MAX_WAIT)
+    if wait > 0:
+        job.wait(wait)
+    return jsonify(job.to_dict()), 200
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if job.status == job.FAILED:
+        return jsonify({"error": "Prediction failed"}), 500
+    if job.status != job.DONE:
+        return jsonify(job.to_dict()), 202
+    return jsonify(job.result), 200
+
+@app.route("/cache/stats")
+def cache_stats():
+    # Hit/miss/eviction counters of the prediction cache
+    if cache is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, **cache.stats()}), 200
+
+@app.route("/scheduler/stats")
+def scheduler_stats():
+    # Batch-size and queue-wait statistics of the micro-batching scheduler
+    if scheduler is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, **scheduler.stats()}), 200
+
+@app.route("/triage/stats")
+def triage_stats():
+    # Slices skipped by the triage pass since startup
+    if triage is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, **triage.usage.to_dict()}), 200
+
+@app.route("/admission/stats")
+def admission_stats():
+    # Budget held by the /predict requests in flight and the rejections since startup
+    if admission is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, **admission.stats()}), 200
+
+@app.route("/cascade/stats")
+def cascade_stats():
+    # Slices answered by the first member alone since startup
+    if not isinstance(model, CascadeEnsemble):
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, **model.usage.to_dict()}), 200
+
+def compact_predictions(files, mask_format):
+    """
+    Return encoded masks with shape/spacing metadata and, unless ?images=0,
+    the window-leveled slices once per study.
+    """
+    include_images = request.args.get('images', '1') != '0'
+    models = request_engine()
+    predict_triage = request_triage()
+    try:
+        studies = get_compact_prediction(files, models, max_batch_size=PREDICT_BATCH_SIZE,
+                                         mask_format=mask_format, include_images=include_images,
+                                         cache=cache, postprocess=POSTPROCESS_MODE, triage=predict_triage)
+    except Exception as e:
+        print(bcolors.FAIL + f"Prediction failed: {e}" + bcolors.ENDC)
+        return jsonify({"error": "Prediction failed"}), 500
+
+    print(bcolors.OKGREEN + f"Prediction completed ({mask_format})" + bcolors.ENDC)
+    return jsonify({"format": mask_format, "studies": studies, **usage_report(models, predict_triage)}), 200
+
+def wants_series(files):
+    return (request.args.get('group', '').lower() == 'series'
+            or any(is_archive(file) for file in files))
+
+def series_predictions(files, mask_format='png'):
+    """
+    Expand zip archives, group the instances by series and predict every
+    series as one volume. Runs admitted on the estimate of upload_cost, the
+    request limits are checked again on the expanded instances.
+    Streaming, compact formats and ?store=1 work as for single files.
+    """
+    if wants_stream():
+        # Uploads are closed when the view returns, before the stream is consumed
+        files = [f if isinstance(f, BufferedUpload) else BufferedUpload.from_storage(f) for f in files]
+    try:
+        instances = expand_uploads(files, max_bytes=MAX_REQUEST_MB * 1024 * 1024)
+    except ArchiveTooLargeError as e:
+        print(bcolors.WARNING + f"Upload rejected: {e}" + bcolors.ENDC)
+        return jsonify({"error": "Upload too large", "max_mb": MAX_REQUEST_MB}), 413
+    except zipfile.BadZipFile as e:
+        return jsonify({"error": f"Invalid archive: {e}"}), 400
+
+    series_list = group_series(instances)
+    rejected = budget_exceeded(sum(len(series) for series in series_list),
+                               sum(series.decoded_bytes for series in series_list))
+    if rejected is not None:
+        return rejected
+    print(bcolors.OKBLUE + f"[{current_request().id}] Grouped {len(instances)} instances into "
+          f"{len(series_list)} series" + bcolors.ENDC)
+    return dispatch_series(series_list, mask_format)
+
+def dispatch_series(series_list, mask_format):
+    if wants_store():
+        return store_series(series_list)
+    if wants_stream():
+        return stream_series(series_list)
+    if mask_format in MASK_FORMATS:
+        return compact_series(series_list, mask_format)
+    return predict_series(series_list)
+
+def predict_series(series_list):
+    models = request_engine()
+    predict_triage = request_triage()
+    try:
+        results = get_series_prediction(series_list, models, max_batch_size=PREDICT_BATCH_SIZE,
+                                        scale_factor=OVERLAY_SCALE, cache=cache, postprocess=POSTPROCESS_MODE,
+                                        triage=predict_triage)
+    except Exception as e:
+        print(bcolors.FAIL + f"Prediction failed: {e}" + bcolors.ENDC)
+        return jsonify({"error": "Prediction failed"}), 500
+
+    print(bcolors.OKGREEN + f"[{current_request().id}] Prediction completed" + bcolors.ENDC)
+    return jsonify({"series": results, **usage_report(models, predict_triage)}), 200
+
+def compact_series(series_list, mask_format):
+    # compact_predictions for grouped series
+    include_images = request.args.get('images', '1') != '0'
+    models = request_engine()
+    predict_triage = request_triage()
+    try:
+        results = get_compact_series_prediction(series_list, models, max_batch_size=PREDICT_BATCH_SIZE,
+                                                mask_format=mask_format, include_images=include_images,
+                                                cache=cache, postprocess=POSTPROCESS_MODE, triage=predict_triage)
+    except Exception as e:
+        print(bcolors.FAIL + f"Prediction failed: {e}" + bcolors.ENDC)
+        return jsonify({"error": "Prediction failed"}), 500
+
+    print(bcolors.OKGREEN + f"[{current_request().id}] Prediction completed ({mask_format})" + bcolors.ENDC)
+    return jsonify({"format": mask_format, "series": results, **usage_report(models, predict_triage)}), 200
+
+def stream_series(series_list):
+    # stream_predictions for grouped series, one NDJSON line per slice
+    def generate():
+        count = 0
+        models = request_engine()
+        stream_triage = request_triage()
+        try:
+            for result in iter_series_predictions(series_list, models, max_batch_size=PREDICT_BATCH_SIZE,
+                                                  scale_factor=OVERLAY_SCALE, cache=cache,
+                                                  postprocess=POSTPROCESS_MODE, triage=stream_triage):
+                count += 1
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            print(bcolors.FAIL + f"Prediction failed: {e}" + bcolors.ENDC)
+            yield json.dumps({"error": "Prediction failed"}) + "\n"
+            return
+        print(bcolors.OKGREEN + f"Prediction completed ({count} slices streamed)" + bcolors.ENDC)
+        yield json.dumps({"done": True, "count": count, **usage_report(models, stream_triage)}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def wants_store():
+    return request.args.get('store', '').lower() in ('1', 'true')
+
+def stored_predictions(files):
+    """
+    Predict without rendering and keep every study in the study store; the
+    response only lists the study ids, overlays are fetched per slice from
+    /studies/<id>/slices.
+    """
+    models = request_engine()
+    predict_triage = request_triage()
+    try:
+        stored = [studies.put(display, masks, file=filename, file_index=file_idx)
+                  for file_idx, filename, display, masks in sorted(
+                      iter_studies(files, models, PREDICT_BATCH_SIZE, cache=cache, postprocess=POSTPROCESS_MODE,
+                                   triage=predict_triage), key=lambda item: item[0])]
+    except Exception as e:
+        print(bcolors.FAIL + f"Prediction failed: {e}" + bcolors.ENDC)
+        return jsonify({"error": "Prediction failed"}), 500
+
+    print(bcolors.OKGREEN + f"[{current_request().id}] Prediction completed, stored {len(stored)} studies" + bcolors.ENDC)
+    return jsonify({"studies": [study_summary(study) for study in stored], **usage_report(models, predict_triage)}), 200
+
+def store_series(series_list):
+    # ?store=1 counterpart of predict_series
+    models = request_engine()
+    predict_triage = request_triage()
+    try:
+        stored = [studies.put(display, masks, series_index=series_idx, series_uid=series.uid,
+                              description=series.description)
+                  for series_idx, series, display, masks in sorted(
+                      iter_series(series_list, models, PREDICT_BATCH_SIZE, cache, POSTPROCESS_MODE, predict_triage),
+                      key=lambda item: item[0])]
+    except Exception as e:
+        print(bcolors.FAIL + f"Prediction failed: {e}" + bcolors.ENDC)
+        return jsonify({"error": "Prediction failed"}), 500
+
+    print(bcolors.OKGREEN + f"[{current_request().id}] Prediction completed, stored {len(stored)} series" + bcolors.ENDC)
+    return jsonify({"studies": [study_summary(study) for study in stored], **usage_report(models, predict_triage)}), 200
+
+def study_summary(study):
+    return {**study.to_dict(STUDY_TTL), "slices_url": url_for('study_slices', study_id=study.id)}
+
+def unknown_study():
+    return jsonify({"error": "Unknown or expired study"}), 404
+
+def tile_params():
+    """
+    (scale, image format, None) of a slice request, or (None, None, 400 response).
+    """
+    try:
+        scale = int(request.args.get('scale', OVERLAY_SCALE))
+    except ValueError:
+        scale = 0
+    if not 1 <= scale <= TILE_MAX_SCALE:
+        return None, None, (jsonify({"error": f"scale must be between 1 and {TILE_MAX_SCALE}"}), 400)
+    image_format = request.args.get('format', 'png').lower()
+    if image_format == 'jpg':
+        image_format = 'jpeg'
+    if image_format not in IMAGE_FORMATS:
+        return None, None, (jsonify({"error": f"Unknown format '{image_format}'"}), 400)
+    return scale, image_format, None
+
+def render_tile(study, slice_index, scale, image_format):
+    """
+    Encoded overlay of one slice from the tile cache, rendered on first access.
+    Returns (bytes, cache hit).
+    """
+    key = (study.id, slice_index, scale, image_format)
+    data = tiles.get(key)
+    if data is not None:
+        return data, True
+    data = render_slice(study.display[slice_index], study.masks[slice_index], scale, image_format)
+    tiles.put(key, data)
+    return data, False
+
+def prefetch_tiles(study, slice_index, radius, scale, image_format):
+    """
+    Queue the neighbours of a slice for rendering in the background, nearest
+    first and the next slice before the previous one. Returns their indices.
+    """
+    neighbours = [idx for offset in range(1, radius + 1) for idx in (slice_index + offset, slice_index - offset)
+                  if 0 <= idx < len(study)]
+    for idx in neighbours:
+        key = (study.id, idx, scale, image_format)
+        with prefetch_lock:
+            if key in prefetching or key in tiles:
+                continue
+            prefetching.add(key)
+        prefetcher.submit(prefetch_tile, study, idx, scale, image_format, key)
+    return neighbours
+
+def prefetch_tile(study, slice_index, scale, image_format, key):
+    # Runs on the prefetcher; bypasses tiles.get so the hit rate reflects the viewer's requests
+    try:
+        tiles.put(key, render_slice(study.display[slice_index], study.masks[slice_index], scale, image_format))
+    except Exception as e:
+        print(bcolors.WARNING + f"[Studies] Prefetching slice {slice_index} of {study.id} failed: {e}" + bcolors.ENDC)
+    finally:
+        with prefetch_lock:
+            prefetching.discard(key)
+
+@app.route("/studies/stats")
+def study_stats():
+    # Stored studies and the rendered slice cache
+    return jsonify({"store": studies.stats(), "tiles": tiles.stats()}), 200
+
+@app.route("/studies/<study_id>", methods=["GET", "DELETE"])
+def study_info(study_id):
+    if request.method == "DELETE":
+        if not studies.delete(study_id):
+            return unknown_study()
+        tiles.discard(study_id)
+        return jsonify({"deleted": study_id}), 200
+
+    study = studies.get(study_id)
+    if study is None:
+        return unknown_study()
+    return jsonify(study_summary(study)), 200
+
+@app.route("/studies/<study_id>/slices/<int:slice_index>")
+def study_slice(study_id, slice_index):
+    """
+    Overlay of one slice as an image, ?scale=<1..TILE_MAX_SCALE>&format=png|jpeg|webp.
+    ?prefetch=<n> renders the n slices on each side in the background and
+    lists them in a 'Link: rel=prefetch' header.
+    """
+    study = studies.get(study_id)
+    if study is None:
+        return unknown_study()
+    if slice_index >= len(study):
+        return jsonify({"error": "Slice out of range", "slices": len(study)}), 404
+    scale, image_format, error = tile_params()
+    if error is not None:
+        return error
+    try:
+        radius = min(max(int(request.args.get('prefetch', TILE_PREFETCH)), 0), TILE_PREFETCH_MAX)
+    except ValueError:
+        return jsonify({"error": "prefetch must be an integer"}), 400
+
+    data, hit = render_tile(study, slice_index, scale, image_format)
+    response = Response(data, mimetype=IMAGE_FORMATS[image_format][1])
+    # The overlay of a study id never changes, only expires
+    response.headers['Cache-Control'] = f"private, max-age={STUDY_TTL}"
+    response.headers['X-Tile-Cache'] = "hit" if hit else "miss"
+    neighbours = prefetch_tiles(study, slice_index, radius, scale, image_format)
+    if neighbours:
+        response.headers['Link'] = ", ".join(
+            f"<{url_for('study_slice', study_id=study_id, slice_index=idx, scale=scale, format=image_format)}>; "
+            f"rel=prefetch" for idx in neighbours)
+    return response
+
+@app.route("/studies/<study_id>/slices")
+def study_slices(study_id):
+    """
+    Overlays of the slices [start, end) as base64 data URIs, at most
+    TILE_MAX_RANGE per request.
+    """
+    study = studies.get(study_id)
+    if study is None:
+        return unknown_study()
+    scale, image_format, error = tile_params()
+    if error is not None:
+        return error
+    try:
+        start = int(request.args.get('start', 0))
+        end = int(request.args.get('end', min(len(study), start + TILE_MAX_RANGE)))
+    except ValueError:
+        return jsonify({"error": "start and end must be integers"}), 400
+    if not 0 <= start < end <= len(study) or end - start > TILE_MAX_RANGE:
+        return jsonify({"error": "Invalid slice range", "slices": len(study), "max_range": TILE_MAX_RANGE}), 400
+
+    prefix = f"data:{IMAGE_FORMATS[image_format][1]};base64,"
+    overlays = [{
+        "slice_index": idx,
+        "overlay": prefix + base64.b64encode(render_tile(study, idx, scale, image_format)[0]).decode('utf-8'),
+    } for idx in range(start, end)]
+    return jsonify({"study_id": study_id, "start": start, "end": end, "scale": scale, "format": image_format,
+                    "slices": overlays}), 200
+
+def wants_stream():
+    """
+    Streaming is negotiated with ?stream=1 or an 'Accept: application/x-ndjson' header.
+    """
+    if request.args.get('stream', '').lower() in ('1', 'true', 'ndjson'):
+        return True
+    return 'application/x-ndjson' in request.headers.get('Accept', '')
 
-    # Upscale the overlays by a factor of 4
-    print(bcolors.OKBLUE + f"Upscaling overlays" + bcolors.ENDC)
+def stream_predictions(files):
+    """
+    Emit one NDJSON line per slice as soon as it is ready, followed by a final
+    summary line. Errors raised mid-stream are reported as an 'error' line.
+    """
+    # Uploads are closed when the view returns, before the stream is consumed
+    files = [BufferedUpload.from_storage(f) for f in files]
 
-    upscaled_list = upscale_overlays(overlays, scale_factor=2)
+    def generate():
+        count = 0
+        models = request_engine()
+        stream_triage = request_triage()
+        try:
+            for result in iter_predictions(files, models, max_batch_size=PREDICT_BATCH_SIZE,
+                                           scale_factor=OVERLAY_SCALE, cache=cache, pipeline=PIPELINE,
+                                           postprocess=POSTPROCESS_MODE, triage=stream_triage):
+                count += 1
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            print(bcolors.FAIL + f"Prediction failed: {e}" + bcolors.ENDC)
+            yield json.dumps({"error": "Prediction failed"}) + "\n"
+            return
+        print(bcolors.OKGREEN + f"Prediction completed ({count} slices streamed)" + bcolors.ENDC)
+        yield json.dumps({"done": True, "count": count, **usage_report(models, stream_triage)}) + "\n"
 
-    print(bcolors.OKGREEN + f"Upscaling completed" + bcolors.ENDC)
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
-    return jsonify({"overlays": upscaled_list}), 200
-    
 # Error handlers
 @app.errorhandler(401)
 def unauthorized(e):
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the prediction path.
+
+Generates synthetic DICOM studies, optionally swaps the ensemble for small
+random-weight models with the same I/O shape, and times every stage
+(header, decode, preprocess, infer, postprocess, display, render) and the
+/predict endpoint end to end through the Flask test client. For each stage it
+reports p50/p95 latency, slices/s, the peak RSS while the stage ran and how
+far it rose above the RSS at the stage's start (Linux, where the high-water
+mark can be reset), and the whole process' peak RSS.
+
+    python bench.py --files 2 --slices 24 --size 256 --output bench.json
+    python bench.py --output new.json --compare bench.json --max-regression 0.15
+
+With --compare, the exit status is 1 when a stage's p50 latency grew by more
+than --max-regression (a fraction) over the baseline results.
+"""
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '1'
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import shutil
+import resource
+import tempfile
+
+import numpy as np
+
+# Stages in pipeline order; 'predict' and 'predict_rle' go through the Flask endpoint
+STAGES = ('header', 'decode', 'preprocess', 'infer', 'postprocess', 'display', 'render', 'predict', 'predict_rle')
+
+def process_peak_rss_mb():
+    # Peak of the whole process so far; ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def reset_peak_rss():
+    """
+    Reset the RSS high-water mark (VmHWM) of this process. Returns False
+    where that is not supported (non-Linux, kernels before 4.0).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def status_mb(field):
+    # VmRSS / VmHWM from /proc/self/status, None when unavailable
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def measure(fn, slices, repeat, warmup):
+    """
+    Time fn() repeat times after warmup untimed calls. The stage's own peak
+    RSS is the high-water mark reset after the warmup calls.
+    """
+    for _ in range(warmup):
+        fn()
+    stage_peak = reset_peak_rss()
+    rss_before = status_mb('VmRSS')
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    durations = np.array(durations)
+    timings = {
+        "runs": repeat,
+        "slices": slices,
+        "p50_ms": round(float(np.percentile(durations, 50)) * 1000, 3),
+        "p95_ms": round(float(np.percentile(durations, 95)) * 1000, 3),
+        "mean_ms": round(float(durations.mean()) * 1000, 3),
+        "slices_per_s": round(slices / float(np.median(durations)), 2),
+    }
+    peak = status_mb('VmHWM') if stage_peak else None
+    return {
+        **timings,
+        "stage_peak_rss_mb": round(peak, 1) if peak is not None else None,
+        "stage_growth_mb": round(peak - rss_before, 1) if peak is not None and rss_before is not None else None,
+        "process_peak_rss_mb": round(process_peak_rss_mb(), 1),
+    }
+
+def compare(results, baseline, max_regression):
+    """
+    Print the p50 change of every stage against a baseline and return the
+    names of the stages that regressed by more than max_regression.
+    """
+    if baseline.get("config") != results["config"]:
+        print("Warning: the baseline was measured with a different configuration")
+    regressions = []
+    print(f"{'stage':<12} {'base p50':>10} {'p50':>10} {'change':>8}")
+    for name, stage in results["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if not base or not base["p50_ms"]:
+            continue
+        change = stage["p50_ms"] / base["p50_ms"] - 1
+        flag = "  REGRESSION" if change > max_regression else ""
+        print(f"{name:<12} {base['p50_ms']:>10.2f} {stage['p50_ms']:>10.2f} {change:>+8.1%}{flag}")
+        if change > max_regression:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the prediction path.")
+    parser.add_argument('--files', type=int, default=2, help="Synthetic studies per request")
+    parser.add_argument('--slices', type=int, default=24, help="Slices per study")
+    parser.add_argument('--size', type=int, default=256, help="Rows and columns of every slice")
+    parser.add_argument('--single-frame', action='store_true', help="One file per slice instead of multi-frame files")
+    parser.add_argument('--models', choices=('stub', 'real'), default='stub',
+                        help="Random-weight stand-ins or the real MODEL_PATHS")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=STAGES)
+    parser.add_argument('--output', default='bench.json', help="Where the results are written")
+    parser.add_argument('--compare', help="Baseline results to check for regressions")
+    parser.add_argument('--max-regression', type=float, default=0.1)
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+
+    # The server reads its configuration at import, measure without the prediction cache
+    os.environ.setdefault('CACHE_MAX_MB', '0')
+    model_dir = None
+    if args.models == 'stub':
+        from utils.ensemble import MODEL_PATHS
+        from utils.synthetic import write_stub_models
+        model_dir = tempfile.mkdtemp(prefix="bench-models-")
+        write_stub_models(model_dir, MODEL_PATHS)
+        os.chdir(model_dir)  # MODEL_PATHS are relative
+    try:
+        return run(args, output, baseline_path)
+    finally:
+        if model_dir is not None:
+            shutil.rmtree(model_dir, ignore_errors=True)
+
+def run(args, output, baseline_path):
+    """
+    Measure the selected stages, write the results and compare them to the baseline.
+    """
+
+    import app as server
+    from utils.synthetic import synthetic_study
+    from utils.ingest import read_header, read_deferred
+    from utils.ensemble import (dataset_to_volume, preprocess_volume_2d, ensemble_predict_batch,
+                                volume_to_display, render_study)
+    from utils.postprocess import postprocess_volume
+
+    studies = [synthetic_study(args.slices, args.size, args.size, multi_frame=not args.single_frame, seed=seed)
+               for seed in range(args.files)]
+    files = [item for study in studies for item in study]
+    total_slices = args.files * args.slices
+
+    # Inputs of every stage, computed once from the previous one
+    volumes = [np.asarray(dataset_to_volume(read_deferred(io.BytesIO(data)))) for _, data in files]
+    batches = [preprocess_volume_2d(volume) for volume in volumes]
+    batch = np.concatenate(batches, axis=0)
+    avg_pred = ensemble_predict_batch(server.model, batch, server.PREDICT_BATCH_SIZE)
+    splits = np.cumsum([len(v) for v in volumes])[:-1]
+    masks = [postprocess_volume(p, mode=server.POSTPROCESS_MODE) for p in np.split(avg_pred, splits)]
+    displays = [volume_to_display(volume) for volume in volumes]
+
+    client = server.app.test_client()
+
+    def post(query=""):
+        data = {'files': [(io.BytesIO(content), name) for name, content in files]}
+        response = client.post('/predict' + query, data=data, content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise RuntimeError(f"/predict{query} returned {response.status_code}")
+
+    stage_fns = {
+        "header": lambda: [read_header(io.BytesIO(data)) for _, data in files],
+        "decode": lambda: [np.asarray(dataset_to_volume(read_deferred(io.BytesIO(data)))) for _, data in files],
+        "preprocess": lambda: [preprocess_volume_2d(volume) for volume in volumes],
+        "infer": lambda: ensemble_predict_batch(server.model, batch, server.PREDICT_BATCH_SIZE),
+        "postprocess": lambda: [postprocess_volume(p, mode=server.POSTPROCESS_MODE) for p in np.split(avg_pred, splits)],
+        "display": lambda: [volume_to_display(volume) for volume in volumes],
+        "render": lambda: [list(render_study(d, m, server.OVERLAY_SCALE)) for d, m in zip(displays, masks)],
+        "predict": lambda: post(),
+        "predict_rle": lambda: post("?format=rle&images=0"),
+    }
+
+    results = {
+        "config": {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "inference_backend": server.INFERENCE_BACKEND,
+            "predict_batch_size": server.PREDICT_BATCH_SIZE,
+        },
+        "stages": {},
+    }
+    print(f"{'stage':<12} {'p50 ms':>10} {'p95 ms':>10} {'slices/s':>10} {'stage MB':>9} {'growth MB':>10} "
+          f"{'process MB':>11}")
+    for name in args.stages:
+        stage = measure(stage_fns[name], total_slices, args.repeat, args.warmup)
+        results["stages"][name] = stage
+        print(f"{name:<12} {stage['p50_ms']:>10.2f} {stage['p95_ms']:>10.2f} "
+              f"{stage['slices_per_s']:>10.1f} {stage['stage_peak_rss_mb'] or float('nan'):>9.1f} "
+              f"{stage['stage_growth_mb'] if stage['stage_growth_mb'] is not None else float('nan'):>10.1f} "
+              f"{stage['process_peak_rss_mb']:>11.1f}")
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to '{output}'")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print(f"Regressed stages: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Offline conversion of the ensemble to TFLite.
+
+Converts every member of MODEL_PATHS to one TFLite artifact per requested
+quantization (written next to the .keras file, see tflite_path), then runs
+the original and converted ensembles on the same slices and reports how far
+the masks agree (Dice) and how long each takes. With --cascade, the
+confidence-gated cascade (CASCADE_ENABLED) is measured against the full
+Keras ensemble on the same slices.
+
+    python convert.py --quantization float16 dynamic --validate case1.dcm case2.dcm
+    python convert.py --quantization int8 --calibration train1.dcm --validate case1.dcm
+
+Serve the artifacts with INFERENCE_BACKEND=tflite TFLITE_QUANTIZATION=<quantization>.
+"""
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '1'
+import json
+import time
+import argparse
+
+import numpy as np
+import tensorflow as tf
+
+from utils.bcolors import bcolors
+from utils.cascade import CascadeEnsemble, measure_cascade
+from utils.ensemble import (load_ensemble, load_dicom, preprocess_volume_2d, ensemble_predict_batch,
+                            tflite_path, TFLiteModel, MODEL_PATHS, PREDICT_BATCH_SIZE, TFLITE_QUANTIZATIONS)
+
+# Slices fed to the converter to calibrate int8 activations
+CALIBRATION_SLICES = 200
+
+def load_slices(paths):
+    """
+    Preprocessed slices (N, 128, 128, 1) of every DICOM file in paths.
+    """
+    batches = [preprocess_volume_2d(load_dicom(path)) for path in paths]
+    return np.concatenate(batches, axis=0) if batches else np.zeros((0, 128, 128, 1), dtype=np.float32)
+
+def convert_member(model, quantization, calibration=None):
+    """
+    Convert one Keras model to a TFLite flatbuffer with post-training quantization.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'dynamic':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif quantization == 'int8':
+        if calibration is None or len(calibration) == 0:
+            raise ValueError("int8 quantization needs calibration slices (--calibration)")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([s[None]] for s in calibration[:CALIBRATION_SLICES])
+    return converter.convert()
+
+def mask_dice(a, b, smooth=1e-6):
+    """
+    Dice coefficient of two binary masks; 1 when both are empty.
+    """
+    a = a.astype(bool)
+    b = b.astype(bool)
+    total = a.sum() + b.sum()
+    if total == 0:
+        return 1.0
+    return float((2. * np.logical_and(a, b).sum() + smooth) / (total + smooth))
+
+def timed_predict(models, slices, max_batch_size):
+    start = time.perf_counter()
+    pred = ensemble_predict_batch(models, slices, max_batch_size)
+    return pred, time.perf_counter() - start
+
+def validate(keras_models, tflite_models, slices, max_batch_size, threshold=0.5):
+    """
+    Agreement of the converted ensemble with the original on the same slices.
+    """
+    # One untimed pass each so graph tracing and tensor allocation are not measured
+    ensemble_predict_batch(keras_models, slices[:max_batch_size], max_batch_size)
+    ensemble_predict_batch(tflite_models, slices[:max_batch_size], max_batch_size)
+
+    reference, keras_time = timed_predict(keras_models, slices, max_batch_size)
+    converted, tflite_time = timed_predict(tflite_models, slices, max_batch_size)
+    ref_masks = reference > threshold
+    new_masks = converted > threshold
+
+    members = []
+    for keras_model, tflite_model in zip(keras_models, tflite_models):
+        ref = keras_model.predict(slices, batch_size=max_batch_size, verbose=0)[..., 0] > threshold
+        new = tflite_model.predict(slices, batch_size=max_batch_size)[..., 0] > threshold
+        members.append({"model": tflite_model.path, "dice": mask_dice(ref, new)})
+
+    per_slice = [mask_dice(r, n) for r, n in zip(ref_masks, new_masks)]
+    return {
+        "slices": len(slices),
+        "ensemble_dice": mask_dice(ref_masks, new_masks),
+        "mean_slice_dice": float(np.mean(per_slice)),
+        "min_slice_dice": float(np.min(per_slice)),
+        "max_probability_error": float(np.abs(reference - converted).max()),
+        "keras_ms_per_slice": 1000 * keras_time / len(slices),
+        "tflite_ms_per_slice": 1000 * tflite_time / len(slices),
+        "members": members,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the ensemble to TFLite and validate it.")
+    parser.add_argument('--quantization', nargs='+', default=['float16'], choices=TFLITE_QUANTIZATIONS)
+    parser.add_argument('--calibration', nargs='*', default=[], help="DICOM files calibrating int8 quantization")
+    parser.add_argument('--validate', nargs='*', default=[], help="DICOM files the agreement is measured on")
+    parser.add_argument('--report', default='tflite_report.json', help="Where the validation report is written")
+    parser.add_argument('--batch-size', type=int, default=PREDICT_BATCH_SIZE)
+    parser.add_argument('--cascade', action='store_true', help="Also measure the cascade ensemble")
+    parser.add_argument('--cascade-band', type=float, default=0.1)
+    parser.add_argument('--cascade-max-uncertain', type=float, default=0.001)
+    parser.add_argument('--cascade-max-region', type=int, default=0)
+    args = parser.parse_args()
+
+    keras_models = load_ensemble(backend='keras')
+    if len(keras_models) != len(MODEL_PATHS):
+        print(bcolors.FAIL + "[Convert] Every model in MODEL_PATHS must load" + bcolors.ENDC)
+        return 1
+
+    calibration = load_slices(args.calibration) if args.calibration else None
+    slices = load_slices(args.validate)
+    if len(slices) == 0:
+        print(bcolors.WARNING + "[Convert] No --validate files, measuring agreement on random slices only" + bcolors.ENDC)
+        slices = np.random.default_rng(0).standard_normal((64, 128, 128, 1)).astype(np.float32)
+    if calibration is None:
+        calibration = slices
+
+    report = {"validation_files": args.validate, "results": {}}
+    for quantization in args.quantization:
+        print(bcolors.OKBLUE + f"[Convert] {quantization}" + bcolors.ENDC)
+        for keras_model, path in zip(keras_models, MODEL_PATHS):
+            out = tflite_path(path, quantization)
+            with open(out, 'wb') as f:
+                f.write(convert_member(keras_model, quantization, calibration))
+            print(f"[Convert] {path} -> {out} ({os.path.getsize(out) / 1024:.0f} KB)")
+
+        tflite_models = [TFLiteModel(tflite_path(path, quantization)) for path in MODEL_PATHS]
+        result = validate(keras_models, tflite_models, slices, args.batch_size)
+        result["artifacts"] = {m.path: os.path.getsize(m.path) for m in tflite_models}
+        report["results"][quantization] = result
+        print(bcolors.OKGREEN + f"[Convert] {quantization}: ensemble Dice {result['ensemble_dice']:.4f}, "
+              f"min slice Dice {result['min_slice_dice']:.4f}, "
+              f"{result['keras_ms_per_slice']:.2f} -> {result['tflite_ms_per_slice']:.2f} ms/slice" + bcolors.ENDC)
+
+    if args.cascade:
+        cascade = CascadeEnsemble(keras_models, band=args.cascade_band,
+                                  max_uncertain_fraction=args.cascade_max_uncertain,
+                                  max_region_pixels=args.cascade_max_region)
+        result = measure_cascade(cascade, slices, args.batch_size)
+        report["cascade"] = {"band": args.cascade_band, "max_uncertain_fraction": args.cascade_max_uncertain,
+                             "max_region_pixels": args.cascade_max_region, **result}
+        print(bcolors.OKGREEN + f"[Convert] cascade: Dice {result['dice']:.4f} vs full ensemble, "
+              f"{result['short_circuit_fraction']:.0%} of slices short-circuited, "
+              f"{result['member_calls_saved']:.0%} of member calls saved" + bcolors.ENDC)
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"[Convert] Report written to '{args.report}'")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
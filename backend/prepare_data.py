@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+One-time preprocessing of the training data into slice shards.
+
+Resamples and normalizes the CaseXX.mhd volumes of every split once and
+writes the slices (cropped/padded to the patch size) and masks to
+memory-mapped .npy shards under --cache-dir, keyed by spacing and patch
+size. Training then reads them through utils.dataset.make_dataset:
+
+    python prepare_data.py --data-dir datasets --splits train test --spacing 1 1 1 --workers 8
+
+    train, train_slices = make_dataset(['datasets/shards/train_sp1x1x1_ps128x128'], batch_size=32, seed=0)
+    model.fit(train, steps_per_epoch=train_slices // 32, ...)
+
+Cases are processed by a pool of --workers processes into a content-addressed
+resample cache keyed by the source file hashes and the target spacing, so a
+rerun only processes new or changed cases. The timing and failures of every
+case are printed and written to --report.
+"""
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '1'
+import json
+import time
+import argparse
+
+from utils.bcolors import bcolors
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocess the training cases into slice shards.")
+    parser.add_argument('--data-dir', default='datasets', help="Directory holding the split folders")
+    parser.add_argument('--splits', nargs='+', default=['train', 'test'])
+    parser.add_argument('--cache-dir', default=os.path.join('datasets', 'shards'))
+    parser.add_argument('--resample-dir', help="Preprocessed case cache (default: <cache-dir>/resampled)")
+    parser.add_argument('--spacing', type=float, nargs=3, default=(1.0, 1.0, 1.0), help="Target spacing x y z in mm")
+    parser.add_argument('--patch-size', type=int, nargs=2, default=(128, 128))
+    parser.add_argument('--shard-slices', type=int, help="Slices per shard (default: utils.dataset.SHARD_SLICES)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Preprocessing processes")
+    parser.add_argument('--prostatex-segmentations', help="PROSTATEx segmentation directory (one folder per patient)")
+    parser.add_argument('--prostatex-images', help="PROSTATEx image directory (one folder per patient)")
+    parser.add_argument('--target-depth', type=int, default=16, help="Slices kept per PROSTATEx patient")
+    parser.add_argument('--force', action='store_true', help="Rewrite the shards even if they are up to date")
+    parser.add_argument('--report', default='prepare_report.json', help="Where the per-case report is written")
+    args = parser.parse_args()
+
+    # Imported here: spawned workers re-import this script and must not pay for TensorFlow
+    from utils.dataset import build_shards, build_prostatex_shards, read_manifest, SHARD_SLICES
+    shard_slices = args.shard_slices or SHARD_SLICES
+
+    builds = [(split, lambda split=split: build_shards(
+        args.data_dir, split, args.cache_dir, tuple(args.spacing), tuple(args.patch_size),
+        shard_slices, args.force, args.workers, args.resample_dir)) for split in args.splits]
+    if args.prostatex_segmentations and args.prostatex_images:
+        builds.append(('prostatex', lambda: build_prostatex_shards(
+            args.prostatex_segmentations, args.prostatex_images, args.cache_dir, tuple(args.patch_size),
+            args.target_depth, shard_slices, args.force, args.workers, args.resample_dir)))
+
+    report = {}
+    failed = 0
+    for name, build in builds:
+        start = time.perf_counter()
+        directory = build()
+        manifest = read_manifest(directory)
+        summary = manifest["preprocessing"]
+        report[name] = {
+            "directory": str(directory),
+            "slices": manifest["slices"],
+            "wall_seconds": round(time.perf_counter() - start, 3),
+            **summary,
+            "case_seconds": manifest["case_seconds"],
+        }
+        failed += len(summary["failed"])
+        print(f"{name}: {summary['processed']} processed, {summary['cached']} cached, "
+              f"{len(summary['failed'])} failed in {report[name]['wall_seconds']:.1f}s")
+        if summary["failed"]:
+            print(bcolors.FAIL + f"{name} failures: {', '.join(summary['failed'])}" + bcolors.ENDC)
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to '{args.report}'")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
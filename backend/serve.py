@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Pre-fork production server.
+
+The parent process loads and warms the ensemble once, binds the listening
+socket and forks SERVE_WORKERS HTTP workers that share it. Workers do the
+DICOM decoding, OpenCV work, PNG encoding and JSON on their own CPU and hand
+preprocessed slices to the parent through shared memory, where a single
+inference loop batches them across workers. The triage pass (TRIAGE_ENABLED)
+runs on its own model in the parent too, so it stays a cheap first pass.
+
+Signals:
+    SIGHUP          reload the models, then replace workers one by one
+    SIGTERM/SIGINT  stop accepting connections, finish in-flight requests and exit
+
+Uses the fork start method (Linux/macOS).
+"""
+import os
+import time
+import signal
+import socket
+import itertools
+import threading
+import multiprocessing as mp
+from multiprocessing import resource_tracker
+
+from werkzeug.serving import make_server
+
+# The parent must hold the warmed-up models before forking the workers
+os.environ['BACKGROUND_LOADING'] = '0'
+import app as server
+from utils.bcolors import bcolors
+from utils.ensemble import ensemble_predict_batch, warm_up
+from utils.scheduler import InferenceScheduler
+from utils.prefork import InferenceServer, RemoteEnsemble
+from utils.cascade import CascadeEnsemble
+
+# Serving configuration
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = int(os.environ.get('PORT', 5000))
+SERVE_WORKERS = int(os.environ.get('SERVE_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+SHUTDOWN_TIMEOUT = 30  # Seconds a worker may take to finish in-flight requests
+
+# The parent owns the models; workers only see RemoteEnsemble
+state = {"model": server.model, "triage": server.triage.model if server.triage is not None else None}
+
+def run_worker(worker_id, sock, request_queue, response_queue):
+    """
+    Entry point of a forked HTTP worker.
+    """
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    server.scheduler = None
+    server.engine = RemoteEnsemble(worker_id, request_queue, response_queue)
+    if server.admission is not None:
+        # Each worker admits on its own, so every worker gets an equal share of the budget.
+        # A request larger than one share is rejected with 413 even if the others are idle.
+        server.admission.max_bytes //= SERVE_WORKERS
+        server.admission.max_slices = max(1, server.admission.max_slices // SERVE_WORKERS)
+    if server.triage is not None and server.triage.model is not None:
+        # The cheap triage model is run by the parent's triage scheduler
+        server.triage.model = server.engine.endpoint("triage")
+
+    httpd = make_server(HOST, PORT, server.app, threaded=True, fd=sock.fileno())
+    # Let server_close() wait for in-flight requests
+    httpd.daemon_threads = False
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=httpd.shutdown).start())
+
+    print(bcolors.OKCYAN + f"[Serve] Worker {worker_id} (pid {os.getpid()}) ready" + bcolors.ENDC)
+    httpd.serve_forever()
+    httpd.server_close()
+    server.engine.close()
+
+def main():
+    ctx = mp.get_context('fork')
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((HOST, PORT))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    scheduler = InferenceScheduler(
+        lambda batch: ensemble_predict_batch(state["model"], batch, server.PREDICT_BATCH_SIZE),
+        max_batch_size=server.PREDICT_BATCH_SIZE, max_wait_ms=server.SCHEDULER_MAX_WAIT_MS,
+        batch_sizes=server.WARMUP_BATCH_SIZES)
+    warm_up(scheduler, server.WARMUP_BATCH_SIZES)
+
+    endpoints = {}
+    if state["triage"] is not None:
+        endpoints["triage"] = InferenceScheduler(
+            lambda batch: ensemble_predict_batch(state["triage"], batch, server.PREDICT_BATCH_SIZE),
+            max_batch_size=server.PREDICT_BATCH_SIZE, max_wait_ms=server.SCHEDULER_MAX_WAIT_MS,
+            batch_sizes=server.WARMUP_BATCH_SIZES)
+    elif server.triage is not None:
+        print(bcolors.WARNING + "[Serve] No separate triage model for this backend, "
+              "the triage pass runs on the full ensemble" + bcolors.ENDC)
+
+    # One resource tracker shared by all workers, so shared memory segments have a single owner
+    resource_tracker.ensure_running()
+
+    request_queue = ctx.Queue()
+    inference = InferenceServer(scheduler, request_queue, endpoints)
+    inference.start()
+
+    workers = {}
+    worker_ids = itertools.count()
+
+    def spawn():
+        worker_id = next(worker_ids)
+        response_queue = ctx.Queue()
+        inference.response_queues[worker_id] = response_queue
+        process = ctx.Process(target=run_worker, args=(worker_id, sock, request_queue, response_queue))
+        process.start()
+        workers[worker_id] = process
+
+    def retire(worker_id):
+        process = workers.pop(worker_id)
+        process.terminate()  # SIGTERM: graceful shutdown in the worker
+        process.join(SHUTDOWN_TIMEOUT)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        inference.response_queues.pop(worker_id, None)
+
+    flags = {"reload": False, "stop": False}
+    signal.signal(signal.SIGHUP, lambda *_: flags.update(reload=True))
+    signal.signal(signal.SIGTERM, lambda *_: flags.update(stop=True))
+    signal.signal(signal.SIGINT, lambda *_: flags.update(stop=True))
+
+    for _ in range(SERVE_WORKERS):
+        spawn()
+    print(bcolors.OKGREEN + f"[Serve] Listening on {HOST}:{PORT} with {SERVE_WORKERS} workers" + bcolors.ENDC)
+
+    while not flags["stop"]:
+        time.sleep(0.5)
+
+        # Replace workers that died unexpectedly
+        for worker_id, process in list(workers.items()):
+            if not process.is_alive():
+                print(bcolors.WARNING + f"[Serve] Worker {worker_id} exited ({process.exitcode}), respawning" + bcolors.ENDC)
+                workers.pop(worker_id)
+                inference.response_queues.pop(worker_id, None)
+                spawn()
+
+        if flags["reload"]:
+            flags["reload"] = False
+            print(bcolors.OKBLUE + "[Serve] Reloading models" + bcolors.ENDC)
+            new_model = server.load_models()
+            if not new_model:
+                print(bcolors.FAIL + "[Serve] Reload failed, keeping current models" + bcolors.ENDC)
+                continue
+            # Warm up before swapping, so no request reaches a cold or broken model
+            try:
+                warm_up(new_model.members if isinstance(new_model, CascadeEnsemble) else new_model,
+                        server.WARMUP_BATCH_SIZES, server.PREDICT_BATCH_SIZE)
+            except Exception as e:
+                print(bcolors.FAIL + f"[Serve] Warm-up of the new models failed ({e}), keeping current models"
+                      + bcolors.ENDC)
+                continue
+            # Swap every reference, so the old models are freed instead of kept next to the new ones
+            if server.engine is server.model:
+                server.engine = new_model
+            server.model = state["model"] = new_model
+            if state["triage"] is not None:
+                state["triage"] = server.triage.model = server.triage_models(new_model) or state["triage"]
+            # The disk tier outlives the models, keys of the new weights must not match the old masks
+            if server.cache is not None:
+                server.cache.namespace = server.cache_namespace(server.model, server.triage)
+            # Rolling restart: start the replacement before retiring the old worker
+            for worker_id in list(workers):
+                spawn()
+                retire(worker_id)
+            print(bcolors.OKGREEN + "[Serve] Reload completed" + bcolors.ENDC)
+
+    print(bcolors.OKBLUE + "[Serve] Shutting down" + bcolors.ENDC)
+    for worker_id in list(workers):
+        retire(worker_id)
+    inference.stop()
+    sock.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import io
+import threading
+import time
+import zipfile
+
+import numpy as np
+import pytest
+from pydicom.uid import generate_uid
+
+from utils.admission import AdmissionController, AdmissionRejected, estimate_cost
+from utils.jobs import BufferedUpload
+from utils.series import upload_headers
+from utils.synthetic import synthetic_dataset, to_bytes
+
+def test_estimate_cost_overlays():
+    base = estimate_cost(10, 256, 256, overlays=False)
+    assert estimate_cost(10, 256, 256, overlay_scale=2) == base + 10 * 256 * 256 * 4 * 3
+
+def test_admits_within_budget_and_releases():
+    controller = AdmissionController(max_bytes=100, max_slices=10)
+    first = controller.acquire(60, 4)
+    second = controller.acquire(40, 6)
+    assert controller.stats()["in_flight_bytes"] == 100
+    first.release()
+    first.release()  # Idempotent
+    second.release()
+    stats = controller.stats()
+    assert (stats["in_flight_bytes"], stats["in_flight_slices"], stats["in_flight_requests"]) == (0, 0, 0)
+    assert stats["admitted"] == 2
+
+@pytest.mark.parametrize("nbytes, slices", [(101, 1), (1, 11)])
+def test_larger_than_the_budget_is_413(nbytes, slices):
+    controller = AdmissionController(max_bytes=100, max_slices=10)
+    with pytest.raises(AdmissionRejected) as e:
+        controller.acquire(nbytes, slices)
+    assert e.value.status == 413
+    assert e.value.retry_after is None
+    assert controller.stats()["rejected"]["413"] == 1
+
+def test_full_queue_is_429():
+    controller = AdmissionController(max_bytes=100, max_slices=10, max_waiting=0, retry_after=3)
+    with controller.acquire(100, 1):
+        with pytest.raises(AdmissionRejected) as e:
+            controller.acquire(1, 1)
+    assert (e.value.status, e.value.retry_after) == (429, 3)
+    assert controller.stats()["rejected"]["429"] == 1
+
+def test_wait_timeout_is_429():
+    controller = AdmissionController(max_bytes=100, max_slices=10, max_wait=0.05)
+    with controller.acquire(100, 1):
+        start = time.monotonic()
+        with pytest.raises(AdmissionRejected) as e:
+            controller.acquire(10, 1)
+        assert time.monotonic() - start >= 0.05
+    assert e.value.status == 429
+    assert controller.stats()["waiting"] == 0
+
+def test_waiter_is_admitted_on_release():
+    controller = AdmissionController(max_bytes=100, max_slices=10, max_wait=5)
+    holder = controller.acquire(80, 1)
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(controller.acquire(50, 1)))
+    waiter.start()
+    time.sleep(0.05)
+    assert not admitted and controller.stats()["waiting"] == 1
+    holder.release()
+    waiter.join(2)
+    assert admitted and controller.stats()["in_flight_bytes"] == 50
+    admitted[0].release()
+
+def test_reserved_waiter_blocks_smaller_requests():
+    controller = AdmissionController(max_bytes=100, max_slices=10, max_wait=5, reserve_after=0.05)
+    holder = controller.acquire(60, 1)
+    large = []
+    waiter = threading.Thread(target=lambda: large.append(controller.acquire(80, 1)))
+    waiter.start()
+    # Before reserve_after a small request may backfill around the waiting one
+    time.sleep(0.01)
+    controller.acquire(10, 1, max_wait=0).release()
+    # Afterwards the waiting request holds its place
+    time.sleep(0.1)
+    with pytest.raises(AdmissionRejected):
+        controller.acquire(10, 1, max_wait=0.05)
+    holder.release()
+    waiter.join(2)
+    assert large
+    large[0].release()
+
+def test_zipped_members_are_estimated_from_their_headers():
+    uid = generate_uid()
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for i in range(3):
+            # Extensionless members are recognised by their preamble
+            zf.writestr(f"series/IM{i}", to_bytes(synthetic_dataset(np.zeros((2, 32, 48), dtype=np.uint16), uid, i + 1)))
+        zf.writestr("series/README.txt", "not a DICOM file")
+    upload = BufferedUpload("study.zip", archive.getvalue())
+    single = BufferedUpload("single.dcm", to_bytes(synthetic_dataset(np.zeros((1, 16, 16), dtype=np.uint16), uid)))
+
+    headers = list(upload_headers([upload, single]))
+    assert [(h.frames, h.rows, h.columns) for h in headers] == [(2, 32, 48)] * 3 + [(1, 16, 16)]
+    assert upload.tell() == 0
@@ -0,0 +1,47 @@
+import numpy as np
+import tensorflow as tf
+
+from utils.augment import BatchAugmenter, gaussian_kernel
+
+def batch(size=4, height=32, width=32):
+    rng = np.random.default_rng(0)
+    images = rng.random((size, height, width, 1), dtype=np.float32)
+    masks = np.zeros((size, height, width, 1), dtype=np.float32)
+    masks[:, 8:24, 10:20] = 1.0
+    return tf.constant(images), tf.constant(masks)
+
+def test_same_seed_same_output():
+    images, masks = batch()
+    augmenter = BatchAugmenter()
+    first = augmenter(images, masks, seed=(3, 7))
+    second = augmenter(images, masks, seed=(3, 7))
+    other = augmenter(images, masks, seed=(3, 8))
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(a.numpy(), b.numpy())
+    assert not np.array_equal(first[0].numpy(), other[0].numpy())
+
+def test_masks_stay_binary_and_images_clipped():
+    images, masks = batch()
+    out_images, out_masks = BatchAugmenter()(images, masks, seed=(1, 2))
+    assert out_images.shape == images.shape and out_masks.shape == masks.shape
+    assert set(np.unique(out_masks.numpy())) <= {0.0, 1.0}
+    assert out_images.numpy().min() >= 0.0 and out_images.numpy().max() <= 1.0
+
+def test_empty_config_is_the_identity():
+    images, masks = batch()
+    out_images, out_masks = BatchAugmenter({})(images, masks, seed=(1, 2))
+    np.testing.assert_array_equal(out_images.numpy(), images.numpy())
+    np.testing.assert_array_equal(out_masks.numpy(), masks.numpy())
+
+def test_runs_inside_a_traced_function():
+    images, masks = batch()
+    augmenter = BatchAugmenter({'flip': True, 'elastic': True})
+    traced = tf.function(lambda i, m, s: augmenter(i, m, seed=s))
+    seed = tf.constant([5, 1], tf.int64)
+    np.testing.assert_array_equal(traced(images, masks, seed)[1].numpy(), augmenter(images, masks, seed)[1].numpy())
+
+def test_gaussian_kernel_is_normalized_and_truncated():
+    kernel = gaussian_kernel(50, 32)
+    assert len(kernel) == 2 * 31 + 1
+    np.testing.assert_allclose(kernel.sum(), 1.0, rtol=1e-6)
+    assert len(gaussian_kernel(1, 128)) == 9
@@ -0,0 +1,47 @@
+import numpy as np
+
+import utils.cases as cases
+from utils.cases import ResampleCache, process_case
+
+def write_case(directory, pixels=b"\x00\x01\x02\x03"):
+    # .mhd header referencing its raw data file
+    header = directory / "case.mhd"
+    header.write_text("ObjectType = Image\nElementDataFile = case.raw\n")
+    (directory / "case.raw").write_bytes(pixels)
+    return header
+
+def test_key_ignores_the_spacing_container(tmp_path):
+    cache = ResampleCache(tmp_path / "cache")
+    header = write_case(tmp_path)
+    assert (cache.key([header], "mhd", new_spacing=[1.0, 1.0, 1.5])
+            == cache.key([header], "mhd", new_spacing=(1.0, 1.0, 1.5)))
+    assert (cache.key([header], "mhd", new_spacing=(1.0, 1.0, 1.5))
+            != cache.key([header], "mhd", new_spacing=(1.0, 1.0, 1.0)))
+    assert cache.key([header], "mhd") != cache.key([header], "prostatex")
+
+def test_key_changes_with_the_source(tmp_path):
+    cache = ResampleCache(tmp_path / "cache")
+    header = write_case(tmp_path)
+    before = cache.key([header], "mhd", new_spacing=(1, 1, 1))
+    # The pixel data lives in the file the header references
+    (tmp_path / "case.raw").write_bytes(b"\x00\x01\x02\x04")
+    assert cache.key([header], "mhd", new_spacing=(1, 1, 1)) != before
+
+def test_process_case_stores_once(tmp_path, monkeypatch):
+    calls = []
+
+    def loader(path, new_spacing=(1.0, 1.0, 1.0)):
+        calls.append(path)
+        return np.ones((2, 4, 4), dtype=np.float32), np.zeros((2, 4, 4), dtype=np.uint8)
+
+    monkeypatch.setitem(cases.LOADERS, "stub", loader)
+    header = write_case(tmp_path)
+    first = process_case("stub", "case", [header], {"new_spacing": [1, 1, 1]}, tmp_path / "cache")
+    second = process_case("stub", "case", [header], {"new_spacing": (1, 1, 1)}, tmp_path / "cache")
+    assert first["error"] is None and not first["cached"]
+    assert second["cached"] and second["key"] == first["key"]
+    assert len(calls) == 1
+
+    image, mask = ResampleCache(tmp_path / "cache").load(first["key"])
+    assert image.dtype == np.float32 and image.shape == (2, 4, 4)
+    assert isinstance(image, np.memmap)
@@ -0,0 +1,52 @@
+import json
+
+import numpy as np
+
+from utils.dataset import ShardWriter, ShardedSlices, crop_or_pad, make_dataset
+
+def write_shards(directory, slices=23, shard_slices=5, adds=(7, 9, 7)):
+    # Slice i is filled with i, so the gathered order can be read back
+    images = np.arange(slices, dtype=np.float32)[:, None, None] * np.ones((1, 4, 6), dtype=np.float32)
+    masks = (np.arange(slices) % 2)[:, None, None] * np.ones((1, 4, 6), dtype=np.uint8)
+    writer = ShardWriter(directory, patch_size=(4, 6), shard_slices=shard_slices)
+    start = 0
+    for count in adds:
+        writer.add(images[start:start + count], masks[start:start + count])
+        start += count
+    writer.close(source="test")
+    return images, masks
+
+def test_gather_round_trip_across_shard_boundaries(tmp_path):
+    images, masks = write_shards(tmp_path)
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    assert [shard["slices"] for shard in manifest["shards"]] == [5, 5, 5, 5, 3]
+
+    slices = ShardedSlices(tmp_path)
+    assert len(slices) == 23
+    # Unsorted indices spanning every shard, with a repeat
+    indices = [22, 0, 9, 10, 4, 5, 14, 15, 19, 20, 3, 9]
+    gathered_images, gathered_masks = slices.gather(indices)
+    assert gathered_images.shape == (len(indices), 4, 6, 1)
+    np.testing.assert_array_equal(gathered_images[..., 0], images[indices])
+    np.testing.assert_array_equal(gathered_masks[..., 0], masks[indices])
+
+def test_several_directories_are_concatenated(tmp_path):
+    first, _ = write_shards(tmp_path / "a", slices=8, adds=(8,))
+    second, _ = write_shards(tmp_path / "b", slices=6, adds=(6,))
+    slices = ShardedSlices([tmp_path / "a", tmp_path / "b"])
+    gathered, _ = slices.gather([13, 7, 8, 0])
+    np.testing.assert_array_equal(gathered[:, 0, 0, 0], [second[5, 0, 0], first[7, 0, 0], second[0, 0, 0], 0])
+
+def test_dataset_yields_every_slice_once_per_epoch(tmp_path):
+    write_shards(tmp_path)
+    dataset, count = make_dataset(tmp_path, batch_size=4, seed=1, repeat=False)
+    values = np.concatenate([images.numpy()[:, 0, 0, 0] for images, _ in dataset])
+    assert count == 23
+    assert sorted(values.tolist()) == list(range(23))
+
+def test_crop_or_pad_centers():
+    volume = np.arange(2 * 3 * 8, dtype=np.float32).reshape(2, 3, 8)
+    out = crop_or_pad(volume, (5, 4))
+    assert out.shape == (2, 5, 4)
+    np.testing.assert_array_equal(out[:, 1:4], volume[:, :, 2:6])
+    assert not out[:, 0].any() and not out[:, 4].any()
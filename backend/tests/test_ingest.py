@@ -0,0 +1,53 @@
+import io
+import tracemalloc
+
+import numpy as np
+import pytest
+from flask import Flask, jsonify, request
+from pydicom.uid import generate_uid
+
+from utils.ensemble import cache_key
+from utils.cache import PredictionCache
+from utils.ingest import UploadRequest, read_deferred, pixel_view, open_volume
+from utils.synthetic import synthetic_dataset, to_bytes
+
+def upload_app():
+    app = Flask('test_ingest')
+    app.request_class = UploadRequest
+
+    @app.route('/upload', methods=['POST'])
+    def upload():
+        upload = request.files['file']
+        dcm = read_deferred(upload)
+        tracemalloc.start()
+        view = pixel_view(dcm)
+        key = cache_key(dcm, PredictionCache(max_bytes=0), '2d')
+        volume = open_volume(dcm)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return jsonify({
+            "stream": type(upload.stream).__name__,
+            "shared": view is pixel_view(dcm) and volume.raw is view,
+            "writeable": bool(view.flags.writeable),
+            "pixel_bytes": view.nbytes,
+            "peak": peak,
+            "key": key,
+            "checksum": int(np.asarray(volume)[1].sum()),
+        })
+
+    return app
+
+@pytest.mark.parametrize("max_memory,stream", [(64 * 1024 * 1024, "BytesIO"), (0, "BufferedRandom")])
+def test_upload_pixels_are_not_copied(monkeypatch, max_memory, stream):
+    monkeypatch.setattr(UploadRequest, 'max_memory', max_memory)
+    pixels = np.random.default_rng(0).integers(0, 4096, (8, 256, 256), dtype=np.uint16)
+    data = to_bytes(synthetic_dataset(pixels, generate_uid()))
+
+    response = upload_app().test_client().post('/upload', data={"file": (io.BytesIO(data), "volume.dcm")})
+    result = response.get_json()
+    assert result["stream"] == stream
+    assert result["shared"] and not result["writeable"]
+    assert result["pixel_bytes"] == pixels.nbytes
+    # The cache key and the lazy volume read the same view, a full copy would exceed this
+    assert result["peak"] < pixels.nbytes // 4
+    assert result["checksum"] == int(pixels[1].astype(np.float32).sum())
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from utils.maskcodec import rle_encode, rle_decode, bitpack_encode, bitpack_decode, encode_masks
+
+def random_masks(n=4, shape=(128, 128), seed=0):
+    return (np.random.default_rng(seed).random((n, *shape)) > 0.7).astype(np.uint8)
+
+@pytest.mark.parametrize("mask", [
+    np.zeros((128, 128), np.uint8),
+    np.ones((128, 128), np.uint8),
+    random_masks(1)[0],
+    np.pad(np.ones((2, 3), np.uint8), ((0, 1), (1, 0))),
+])
+def test_rle_round_trip(mask):
+    counts = rle_encode(mask)
+    assert sum(counts) == mask.size
+    np.testing.assert_array_equal(rle_decode(counts, mask.shape), mask)
+
+def test_rle_starts_with_zero_run():
+    assert rle_encode(np.zeros((4, 4), np.uint8)) == [16]
+    assert rle_encode(np.ones((2, 2), np.uint8)) == [0, 4]
+
+@pytest.mark.parametrize("shape", [(4, 128, 128), (3, 5, 7)])
+def test_bitpack_round_trip(shape):
+    masks = random_masks(shape[0], shape[1:])
+    np.testing.assert_array_equal(bitpack_decode(bitpack_encode(masks), masks.shape), masks)
+
+def test_encode_masks():
+    masks = random_masks(2)
+    counts = encode_masks(masks, 'rle')
+    assert len(counts) == 2
+    np.testing.assert_array_equal(rle_decode(counts[1], masks.shape[1:]), masks[1])
+    np.testing.assert_array_equal(bitpack_decode(encode_masks(masks, 'bitpack'), masks.shape), masks)
+    with pytest.raises(ValueError):
+        encode_masks(masks, 'png')
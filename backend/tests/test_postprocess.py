@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+import pytest
+
+import utils.postprocess as postprocess
+from utils.postprocess import postprocess_volume, largest_connected_component_3d, upsample_masks
+
+def two_components():
+    # A: 2x2 square through all 3 slices (12 pixels), B: 3x3 square on the middle slice only (9 pixels)
+    pred = np.zeros((3, 16, 16), dtype=np.float32)
+    pred[:, 2:4, 2:4] = 0.9
+    pred[1, 10:13, 10:13] = 0.8
+    return pred
+
+def test_2d_keeps_the_largest_component_per_slice():
+    masks = postprocess_volume(two_components(), mode='2d')
+    assert masks[0, 2:4, 2:4].all() and masks[2, 2:4, 2:4].all()
+    # On the middle slice B is larger than A's cross-section
+    assert masks[1, 10:13, 10:13].all() and not masks[1, 2:4, 2:4].any()
+
+def test_3d_keeps_the_largest_component_of_the_volume():
+    masks = postprocess_volume(two_components(), mode='3d')
+    assert masks[:, 2:4, 2:4].all()
+    assert not masks[1, 10:13, 10:13].any()
+    np.testing.assert_array_equal(masks, largest_connected_component_3d((two_components() > 0.5).astype(np.uint8)))
+
+def test_3d_ignores_empty_slices_and_unknown_modes():
+    pred = np.zeros((5, 8, 8), dtype=np.float32)
+    assert not postprocess_volume(pred, mode='3d').any()
+    with pytest.raises(ValueError):
+        postprocess_volume(pred, mode='4d')
+
+def test_upsample_masks_matches_per_slice_resize(monkeypatch):
+    # Force several OpenCV calls to cover the chunking
+    monkeypatch.setattr(postprocess, '_MAX_RESIZE_CHANNELS', 2)
+    masks = (np.random.default_rng(0).random((5, 16, 16)) > 0.6).astype(np.uint8)
+    masks[2] = 0
+    out = upsample_masks(masks, (40, 24))
+    assert out.shape == (5, 24, 40) and out.dtype == np.uint8
+    for mask, resized in zip(masks, out):
+        np.testing.assert_array_equal(resized, cv2.resize(mask, (40, 24), interpolation=cv2.INTER_LINEAR))
+    assert not out[2].any()
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from utils.ensemble import preprocess_slice_2d, preprocess_volume_2d
+
+def reference(volume):
+    # The per-slice path on float32 slices, as dataset_to_volume hands them over
+    return np.concatenate([preprocess_slice_2d(s.astype(np.float32)) for s in volume])
+
+@pytest.mark.parametrize("dtype", [np.float32, np.uint16])
+def test_volume_matches_per_slice(dtype):
+    rng = np.random.default_rng(0)
+    volume = (rng.random((5, 200, 160)) * 4095).astype(dtype)
+    batch = preprocess_volume_2d(volume)
+    assert batch.shape == (5, 128, 128, 1)
+    assert batch.dtype == np.float32
+    np.testing.assert_allclose(batch, reference(volume), atol=1e-5)
+
+def test_constant_slice_is_zero():
+    volume = np.full((2, 64, 64), 300.0, dtype=np.float32)
+    volume[1] = np.random.default_rng(1).random((64, 64))
+    batch = preprocess_volume_2d(volume)
+    np.testing.assert_array_equal(batch[0], 0.0)
+    np.testing.assert_allclose(batch, reference(volume), atol=1e-5)
+
+def test_fills_out_buffer():
+    volume = np.random.default_rng(2).random((3, 100, 100)).astype(np.float32)
+    out = np.zeros((5, 128, 128, 1), dtype=np.float32)
+    preprocess_volume_2d(volume, out=out[1:4])
+    np.testing.assert_allclose(out[1:4], reference(volume), atol=1e-5)
+    assert not out[0].any() and not out[4].any()
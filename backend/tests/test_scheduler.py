@@ -0,0 +1,42 @@
+import threading
+
+import numpy as np
+
+from utils.scheduler import InferenceScheduler
+
+def test_calls_only_use_the_given_batch_sizes():
+    calls = []
+    lock = threading.Lock()
+
+    def predict(batch):
+        with lock:
+            calls.append(len(batch))
+        return batch * 2
+
+    scheduler = InferenceScheduler(predict, max_batch_size=8, max_wait_ms=20, batch_sizes=[1, 2, 4, 8, 64])
+    batches = [np.random.default_rng(n).random((n, 4, 4, 1), dtype=np.float32) for n in (3, 5, 7, 13, 1)]
+    results = [None] * len(batches)
+
+    def run(i):
+        results[i] = scheduler.predict(batches[i])
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(batches))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    for batch, result in zip(batches, results):
+        np.testing.assert_array_equal(result, batch * 2)
+    assert set(calls) <= {1, 2, 4, 8}
+    stats = scheduler.stats()
+    assert stats["slices"] == sum(len(batch) for batch in batches)
+    assert stats["padded_slices"] == sum(calls) - stats["slices"]
+
+def test_without_batch_sizes_batches_never_exceed_the_maximum():
+    calls = []
+    scheduler = InferenceScheduler(lambda batch: calls.append(len(batch)) or batch, max_batch_size=8, max_wait_ms=20)
+    futures = [future for n in (5, 6, 7) for future in scheduler.submit(np.zeros((n, 2), dtype=np.float32))]
+    for future in futures:
+        future.result(5)
+    assert max(calls) <= 8 and sum(calls) == 18
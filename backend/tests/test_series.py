@@ -0,0 +1,75 @@
+import io
+import zipfile
+
+import numpy as np
+from pydicom.uid import generate_uid
+
+from utils.jobs import BufferedUpload
+from utils.series import expand_uploads, group_series
+from utils.synthetic import synthetic_dataset, to_bytes
+
+def instance(series_uid, value, instance_number=None, position=None, orientation=(1, 0, 0, 0, 1, 0), size=8):
+    # Single-slice instance whose pixels all equal value, so the volume order can be read back
+    ds = synthetic_dataset(np.full((1, size, size), value, dtype=np.uint16), series_uid, instance_number)
+    if instance_number is None:
+        del ds.InstanceNumber
+    if position is not None:
+        ds.ImagePositionPatient = list(position)
+        ds.ImageOrientationPatient = list(orientation)
+    return BufferedUpload(f"{value}.dcm", to_bytes(ds))
+
+def slice_values(series):
+    return series.volume()[:, 0, 0].astype(int).tolist()
+
+def test_sorted_by_position_along_the_normal():
+    uid = generate_uid()
+    # Upload order and instance numbers disagree with the positions
+    uploads = [instance(uid, value, instance_number=10 - value, position=(0, 0, z))
+               for value, z in [(3, 30.0), (1, -10.0), (2, 5.5), (4, 42.0)]]
+    [series] = group_series(uploads)
+    assert slice_values(series) == [1, 2, 3, 4]
+    assert series.filenames == ["1.dcm", "2.dcm", "3.dcm", "4.dcm"]
+
+def test_sorted_along_an_oblique_normal():
+    uid = generate_uid()
+    # Sagittal orientation: the normal is +x, the in-plane y offsets must not matter
+    orientation = (0, 1, 0, 0, 0, 1)
+    uploads = [instance(uid, value, position=(x, 100.0 - x, 7.0), orientation=orientation)
+               for value, x in [(2, 1.0), (3, 2.5), (1, -4.0)]]
+    [series] = group_series(uploads)
+    assert slice_values(series) == [1, 2, 3]
+
+def test_falls_back_to_instance_number():
+    uid = generate_uid()
+    uploads = [instance(uid, 2, instance_number=2, position=(0, 0, 1)),
+               instance(uid, 3, instance_number=3),
+               instance(uid, 1, instance_number=1, position=(0, 0, 9))]
+    [series] = group_series(uploads)
+    assert series.instance_numbers == [1, 2, 3]
+    assert slice_values(series) == [1, 2, 3]
+
+def test_missing_instance_numbers_keep_upload_order():
+    uid = generate_uid()
+    [series] = group_series([instance(uid, value) for value in (5, 2, 7)])
+    assert slice_values(series) == [5, 2, 7]
+
+def test_groups_by_series_and_size():
+    first, second = generate_uid(), generate_uid()
+    uploads = [instance(first, 1, 1), instance(second, 2, 1), instance(first, 3, 2),
+               instance(first, 4, 3, size=16)]
+    groups = group_series(uploads)
+    assert [(series.uid, len(series)) for series in groups] == [(first, 2), (second, 1), (first, 1)]
+
+def test_expand_zip_skips_directories_and_macos_metadata():
+    uid = generate_uid()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('study/', b'')
+        archive.writestr('study/b', instance(uid, 2, 2).getvalue())
+        archive.writestr('study/a.dcm', instance(uid, 1, 1).getvalue())
+        archive.writestr('__MACOSX/study/._a.dcm', b'junk')
+        archive.writestr('study/notes.txt', b'not dicom')
+    instances = expand_uploads([BufferedUpload('study.zip', buffer.getvalue())])
+    assert sorted(upload.filename for upload in instances) == ['study.zip/study/a.dcm', 'study.zip/study/b']
+    [series] = group_series(instances)
+    assert slice_values(series) == [1, 2]
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from utils.triage import SliceTriage
+from utils.ensemble import predict_triaged
+
+def probs_for(sampled, positive, pixels=50):
+    # Triage predictions with `pixels` foreground pixels on the positive slices
+    probs = np.zeros((len(sampled), 128, 128), dtype=np.float32)
+    for row, idx in enumerate(sampled):
+        if idx in positive:
+            probs[row].flat[:pixels] = 1.0
+    return probs
+
+def test_samples_include_last_slice():
+    triage = SliceTriage(stride=3, min_depth=4)
+    np.testing.assert_array_equal(triage.samples(10), [0, 3, 6, 9])
+    np.testing.assert_array_equal(triage.samples(11), [0, 3, 6, 9, 10])
+    assert len(triage.samples(3)) == 0
+
+@pytest.mark.parametrize("positive, expected", [
+    ({8, 10}, (5, 14)),    # Widened by stride - 1 and the margin on both sides
+    ({0}, (0, 4)),         # Clipped at the first slice
+    ({19}, (16, 20)),      # And at the last one
+    ({4, 16}, (1, 20)),
+])
+def test_keep_range(positive, expected):
+    triage = SliceTriage(stride=2, margin=2, min_pixels=20, min_depth=8)
+    sampled = triage.samples(20)
+    keep = triage.keep(20, sampled, probs_for(sampled, positive))
+    np.testing.assert_array_equal(keep, np.arange(*expected))
+
+def test_keep_everything_when_nothing_found():
+    triage = SliceTriage(stride=2, margin=2, min_pixels=20, min_depth=8)
+    sampled = triage.samples(20)
+    np.testing.assert_array_equal(triage.keep(20, sampled, probs_for(sampled, {8}, pixels=5)), np.arange(20))
+    np.testing.assert_array_equal(triage.keep(5, triage.samples(5), np.zeros((0, 128, 128))), np.arange(5))
+
+class Recorder:
+    """
+    Model stand-in predicting 1 on slices whose input is positive, recording the slices it saw.
+    """
+
+    def __init__(self):
+        self.seen = []
+
+    def predict(self, batch, max_batch_size=None):
+        self.seen.append(batch[:, 0, 0, 0].copy())
+        return (batch[..., 0] > 0).astype(np.float32)
+
+def test_predict_triaged_skips_slices_outside_the_range():
+    # Two volumes of 12 slices, the gland is on slices 6-7 of the first one only
+    batch = np.zeros((24, 128, 128, 1), dtype=np.float32)
+    batch[6:8] = 1.0
+    batch[:, 0, 0, 0] = np.arange(24)  # Slice ids, read back by Recorder (one pixel, below min_pixels)
+    triage_model, full_model = Recorder(), Recorder()
+    triage = SliceTriage(triage_model, stride=2, margin=1, min_pixels=20, min_depth=8).track()
+
+    avg_pred = predict_triaged(full_model, batch, [(0, 12), (12, 24)], triage)
+
+    np.testing.assert_array_equal(triage_model.seen[0], [0, 2, 4, 6, 8, 10, 11, 12, 14, 16, 18, 20, 22, 23])
+    # First volume: positive sample 6 -> range [4, 9); second volume: nothing found -> all kept
+    np.testing.assert_array_equal(full_model.seen[0], list(range(4, 9)) + list(range(12, 24)))
+    assert avg_pred[6:8, 1:, 1:].all()
+    assert not avg_pred[:4].any() and not avg_pred[9:12].any()
+    assert triage.usage.to_dict()["skipped_slices"] == 7
+    assert triage.parent.usage.to_dict()["skipped_slices"] == 7
@@ -0,0 +1,162 @@
+import time
+import threading
+from collections import deque
+
+# Model input size and the buffers held per slice while inferring: batch, predictions, masks
+MODEL_SLICE_BYTES = 128 * 128 * 4 * 3
+
+def estimate_cost(frames, rows, columns, overlay_scale=1, overlays=True):
+    """
+    Peak memory of predicting a study, estimated from its header fields
+    before anything is decoded: the float32 volume, the model buffers, the
+    8-bit display slices and, with overlays, the upscaled RGB overlays.
+    """
+    pixels = frames * rows * columns
+    cost = pixels * 4 + frames * MODEL_SLICE_BYTES + pixels
+    if overlays:
+        cost += pixels * overlay_scale * overlay_scale * 3
+    return cost
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request cannot be admitted: status is 413 when it exceeds
+    the whole budget, 429 when the budget is busy and the wait queue is full
+    or the wait timed out.
+    """
+
+    def __init__(self, status, reason, retry_after=None):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+class Ticket:
+    """
+    Share of the budget held by one admitted request, released once.
+    """
+
+    def __init__(self, controller, nbytes, slices):
+        self.controller = controller
+        self.nbytes = nbytes
+        self.slices = slices
+        self.since = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+class AdmissionController:
+    """
+    Global budget of in-flight memory and slices for prediction requests.
+
+    Requests that fit are admitted right away. Otherwise they wait in a
+    queue of at most max_waiting requests for up to max_wait seconds and are
+    rejected with 429 past either limit, so bursts are shed quickly instead
+    of piling up decoded volumes. Requests larger than the whole budget get 413.
+
+    A waiting request does not block later, smaller requests that fit until
+    it has waited reserve_after seconds; from then on it keeps its place, so
+    normal studies are not stuck behind a large one and large ones still run.
+    """
+
+    def __init__(self, max_bytes, max_slices, max_waiting=8, max_wait=10.0, reserve_after=1.0, retry_after=2):
+        self.max_bytes = max_bytes
+        self.max_slices = max_slices
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.reserve_after = reserve_after
+        self.retry_after = retry_after
+        self.bytes = 0
+        self.slices = 0
+        self.active = 0
+        self.admitted = 0
+        self.rejected = {413: 0, 429: 0}
+        self.total_wait = 0.0
+        self._waiting = deque()
+        self._changed = threading.Condition()
+
+    def _fits(self, ticket):
+        return self.bytes + ticket.nbytes <= self.max_bytes and self.slices + ticket.slices <= self.max_slices
+
+    def _admissible(self, ticket):
+        if not self._fits(ticket):
+            return False
+        now = time.monotonic()
+        for other in self._waiting:
+            if other is ticket:
+                return True
+            if now - other.since >= self.reserve_after:
+                return False  # An older request holds its place
+        return True
+
+    def _admit(self, ticket):
+        self.bytes += ticket.nbytes
+        self.slices += ticket.slices
+        self.active += 1
+        self.admitted += 1
+        self.total_wait += time.monotonic() - ticket.since
+
+    def acquire(self, nbytes, slices, max_wait=None):
+        """
+        Block until the request fits the budget and return its Ticket, or
+        raise AdmissionRejected.
+        """
+        ticket = Ticket(self, nbytes, slices)
+        with self._changed:
+            if nbytes > self.max_bytes or slices > self.max_slices:
+                self.rejected[413] += 1
+                raise AdmissionRejected(413, "Request exceeds the server's memory budget")
+            if self._admissible(ticket):
+                self._admit(ticket)
+                return ticket
+            if len(self._waiting) >= self.max_waiting:
+                self.rejected[429] += 1
+                raise AdmissionRejected(429, "Server busy", self.retry_after)
+
+            self._waiting.append(ticket)
+            deadline = ticket.since + (self.max_wait if max_wait is None else max_wait)
+            try:
+                while not self._admissible(ticket):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected[429] += 1
+                        raise AdmissionRejected(429, "Timed out waiting for capacity", self.retry_after)
+                    # Re-checked periodically, reservations depend on time passing
+                    self._changed.wait(min(remaining, self.reserve_after))
+                self._admit(ticket)
+                return ticket
+            finally:
+                self._waiting.remove(ticket)
+                self._changed.notify_all()
+
+    def _release(self, ticket):
+        with self._changed:
+            self.bytes -= ticket.nbytes
+            self.slices -= ticket.slices
+            self.active -= 1
+            self._changed.notify_all()
+
+    def stats(self):
+        with self._changed:
+            return {
+                "in_flight_requests": self.active,
+                "in_flight_bytes": self.bytes,
+                "in_flight_slices": self.slices,
+                "max_bytes": self.max_bytes,
+                "max_slices": self.max_slices,
+                "bytes_fraction": round(self.bytes / self.max_bytes, 4) if self.max_bytes else 0.0,
+                "waiting": len(self._waiting),
+                "max_waiting": self.max_waiting,
+                "admitted": self.admitted,
+                "rejected": {str(status): count for status, count in self.rejected.items()},
+                "avg_wait_ms": round(self.total_wait / self.admitted * 1000, 3) if self.admitted else 0.0,
+            }
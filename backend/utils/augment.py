@@ -0,0 +1,170 @@
+import numpy as np
+import tensorflow as tf
+
+# Augmentations of the training notebook; keys and defaults match its `augmentations` dict
+DEFAULT_AUGMENTATIONS = {
+    'zoom': True,
+    'zoom_range': (0.9, 1.1),
+    'shift': True,
+    'shift_range': 10,
+    'elastic': True,
+    'elastic_alpha': 1000,
+    'elastic_sigma': 50,
+    'noise': True,
+    'noise_mean': 0,
+    'noise_std': 0.01,
+    'rotation': True,
+    'rotation_range': (-15, 15),
+    'flip': True,
+    'brightness_contrast': True,
+    'brightness_range': (0.8, 1.2),
+    'contrast_range': (0.8, 1.2),
+    'clip_range': (0.0, 1.0),
+}
+
+def gaussian_kernel(sigma, size):
+    """
+    Normalized 1D Gaussian taps, truncated at 4 sigma like scipy and at the
+    image size, past which a zero-padded blur gets no contribution.
+    """
+    radius = max(1, min(int(4 * sigma + 0.5), size - 1))
+    x = np.arange(-radius, radius + 1, dtype=np.float64)
+    kernel = np.exp(-0.5 * (x / sigma) ** 2)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+def _sample(images, y, x, nearest=False):
+    """
+    Sample images (B, H, W, C) at the float coordinates y, x (B, H, W),
+    bilinear or nearest, with border pixels repeated outside the image.
+    """
+    height, width = images.shape[1], images.shape[2]
+    batch = tf.shape(images)[0]
+    b = tf.broadcast_to(tf.range(batch)[:, None, None], tf.shape(y))
+
+    def gather(yi, xi):
+        yi = tf.clip_by_value(yi, 0, height - 1)
+        xi = tf.clip_by_value(xi, 0, width - 1)
+        return tf.gather_nd(images, tf.stack([b, yi, xi], axis=-1))
+
+    if nearest:
+        return gather(tf.cast(tf.round(y), tf.int32), tf.cast(tf.round(x), tf.int32))
+
+    y0, x0 = tf.floor(y), tf.floor(x)
+    wy, wx = (y - y0)[..., None], (x - x0)[..., None]
+    y0, x0 = tf.cast(y0, tf.int32), tf.cast(x0, tf.int32)
+    top = gather(y0, x0) * (1 - wx) + gather(y0, x0 + 1) * wx
+    bottom = gather(y0 + 1, x0) * (1 - wx) + gather(y0 + 1, x0 + 1) * wx
+    return top * (1 - wy) + bottom * wy
+
+class BatchAugmenter:
+    """
+    The notebook's slice augmentations (zoom, shift, elastic, noise, rotation,
+    flip, brightness/contrast) applied to a whole batch of images and masks
+    (B, H, W, 1) with TensorFlow ops, so it runs as a parallel tf.data map stage:
+
+        make_dataset(directories, seed=0, augment=BatchAugmenter(augmentations))
+
+    Parameters are drawn per sample in one vectorized call per transform from
+    stateless RNG seeded by the call's seed, so a seeded run is reproducible.
+    The geometric transforms are composed into one sampling grid per sample:
+    images are resampled once (bilinear), masks with nearest neighbour.
+    Elastic displacement fields are blurred as one batch with a separable
+    Gaussian whose taps are computed once.
+    """
+
+    def __init__(self, augmentations=None):
+        self.config = dict(DEFAULT_AUGMENTATIONS if augmentations is None else augmentations)
+        self._kernels = {}
+
+    def enabled(self, name):
+        # Like the notebook, a transform missing from the dict is off
+        return bool(self.config.get(name, False))
+
+    def get(self, name):
+        return self.config.get(name, DEFAULT_AUGMENTATIONS.get(name))
+
+    def _kernel(self, size):
+        # Taps are cached as NumPy arrays; a cached tensor would belong to the graph that traced it
+        if size not in self._kernels:
+            self._kernels[size] = gaussian_kernel(self.get('elastic_sigma'), size)
+        return tf.constant(self._kernels[size])
+
+    def displacement(self, batch, height, width, seed):
+        """
+        Elastic displacement fields (B, H, W, 2): uniform noise in [-1, 1]
+        blurred with zero padding and scaled by elastic_alpha.
+        """
+        noise = tf.random.stateless_uniform([batch, height, width, 2], seed, -1.0, 1.0)
+        rows = self._kernel(height)
+        cols = self._kernel(width)
+        noise = tf.nn.depthwise_conv2d(noise, tf.tile(rows[:, None, None, None], [1, 1, 2, 1]),
+                                       [1, 1, 1, 1], 'SAME')
+        noise = tf.nn.depthwise_conv2d(noise, tf.tile(cols[None, :, None, None], [1, 1, 2, 1]),
+                                       [1, 1, 1, 1], 'SAME')
+        return noise * float(self.get('elastic_alpha'))
+
+    def __call__(self, images, masks, seed=(0, 0)):
+        """
+        Augment a batch; seed is a shape [2] integer tensor, e.g. (run seed, step).
+        """
+        height, width = images.shape[1], images.shape[2]
+        batch = tf.shape(images)[0]
+        seeds = tf.random.experimental.stateless_split(tf.cast(seed, tf.int64), num=8)
+
+        def uniform(idx, low, high, shape=None):
+            return tf.random.stateless_uniform(shape if shape is not None else [batch], seeds[idx], low, high)
+
+        # Output pixel -> input coordinates, relative to the image center
+        cy, cx = (height - 1) / 2.0, (width - 1) / 2.0
+        grid_y, grid_x = tf.meshgrid(tf.range(height, dtype=tf.float32) - cy,
+                                     tf.range(width, dtype=tf.float32) - cx, indexing='ij')
+        y = tf.broadcast_to(grid_y, [batch, height, width])
+        x = tf.broadcast_to(grid_x, [batch, height, width])
+        geometric = False
+
+        if self.enabled('flip'):
+            flips = tf.where(uniform(0, 0.0, 1.0, [batch, 2]) > 0.5, -1.0, 1.0)
+            y, x = y * flips[:, 0, None, None], x * flips[:, 1, None, None]
+            geometric = True
+        if self.enabled('rotation'):
+            low, high = self.get('rotation_range')
+            angle = uniform(1, float(low), float(high)) * (np.pi / 180.0)
+            cos, sin = tf.cos(angle)[:, None, None], tf.sin(angle)[:, None, None]
+            y, x = cos * y - sin * x, sin * y + cos * x
+            geometric = True
+        if self.enabled('elastic'):
+            field = self.displacement(batch, height, width, seeds[2])
+            y, x = y + field[..., 0], x + field[..., 1]
+            geometric = True
+        if self.enabled('shift'):
+            shift_range = float(self.get('shift_range'))
+            shifts = uniform(3, -shift_range, shift_range, [batch, 2])
+            y, x = y - shifts[:, 0, None, None], x - shifts[:, 1, None, None]
+            geometric = True
+        if self.enabled('zoom'):
+            low, high = self.get('zoom_range')
+            scale = uniform(4, float(low), float(high))[:, None, None]
+            y, x = y / scale, x / scale
+            geometric = True
+
+        if geometric:
+            y, x = y + cy, x + cx
+            images = _sample(images, y, x)
+            masks = _sample(masks, y, x, nearest=True)
+
+        clip = self.get('clip_range')
+        if self.enabled('noise'):
+            noise = tf.random.stateless_normal(tf.shape(images), seeds[5], float(self.get('noise_mean')),
+                                               float(self.get('noise_std')))
+            images = images + noise
+            if clip is not None:
+                images = tf.clip_by_value(images, *clip)
+        if self.enabled('brightness_contrast'):
+            brightness = uniform(6, *map(float, self.get('brightness_range')), [batch, 1, 1, 1])
+            contrast = uniform(7, *map(float, self.get('contrast_range')), [batch, 1, 1, 1])
+            images = images * brightness
+            mean = tf.reduce_mean(images, axis=[1, 2, 3], keepdims=True)
+            images = (images - mean) * contrast + mean
+            if clip is not None:
+                images = tf.clip_by_value(images, *clip)
+        return images, masks
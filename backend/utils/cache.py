@@ -0,0 +1,171 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.bcolors import bcolors
+
+#################################
+#  Content-addressed cache keys #
+#################################
+
+def dicom_cache_key(dcm, namespace="", pixel_data=None, **params):
+    """
+    Build a content-addressed key for a DICOM dataset.
+    The key covers the raw PixelData bytes, the header fields that affect the
+    decoded values, the model-set namespace and any preprocessing parameters,
+    so it can be computed without decoding the pixel array.
+    pixel_data may be a zero-copy array view of PixelData to hash in place.
+    """
+    h = hashlib.sha256()
+    h.update(namespace.encode('utf-8'))
+    for name in ('Rows', 'Columns', 'NumberOfFrames', 'SamplesPerPixel', 'BitsAllocated', 'BitsStored',
+                 'PixelRepresentation', 'RescaleSlope', 'RescaleIntercept'):
+        h.update(f"{name}={getattr(dcm, name, None)};".encode('utf-8'))
+    transfer_syntax = getattr(getattr(dcm, 'file_meta', None), 'TransferSyntaxUID', None)
+    h.update(f"TransferSyntaxUID={transfer_syntax};".encode('utf-8'))
+    for name in sorted(params):
+        h.update(f"{name}={params[name]};".encode('utf-8'))
+    if pixel_data is not None:
+        h.update(memoryview(np.ascontiguousarray(pixel_data)).cast('B'))
+    else:
+        h.update(bytes(dcm.PixelData))
+    return h.hexdigest()
+
+def series_cache_key(instance_keys, namespace=""):
+    """
+    Key of a series assembled from several instances, given their
+    dicom_cache_key()s in slice order.
+    """
+    h = hashlib.sha256()
+    h.update(f"series:{namespace};".encode('utf-8'))
+    for key in instance_keys:
+        h.update(key.encode('utf-8'))
+    return h.hexdigest()
+
+def model_fingerprint(paths):
+    """
+    Identify a model set by its file paths, sizes and modification times,
+    so retrained weights never reuse stale cache entries.
+    """
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(path.encode('utf-8'))
+        if os.path.exists(path):
+            st = os.stat(path)
+            h.update(f"{st.st_size}:{int(st.st_mtime)}".encode('utf-8'))
+    return h.hexdigest()[:16]
+
+#######################
+#  Prediction Cache   #
+#######################
+
+class PredictionCache:
+    """
+    Bounded in-memory LRU of per-study prediction results with an optional
+    on-disk tier that survives restarts.
+
+    Each entry stores the binarized masks (depth, 128, 128) and the 8-bit
+    display slices (depth, H, W), which is everything needed to render the
+    overlays again without decoding the DICOM or running the ensemble.
+    Memory usage is bounded by max_bytes; max_bytes=0 keeps only the disk tier.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, disk_dir=None, namespace=""):
+        self.max_bytes = max_bytes
+        self.namespace = namespace  # Model-set version, part of every key
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def _entry_bytes(entry):
+        return sum(arr.nbytes for arr in entry.values())
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.npz")
+
+    def get(self, key):
+        """
+        Return the cached entry dict ('masks', 'display') or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            try:
+                with np.load(self._disk_path(key)) as data:
+                    entry = {name: data[name] for name in data.files}
+            except Exception as e:
+                print(bcolors.WARNING + f"[Cache] Could not read '{key}' from disk: {e}" + bcolors.ENDC)
+            else:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._insert(key, entry)
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, masks, display):
+        """
+        Store the masks and display slices of a study under key.
+        """
+        entry = {
+            'masks': np.ascontiguousarray(masks, dtype=np.uint8),
+            'display': np.ascontiguousarray(display, dtype=np.uint8),
+        }
+        with self._lock:
+            self._insert(key, entry)
+
+        if self.disk_dir:
+            tmp_path = self._disk_path(key) + ".tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    np.savez_compressed(f, **entry)
+                os.replace(tmp_path, self._disk_path(key))
+            except Exception as e:
+                print(bcolors.WARNING + f"[Cache] Could not write '{key}' to disk: {e}" + bcolors.ENDC)
+
+    def _insert(self, key, entry):
+        # Caller holds the lock
+        if key in self._entries:
+            self._size -= self._entry_bytes(self._entries.pop(key))
+        size = self._entry_bytes(entry)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._size += size
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= self._entry_bytes(evicted)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Return hit/miss/eviction counters and current memory usage.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
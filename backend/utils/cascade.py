@@ -0,0 +1,154 @@
+import os
+import threading
+
+import numpy as np
+
+class CascadeUsage:
+    """
+    Counts how many slices the cascade answered with its first member alone.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.slices = 0
+        self.ensemble_slices = 0
+
+    def add(self, slices, ensemble_slices):
+        with self._lock:
+            self.slices += slices
+            self.ensemble_slices += ensemble_slices
+
+    def to_dict(self):
+        with self._lock:
+            short_circuited = self.slices - self.ensemble_slices
+            return {
+                "slices": self.slices,
+                "ensemble_slices": self.ensemble_slices,
+                "short_circuited": short_circuited,
+                "short_circuit_fraction": round(short_circuited / self.slices, 4) if self.slices else 0.0,
+            }
+
+def member_cost(model):
+    """
+    Rough inference cost of an ensemble member: its parameter count for Keras
+    models, the artifact size for converted ones.
+    """
+    if hasattr(model, 'count_params'):
+        return model.count_params()
+    path = getattr(model, 'path', None)
+    if path and os.path.exists(path):
+        return os.path.getsize(path)
+    return 0
+
+class CascadeEnsemble:
+    """
+    Confidence-gated ensemble: the cheapest member runs on every slice and the
+    remaining members only run on slices where its probability map is not
+    clear-cut, i.e. where more than max_uncertain_fraction of the pixels lie
+    in (band, 1 - band) or the predicted region exceeds max_region_pixels.
+    Short-circuited slices keep the first member's probabilities, the others
+    get the average of all members as in the full ensemble.
+
+    Exposes predict(batch, max_batch_size) like FusedEnsemble.
+
+    Args:
+        members: ensemble members with Keras' predict(batch, batch_size, verbose).
+        band: probabilities within band of 0 or 1 count as confident.
+        max_uncertain_fraction: share of uncertain pixels a slice may have and still be short-circuited.
+        max_region_pixels: size of the predicted region (p > threshold) a short-circuited slice may have.
+    """
+
+    def __init__(self, members, band=0.1, max_uncertain_fraction=0.001, max_region_pixels=0, threshold=0.5):
+        self.members = sorted(members, key=member_cost)
+        self.band = band
+        self.max_uncertain_fraction = max_uncertain_fraction
+        self.max_region_pixels = max_region_pixels
+        self.threshold = threshold
+        self.usage = CascadeUsage()
+
+    def __len__(self):
+        return len(self.members)
+
+    @property
+    def signature(self):
+        """
+        Gating parameters, part of the cache namespace since they change the output.
+        """
+        return f"cascade:{self.band}:{self.max_uncertain_fraction}:{self.max_region_pixels}"
+
+    def needs_ensemble(self, probs):
+        """
+        Boolean per slice of probs (N, 128, 128): True where the remaining members must run.
+        """
+        flat = probs.reshape(len(probs), -1)
+        uncertain = np.count_nonzero((flat > self.band) & (flat < 1 - self.band), axis=1)
+        region = np.count_nonzero(flat > self.threshold, axis=1)
+        return (uncertain > self.max_uncertain_fraction * flat.shape[1]) | (region > self.max_region_pixels)
+
+    def predict(self, batch, max_batch_size=32, usage=None):
+        """
+        Returns probability maps of shape (N, 128, 128) for a batch (N, 128, 128, 1).
+        usage, if given, also receives this call's counts (per-request reporting).
+        """
+        batch = np.asarray(batch, dtype=np.float32)
+        probs = self.members[0].predict(batch, batch_size=max_batch_size, verbose=0)[..., 0].astype(np.float32)
+
+        escalate = np.flatnonzero(self.needs_ensemble(probs)) if len(self.members) > 1 else np.zeros(0, dtype=int)
+        if len(escalate):
+            subset = batch[escalate]
+            total = probs[escalate]
+            for model in self.members[1:]:
+                total += model.predict(subset, batch_size=max_batch_size, verbose=0)[..., 0]
+            probs[escalate] = total / len(self.members)
+
+        self.usage.add(len(batch), len(escalate))
+        if usage is not None:
+            usage.add(len(batch), len(escalate))
+        return probs
+
+    def track(self):
+        """
+        Per-request view of the cascade whose usage only counts its own slices.
+        """
+        return TrackedCascade(self)
+
+class TrackedCascade:
+    """
+    Passed in place of the cascade for one request, see CascadeEnsemble.track.
+    """
+
+    def __init__(self, cascade):
+        self.cascade = cascade
+        self.usage = CascadeUsage()
+
+    def __len__(self):
+        return len(self.cascade)
+
+    def predict(self, batch, max_batch_size=32):
+        return self.cascade.predict(batch, max_batch_size, usage=self.usage)
+
+def measure_cascade(cascade, batch, max_batch_size=32, threshold=0.5):
+    """
+    Agreement (Dice of the thresholded masks) of the cascade with the full
+    ensemble of its members on a preprocessed batch, and the compute it saved.
+    """
+    full = np.zeros(batch.shape[:3], dtype=np.float32)
+    for model in cascade.members:
+        full += model.predict(batch, batch_size=max_batch_size, verbose=0)[..., 0]
+    full /= len(cascade.members)
+
+    usage = CascadeUsage()
+    gated = cascade.predict(batch, max_batch_size, usage=usage)
+    a = full > threshold
+    b = gated > threshold
+    total = a.sum() + b.sum()
+    dice = 1.0 if total == 0 else float(2. * np.logical_and(a, b).sum() / total)
+
+    stats = usage.to_dict()
+    member_calls = stats["slices"] + stats["ensemble_slices"] * (len(cascade.members) - 1)
+    return {
+        "dice": dice,
+        "differing_pixels": int(np.count_nonzero(a != b)),
+        "member_calls_saved": round(1 - member_calls / (stats["slices"] * len(cascade.members)), 4) if stats["slices"] else 0.0,
+        **stats,
+    }
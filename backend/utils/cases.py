@@ -0,0 +1,282 @@
+import os
+import re
+import time
+import hashlib
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import cv2
+
+from utils.bcolors import bcolors
+
+try:
+    import SimpleITK as sitk
+except ImportError:  # Only needed to preprocess the raw training cases
+    sitk = None
+
+# Image files of a PROSTATEx series directory
+PROSTATEX_IMAGE_PATTERN = r".*\.dcm$"
+
+# Bump when a loader changes its output, so cached cases are recomputed
+CASE_FORMAT_VERSION = 1
+
+def _require_sitk():
+    if sitk is None:
+        raise ImportError("SimpleITK is required to read the training cases (pip install SimpleITK)")
+
+##################
+#  Case Loading  #
+##################
+
+def case_paths(data_dir, split='train'):
+    """
+    (image, mask) paths of the CaseXX.mhd files of a split that have a
+    CaseXX_segmentation.mhd next to them.
+    """
+    pairs = []
+    for image_path in sorted((Path(data_dir) / split).glob("Case*.mhd")):
+        if image_path.stem.endswith("_segmentation"):
+            continue
+        mask_path = image_path.parent / (image_path.stem + "_segmentation.mhd")
+        if mask_path.exists():
+            pairs.append((image_path, mask_path))
+    return pairs
+
+def resample_image_and_mask(image_path, mask_path, new_spacing=(1.0, 1.0, 1.0)):
+    """
+    Resample an image (linear) and its mask (nearest neighbour) to new_spacing
+    (x, y, z in mm, SimpleITK order). Returns float32 arrays (z, y, x), the
+    mask binarized.
+    """
+    _require_sitk()
+    image_sitk = sitk.ReadImage(str(image_path))
+    mask_sitk = sitk.ReadImage(str(mask_path))
+
+    original_spacing = image_sitk.GetSpacing()
+    original_size = image_sitk.GetSize()
+    new_size = [int(np.round(original_size[i] * (original_spacing[i] / new_spacing[i]))) for i in range(3)]
+
+    def resample(volume, interpolator):
+        return sitk.Resample(volume, new_size, sitk.Transform(), interpolator, volume.GetOrigin(),
+                             tuple(new_spacing), volume.GetDirection(), 0, volume.GetPixelID())
+
+    image = sitk.GetArrayFromImage(resample(image_sitk, sitk.sitkLinear)).astype(np.float32)
+    mask = (sitk.GetArrayFromImage(resample(mask_sitk, sitk.sitkNearestNeighbor)) > 0).astype(np.float32)
+    return image, mask
+
+def normalize_image(image):
+    """
+    Zero mean and unit variance over the whole volume.
+    """
+    return ((image - image.mean()) / (image.std() + 1e-8)).astype(np.float32)
+
+def preprocess_case_2d(image_path, mask_path, new_spacing=(1.0, 1.0, 1.0)):
+    """
+    Resampled, normalized volume and binary mask of one case.
+    """
+    image, mask = resample_image_and_mask(image_path, mask_path, new_spacing)
+    return normalize_image(image), mask
+
+def pad_or_crop_volume(volume, target_depth):
+    """
+    Center-crop or zero-pad the first axis of volume to target_depth slices.
+    """
+    depth = volume.shape[0]
+    if depth > target_depth:
+        start = (depth - target_depth) // 2
+        return volume[start:start + target_depth]
+    if depth < target_depth:
+        before = (target_depth - depth) // 2
+        return np.pad(volume, ((before, target_depth - depth - before), (0, 0), (0, 0)), mode='constant')
+    return volume
+
+def series_files(directory, pattern=PROSTATEX_IMAGE_PATTERN):
+    return sorted(str(p) for p in Path(directory).iterdir() if re.match(pattern, p.name))
+
+def prostatex_cases(segmentation_dir, images_dir, segmentation_filename="1-1.dcm"):
+    """
+    (patient, mask path, image directory) of every PROSTATEx patient with
+    both a segmentation and an image series.
+    """
+    cases = []
+    for patient_dir in sorted(p for p in Path(segmentation_dir).iterdir() if p.is_dir()):
+        mask_path = patient_dir / segmentation_filename
+        image_dir = Path(images_dir) / patient_dir.name
+        if mask_path.exists() and image_dir.is_dir():
+            cases.append((patient_dir.name, mask_path, image_dir))
+    return cases
+
+def load_prostatex_case(mask_path, image_dir, target_depth=16, size=(128, 128)):
+    """
+    Image series and segmentation of one PROSTATEx patient, cropped/padded to
+    target_depth slices and resized to size. The image keeps its raw values
+    (the PROSTATEx set is min-max normalized as a whole); the mask is binary.
+    """
+    _require_sitk()
+    mask = sitk.GetArrayFromImage(sitk.ReadImage(str(mask_path)))
+    if mask.ndim == 2:
+        mask = mask[None]
+    files = series_files(image_dir)
+    if not files:
+        raise IOError(f"No image files in '{image_dir}'")
+    reader = sitk.ImageSeriesReader()
+    reader.SetFileNames(files)
+    image = sitk.GetArrayFromImage(reader.Execute())
+
+    image = pad_or_crop_volume(image, target_depth).astype(np.float32)
+    mask = pad_or_crop_volume(mask, target_depth).astype(np.float32)
+    height, width = size
+    image = np.stack([cv2.resize(s, (width, height), interpolation=cv2.INTER_LINEAR) for s in image])
+    mask = np.stack([cv2.resize(s, (width, height), interpolation=cv2.INTER_NEAREST) for s in mask]) > 0.5
+    return image, mask.astype(np.float32)
+
+#########################
+#  Resample Cache       #
+#########################
+
+def _data_files(path):
+    # A .mhd header references its pixel data in ElementDataFile
+    path = Path(path)
+    if path.is_dir():
+        return [Path(p) for p in sorted(str(p) for p in path.iterdir() if p.is_file())]
+    files = [path]
+    if path.suffix.lower() == '.mhd':
+        with open(path, errors='replace') as f:
+            for line in f:
+                name, _, value = line.partition('=')
+                if name.strip() == 'ElementDataFile' and value.strip() != 'LOCAL':
+                    files.append(path.parent / value.strip())
+    return files
+
+def file_digest(paths, chunk_size=1 << 20):
+    """
+    sha256 over the contents of paths (directories hash every file in them,
+    .mhd headers also hash their data file).
+    """
+    h = hashlib.sha256()
+    for path in paths:
+        for data_file in _data_files(path):
+            h.update(data_file.name.encode('utf-8'))
+            with open(data_file, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    h.update(chunk)
+    return h.hexdigest()
+
+class ResampleCache:
+    """
+    Content-addressed on-disk cache of preprocessed cases. Entries are keyed
+    by the hash of the source files, the loader and its parameters (e.g. the
+    target spacing), so changing the data or the spacing only recomputes the
+    affected cases. Each entry is an image and a mask .npy file.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def key(self, paths, loader, **params):
+        h = hashlib.sha256()
+        h.update(f"{loader}:v{CASE_FORMAT_VERSION};".encode('utf-8'))
+        for name in sorted(params):
+            value = params[name]
+            if isinstance(value, (list, tuple)):
+                value = tuple(value)  # Same key for spacing=[1, 1, 1] and (1, 1, 1)
+            h.update(f"{name}={value};".encode('utf-8'))
+        h.update(file_digest(paths).encode('utf-8'))
+        return h.hexdigest()
+
+    def _paths(self, key):
+        base = self.directory / key[:2] / key
+        return base.with_suffix('.image.npy'), base.with_suffix('.mask.npy')
+
+    def __contains__(self, key):
+        return all(path.exists() for path in self._paths(key))
+
+    def load(self, key, mmap_mode='r'):
+        image_path, mask_path = self._paths(key)
+        return np.load(image_path, mmap_mode=mmap_mode), np.load(mask_path, mmap_mode=mmap_mode)
+
+    def store(self, key, image, mask):
+        for path, array in zip(self._paths(key), (image, mask)):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with open(tmp, 'wb') as f:
+                np.save(f, np.ascontiguousarray(array, dtype=np.float32))
+            os.replace(tmp, path)  # Atomic, readers never see partial entries
+
+########################
+#  Parallel Processing #
+########################
+
+LOADERS = {
+    "mhd": preprocess_case_2d,
+    "prostatex": load_prostatex_case,
+}
+
+def process_case(loader, name, paths, params, cache_dir):
+    """
+    Preprocess one case into the cache unless an entry for the same content
+    and parameters exists. Runs in a worker process; returns a report dict
+    with 'case', 'key', 'cached', 'seconds' and 'error'.
+    """
+    start = time.perf_counter()
+    report = {"case": name, "key": None, "cached": False, "error": None}
+    try:
+        cache = ResampleCache(cache_dir)
+        report["key"] = key = cache.key(paths, loader, **params)
+        if key in cache:
+            report["cached"] = True
+        else:
+            image, mask = LOADERS[loader](*paths, **params)
+            cache.store(key, image, mask)
+    except Exception as e:
+        report["error"] = f"{type(e).__name__}: {e}"
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+def preprocess_cases(cases, loader, cache_dir, workers=1, **params):
+    """
+    Preprocess cases [(name, paths)] with LOADERS[loader] over a pool of
+    worker processes, printing the timing or failure of every case.
+    Returns the reports in the order of cases.
+    """
+    total = len(cases)
+
+    def log(idx, report):
+        if report["error"]:
+            print(bcolors.FAIL + f"[{idx + 1}/{total}] {report['case']} failed: {report['error']}" + bcolors.ENDC)
+        else:
+            state = "cached" if report["cached"] else "processed"
+            print(f"[{idx + 1}/{total}] {report['case']} {state} in {report['seconds']:.2f}s")
+
+    reports = [None] * total
+    if workers <= 1:
+        for idx, (name, paths) in enumerate(cases):
+            reports[idx] = process_case(loader, name, paths, params, cache_dir)
+            log(idx, reports[idx])
+        return reports
+
+    # Spawned workers only import this module, not the parent's TensorFlow state
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(process_case, loader, name, paths, params, cache_dir): idx
+                   for idx, (name, paths) in enumerate(cases)}
+        for future in as_completed(futures):
+            idx = futures[future]
+            reports[idx] = future.result()
+            log(idx, reports[idx])
+    return reports
+
+def summarize(reports):
+    """
+    Counts and total time of a list of case reports.
+    """
+    return {
+        "cases": len(reports),
+        "processed": sum(1 for r in reports if not r["cached"] and not r["error"]),
+        "cached": sum(1 for r in reports if r["cached"]),
+        "failed": [r["case"] for r in reports if r["error"]],
+        "errors": {r["case"]: r["error"] for r in reports if r["error"]},
+        "seconds": round(sum(r["seconds"] for r in reports), 3),
+    }
@@ -0,0 +1,293 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+
+from utils.bcolors import bcolors
+from utils.cases import case_paths, prostatex_cases, preprocess_cases, summarize, ResampleCache
+
+# Slices per .npy shard, about 64 MB of 128x128 float32 images
+SHARD_SLICES = 1024
+
+######################
+#  Slice Processing  #
+######################
+
+def crop_or_pad(volume, target_shape):
+    """
+    Center-crop or zero-pad the last two axes of volume (..., H, W) to target_shape.
+    """
+    out = np.zeros(volume.shape[:-2] + tuple(target_shape), dtype=volume.dtype)
+    src, dst = [], []
+    for size, target in zip(volume.shape[-2:], target_shape):
+        if size >= target:
+            start = (size - target) // 2
+            src.append(slice(start, start + target))
+            dst.append(slice(0, target))
+        else:
+            start = (target - size) // 2
+            src.append(slice(0, size))
+            dst.append(slice(start, start + size))
+    out[(..., *dst)] = volume[(..., *src)]
+    return out
+
+def normalize_min_max(images):
+    """
+    Scale a stack of slices to [0, 1] with its global minimum and maximum,
+    as the PROSTATEx slices are normalized for training.
+    """
+    lo, hi = float(images.min()), float(images.max())
+    return ((images - lo) / (hi - lo if hi > lo else 1.0)).astype(np.float32)
+
+##################
+#  Slice Shards  #
+##################
+
+def shard_key(name, spacing=None, patch_size=(128, 128)):
+    """
+    Directory name of a shard set, e.g. train_sp1.0x1.0x1.0_ps128x128.
+    """
+    key = name
+    if spacing is not None:
+        key += "_sp" + "x".join(f"{s:g}" for s in spacing)
+    return key + "_ps" + "x".join(str(s) for s in patch_size)
+
+class ShardWriter:
+    """
+    Append (slices, H, W) images and masks and write them out as fixed-size
+    images-NNNNN.npy (float32) / masks-NNNNN.npy (uint8) shards plus a
+    manifest.json describing them.
+    """
+
+    def __init__(self, directory, patch_size=(128, 128), shard_slices=SHARD_SLICES):
+        self.directory = Path(directory)
+        self.patch_size = tuple(patch_size)
+        self.shard_slices = shard_slices
+        self.shards = []
+        self._images = []
+        self._masks = []
+        self._pending = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def add(self, images, masks):
+        self._images.append(np.asarray(images, dtype=np.float32))
+        self._masks.append(np.asarray(masks > 0, dtype=np.uint8))
+        self._pending += len(images)
+        while self._pending >= self.shard_slices:
+            self._flush(self.shard_slices)
+
+    def _flush(self, count):
+        images = np.concatenate(self._images)
+        masks = np.concatenate(self._masks)
+        idx = len(self.shards)
+        names = (f"images-{idx:05d}.npy", f"masks-{idx:05d}.npy")
+        np.save(self.directory / names[0], images[:count])
+        np.save(self.directory / names[1], masks[:count])
+        self.shards.append({"images": names[0], "masks": names[1], "slices": int(count)})
+        self._images, self._masks = [images[count:]], [masks[count:]]
+        self._pending -= count
+
+    @property
+    def slices(self):
+        return sum(shard["slices"] for shard in self.shards)
+
+    def close(self, **manifest):
+        """
+        Write the remaining slices and the manifest (with any extra fields).
+        """
+        if self._pending:
+            self._flush(self._pending)
+        manifest.update({
+            "patch_size": list(self.patch_size),
+            "slices": self.slices,
+            "shards": self.shards,
+        })
+        # Written last, so an interrupted run is never mistaken for a finished one
+        with open(self.directory / "manifest.json", 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return self.directory
+
+def read_manifest(directory):
+    path = Path(directory) / "manifest.json"
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def _write_shards(directory, reports, cache, patch_size, shard_slices, force, image_range=None, **fields):
+    """
+    Write the cached cases of reports (see utils.cases.preprocess_cases) to
+    shards, unless the shards in directory were built from the same entries.
+    image_range=(lo, hi) rescales the images to [0, 1].
+    """
+    done = [report for report in reports if not report["error"]]
+    fingerprint = hashlib.sha256(
+        f"{shard_slices}:{image_range}:".encode('utf-8') + "".join(r["key"] for r in done).encode('utf-8')
+    ).hexdigest()[:16]
+    manifest = read_manifest(directory)
+    if not force and manifest is not None and manifest.get("fingerprint") == fingerprint:
+        manifest.update(preprocessing=summarize(reports), case_seconds={r["case"]: r["seconds"] for r in reports})
+        with open(Path(directory) / "manifest.json", 'w') as f:
+            json.dump(manifest, f, indent=2)
+        print(bcolors.OKGREEN + f"Reusing {manifest['slices']} slices in '{directory}'" + bcolors.ENDC)
+        return directory
+
+    writer = ShardWriter(directory, patch_size, shard_slices)
+    for report in done:
+        image, mask = cache.load(report["key"])
+        if image_range is not None:
+            lo, hi = image_range
+            image = (image - lo) / (hi - lo if hi > lo else 1.0)
+        writer.add(crop_or_pad(image, patch_size), crop_or_pad(mask, patch_size))
+    writer.close(fingerprint=fingerprint, cases=[r["case"] for r in done], preprocessing=summarize(reports),
+                 case_seconds={r["case"]: r["seconds"] for r in reports}, **fields)
+    print(bcolors.OKGREEN + f"Wrote {writer.slices} slices of {len(done)} cases to '{directory}'" + bcolors.ENDC)
+    return directory
+
+def build_shards(data_dir, split, cache_dir, spacing=(1.0, 1.0, 1.0), patch_size=(128, 128),
+                 shard_slices=SHARD_SLICES, force=False, workers=1, resample_dir=None):
+    """
+    One-time preprocessing of the .mhd cases of a split: resample to spacing,
+    normalize, crop/pad every slice to patch_size and write the slices to
+    shards under cache_dir/shard_key(split, spacing, patch_size).
+
+    Cases are preprocessed by `workers` processes into a ResampleCache
+    (resample_dir, cache_dir/resampled by default), so a rerun only
+    processes new or changed cases, and the shards are only rewritten when
+    one of them changed or with force. Returns the shard directory.
+    """
+    resample_dir = Path(resample_dir or Path(cache_dir) / "resampled")
+    cases = [(image.name, (str(image), str(mask))) for image, mask in case_paths(data_dir, split)]
+    reports = preprocess_cases(cases, "mhd", resample_dir, workers, new_spacing=tuple(spacing))
+    return _write_shards(Path(cache_dir) / shard_key(split, spacing, patch_size), reports,
+                         ResampleCache(resample_dir), patch_size, shard_slices, force,
+                         source=str(data_dir), split=split, spacing=list(spacing))
+
+def build_prostatex_shards(segmentation_dir, images_dir, cache_dir, patch_size=(128, 128), target_depth=16,
+                           shard_slices=SHARD_SLICES, force=False, workers=1, resample_dir=None,
+                           segmentation_filename="1-1.dcm"):
+    """
+    Load every PROSTATEx patient (target_depth slices resized to patch_size)
+    in parallel through the ResampleCache and write the slices to shards
+    under cache_dir/shard_key('prostatex', patch_size=patch_size), min-max
+    normalized over the whole set. Returns the shard directory.
+    """
+    resample_dir = Path(resample_dir or Path(cache_dir) / "resampled")
+    cases = [(patient, (str(mask_path), str(image_dir)))
+             for patient, mask_path, image_dir in prostatex_cases(segmentation_dir, images_dir, segmentation_filename)]
+    reports = preprocess_cases(cases, "prostatex", resample_dir, workers,
+                               target_depth=target_depth, size=tuple(patch_size))
+
+    cache = ResampleCache(resample_dir)
+    lo, hi = np.inf, -np.inf
+    for report in reports:
+        if not report["error"]:
+            image, _ = cache.load(report["key"])
+            lo, hi = min(lo, float(image.min())), max(hi, float(image.max()))
+    return _write_shards(Path(cache_dir) / shard_key("prostatex", patch_size=patch_size), reports, cache,
+                         patch_size, shard_slices, force, image_range=(lo, hi) if lo <= hi else None,
+                         source=str(images_dir), target_depth=target_depth)
+
+def build_array_shards(images, masks, cache_dir, name, patch_size=(128, 128), shard_slices=SHARD_SLICES):
+    """
+    Write already loaded slices (N, H, W), e.g. the PROSTATEx arrays, to shards
+    under cache_dir/shard_key(name, patch_size=patch_size). Images are min-max
+    normalized over the whole set. Returns the shard directory.
+    """
+    directory = Path(cache_dir) / shard_key(name, patch_size=patch_size)
+    writer = ShardWriter(directory, patch_size, shard_slices)
+    images = normalize_min_max(np.asarray(images, dtype=np.float32))
+    for start in range(0, len(images), shard_slices):
+        writer.add(crop_or_pad(images[start:start + shard_slices], patch_size),
+                   crop_or_pad(np.asarray(masks[start:start + shard_slices]), patch_size))
+    return writer.close(source=name)
+
+class ShardedSlices:
+    """
+    Read-only view over one or more shard directories. Shards are opened as
+    memory maps, so only the slices of the requested batches are read.
+    """
+
+    def __init__(self, directories):
+        if isinstance(directories, (str, os.PathLike)):
+            directories = [directories]
+        self.images = []
+        self.masks = []
+        self.patch_size = None
+        for directory in directories:
+            manifest = read_manifest(directory)
+            if manifest is None:
+                raise FileNotFoundError(f"No shards in '{directory}', run build_shards first")
+            if self.patch_size is not None and tuple(manifest["patch_size"]) != self.patch_size:
+                raise ValueError(f"Shards in '{directory}' have a different patch size")
+            self.patch_size = tuple(manifest["patch_size"])
+            for shard in manifest["shards"]:
+                self.images.append(np.load(Path(directory) / shard["images"], mmap_mode='r'))
+                self.masks.append(np.load(Path(directory) / shard["masks"], mmap_mode='r'))
+        self.offsets = np.cumsum([0] + [len(images) for images in self.images])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def gather(self, indices):
+        """
+        Images and masks (len(indices), H, W, 1) as float32, in the order of indices.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        images = np.empty((len(indices),) + self.patch_size + (1,), dtype=np.float32)
+        masks = np.empty_like(images)
+        shards = np.searchsorted(self.offsets, indices, side='right') - 1
+        for shard in np.unique(shards):
+            rows = np.nonzero(shards == shard)[0]
+            local = indices[rows] - self.offsets[shard]
+            # Sorted reads keep the memory-mapped access sequential
+            order = np.argsort(local)
+            images[rows[order], ..., 0] = self.images[shard][local[order]]
+            masks[rows[order], ..., 0] = self.masks[shard][local[order]]
+        return images, masks
+
+def make_dataset(directories, batch_size=32, shuffle=True, seed=None, augment=None, repeat=True,
+                 drop_remainder=False):
+    """
+    tf.data pipeline over shard directories: shuffled slice indices are
+    batched, batches are gathered from the memory-mapped shards by parallel
+    map calls, optionally augmented and prefetched.
+
+    Args:
+        directories: shard directories (see build_shards and build_array_shards).
+        shuffle: reshuffle all slice indices every epoch; the buffer holds the
+            indices only, so it covers the whole dataset.
+        seed: seed of the shuffle and the augmentation for reproducible runs.
+        augment: optional function (images, masks, seed) -> (images, masks) on
+            batched tensors, e.g. a utils.augment.BatchAugmenter, run as a
+            parallel map stage; seed is (run seed, batch number).
+        repeat: repeat indefinitely, for model.fit with steps_per_epoch.
+
+    Returns:
+        (dataset, number of slices)
+    """
+    slices = ShardedSlices(directories)
+    shape = (None,) + slices.patch_size + (1,)
+
+    def load(indices):
+        images, masks = tf.numpy_function(slices.gather, [indices], [tf.float32, tf.float32])
+        images.set_shape(shape)
+        masks.set_shape(shape)
+        return images, masks
+
+    dataset = tf.data.Dataset.range(len(slices))
+    if shuffle:
+        dataset = dataset.shuffle(len(slices), seed=seed, reshuffle_each_iteration=True)
+    if repeat:
+        dataset = dataset.repeat()
+    dataset = dataset.batch(batch_size, drop_remainder=drop_remainder)
+    dataset = dataset.map(load, num_parallel_calls=tf.data.AUTOTUNE, deterministic=seed is not None)
+    if augment is not None:
+        run_seed = seed if seed is not None else int(np.random.randint(2 ** 31))
+        dataset = dataset.enumerate().map(
+            lambda step, batch: augment(*batch, seed=tf.stack([tf.constant(run_seed, tf.int64), step])),
+            num_parallel_calls=tf.data.AUTOTUNE, deterministic=seed is not None)
+    return dataset.prefetch(tf.data.AUTOTUNE), len(slices)
@@ -1,11 +1,40 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import cv2
 import base64
 import pydicom
+import tensorflow as tf
 from tensorflow.keras.models import load_model
 from tensorflow.keras import backend as K
+from tensorflow.keras import layers, Input, Model
 
 from utils.bcolors import bcolors  # For colored prints, if desired
+from utils.upscale import upscale_image, encode_png_base64, encode_image
+from utils.cache import dicom_cache_key, series_cache_key
+from utils.ingest import read_header, read_deferred, open_volume, pixel_view, DicomHeader
+from utils.pipeline import Stage, run_pipeline
+from utils.postprocess import largest_connected_component, postprocess_volume, upsample_masks
+from utils.maskcodec import encode_masks, encode_display
+from utils.metrics import timed, MODEL_SECONDS, FILES, SLICES
+
+# Maximum number of slices fed to a single model call during batched inference
+PREDICT_BATCH_SIZE = 32
+
+# Ensemble members, adjust to match your environment
+MODEL_PATHS = [
+    "final_model_residual_spatial_dropout.keras",
+    "final_model_residual_attention.keras",
+    "final_model_residual_se.keras"
+]
+
+# Inference backends: 'keras' runs MODEL_PATHS, 'tflite' the artifacts written by convert.py
+INFERENCE_BACKENDS = ('keras', 'tflite')
+
+# Post-training quantization of the TFLite artifacts ('dynamic': int8 weights, float activations)
+TFLITE_QUANTIZATIONS = ('float32', 'float16', 'dynamic', 'int8')
 
 ############################
 # Custom Losses & Metrics #
@@ -30,34 +59,191 @@ def dice_loss(y_true, y_pred):
 #  Model Loading Logic  #
 #########################
 
-def load_ensemble():
+def tflite_path(path, quantization='float16'):
     """
-    Loads multiple Keras models for ensemble inference.
-    Adjust model_paths to match your environment.
+    Location of the TFLite artifact converted from a .keras file.
     """
-    model_paths = [
-        "final_model_residual_spatial_dropout.keras",
-        "final_model_residual_attention.keras",
-        "final_model_residual_se.keras"
-    ]
+    root, _ = os.path.splitext(path)
+    return f"{root}.{quantization}.tflite"
+
+def backend_paths(backend='keras', quantization='float16'):
+    """
+    Files the ensemble is loaded from with the given backend.
+    """
+    if backend == 'keras':
+        return list(MODEL_PATHS)
+    if backend == 'tflite':
+        return [tflite_path(path, quantization) for path in MODEL_PATHS]
+    raise ValueError(f"Unknown inference backend '{backend}'")
+
+def load_keras_member(path, num_threads=None):
+    model = load_model(
+        path,
+        custom_objects={
+            'dice_loss': dice_loss,
+            'dice_coefficient': dice_coefficient
+        }
+    )
+    model.source_path = path  # Names the member in metrics
+    return model
+
+def member_name(model):
+    """
+    Label of an ensemble member: its file name when loaded from disk.
+    """
+    path = getattr(model, 'source_path', None) or getattr(model, 'path', None)
+    if path:
+        return os.path.splitext(os.path.basename(path))[0]
+    return model.name
+
+def load_tflite_member(path, num_threads=None):
+    return TFLiteModel(path, num_threads=num_threads)
 
-    ensemble_models = []
-    for idx, path in enumerate(model_paths, 1):
+# Member loader of every backend, each returns an object with Keras' predict(batch, batch_size, verbose)
+BACKEND_LOADERS = {
+    'keras': load_keras_member,
+    'tflite': load_tflite_member,
+}
+
+def load_ensemble(fused=False, backend='keras', quantization='float16', num_threads=None, parallel=False):
+    """
+    Loads multiple models for ensemble inference.
+    Adjust MODEL_PATHS to match your environment.
+
+    backend selects the runtime ('keras' or 'tflite'); the TFLite artifacts
+    of the given quantization must have been created with convert.py.
+    If fused is True, Keras members are combined into a single compiled
+    FusedEnsemble instead of being returned as a list.
+    If parallel is True, the members are loaded concurrently (file reads and
+    weight deserialization overlap); their order is kept.
+    """
+    loader = BACKEND_LOADERS.get(backend)
+    if loader is None:
+        raise ValueError(f"Unknown inference backend '{backend}'")
+
+    def load(item):
+        idx, path = item
         try:
-            model = load_model(
-                path,
-                custom_objects={
-                    'dice_loss': dice_loss,
-                    'dice_coefficient': dice_coefficient
-                }
-            )
-            ensemble_models.append(model)
+            model = loader(path, num_threads=num_threads)
             print(f"[Ensemble] Loaded Model {idx} from '{path}'.")
+            return model
         except Exception as e:
             print(f"[Ensemble] Error loading Model {idx} from '{path}': {e}")
+            return None
+
+    items = list(enumerate(backend_paths(backend, quantization), 1))
+    if parallel and len(items) > 1:
+        with ThreadPoolExecutor(max_workers=len(items), thread_name_prefix="model-load") as pool:
+            loaded = list(pool.map(load, items))
+    else:
+        loaded = [load(item) for item in items]
+    ensemble_models = [model for model in loaded if model is not None]
+
+    if fused and ensemble_models:
+        if backend != 'keras':
+            print(f"[Ensemble] Fused ensemble is only available with the Keras backend, running {backend} members.")
+            return ensemble_models
+        print("[Ensemble] Building fused ensemble graph.")
+        return FusedEnsemble(ensemble_models)
     
     return ensemble_models
 
+def _tflite_interpreter():
+    # Prefer the standalone runtimes, fall back to the one bundled with TensorFlow
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+class TFLiteModel:
+    """
+    Ensemble member running a converted (optionally quantized) TFLite model.
+    Mirrors Keras' predict() so the ensemble code treats both alike.
+    An interpreter is not thread-safe, so calls on one member are serialized.
+    """
+
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        self.interpreter = _tflite_interpreter()(model_path=path, num_threads=num_threads)
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]['index']
+        self._batch_size = None
+        self._lock = threading.Lock()
+
+    def _invoke(self, chunk):
+        # Tensors are only reallocated when the batch size changes
+        if len(chunk) != self._batch_size:
+            self.interpreter.resize_tensor_input(self._input['index'], list(chunk.shape))
+            self.interpreter.allocate_tensors()
+            self._batch_size = len(chunk)
+        self.interpreter.set_tensor(self._input['index'], chunk)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self._output)
+
+    def predict(self, batch, batch_size=PREDICT_BATCH_SIZE, verbose=0):
+        """
+        Returns probability maps of shape (N, 128, 128, 1) for a batch (N, 128, 128, 1).
+        """
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        if len(batch) == 0:
+            return np.zeros(batch.shape, dtype=np.float32)
+        with self._lock:
+            chunks = [self._invoke(batch[i:i + batch_size]) for i in range(0, len(batch), batch_size)]
+        return np.concatenate(chunks, axis=0)
+
+class FusedEnsemble:
+    """
+    Wraps the ensemble members into one Keras graph that takes the input once,
+    runs every member, averages and thresholds the outputs in-graph.
+    The forward pass is traced once with a fixed input signature and compiled with XLA.
+    """
+
+    def __init__(self, models, input_shape=(128, 128, 1), threshold=0.5, jit_compile=True):
+        self.members = list(models)
+        self.threshold = threshold
+
+        inp = Input(shape=input_shape, name="ensemble_input")
+        outputs = [m(inp, training=False) for m in self.members]
+        avg = layers.Average(name="ensemble_average")(outputs) if len(outputs) > 1 else outputs[0]
+        self.model = Model(inputs=inp, outputs=avg, name="fused_ensemble")
+
+        self._forward = tf.function(
+            self._mask_fn,
+            input_signature=[tf.TensorSpec(shape=(None,) + tuple(input_shape), dtype=tf.float32)],
+            jit_compile=jit_compile,
+        )
+
+    def __len__(self):
+        return len(self.members)
+
+    def _mask_fn(self, x):
+        avg = self.model(x, training=False)
+        return tf.cast(avg[..., 0] > self.threshold, tf.uint8)
+
+    def predict(self, batch, max_batch_size=PREDICT_BATCH_SIZE):
+        """
+        Returns binarized masks of shape (N, 128, 128) for a batch (N, 128, 128, 1).
+        """
+        batch = np.asarray(batch, dtype=np.float32)
+        chunks = [
+            self._forward(tf.convert_to_tensor(batch[i:i + max_batch_size])).numpy()
+            for i in range(0, len(batch), max_batch_size)
+        ]
+        return np.concatenate(chunks, axis=0)
+
+def warm_up(models, batch_sizes=(1,), max_batch_size=PREDICT_BATCH_SIZE):
+    """
+    Run the ensemble once on a dummy batch of every given size, so graph
+    tracing / XLA compilation and tensor allocation happen before the first
+    request. Works with anything ensemble_predict_batch accepts.
+    """
+    for batch_size in sorted(set(batch_sizes)):
+        ensemble_predict_batch(models, np.zeros((batch_size, 128, 128, 1), dtype=np.float32), max_batch_size)
+
 ##################################
 #  Helper Functions for Inference
 ##################################
@@ -68,19 +254,20 @@ def load_dicom(file):
     Returns a numpy array of shape (depth, height, width).
     """
     try:
-        dcm = pydicom.dcmread(file, force=True)
-        arr = dcm.pixel_array.astype(np.float32)
-        # If there's a slope/intercept
-        slope = getattr(dcm, 'RescaleSlope', 1.0)
-        intercept = getattr(dcm, 'RescaleIntercept', 0.0)
-        arr = arr * slope + intercept
-        
-        # If single slice, shape = (height, width).
-        # If multi-slice, shape = (num_slices, height, width).
-        if arr.ndim == 2:
-            # Expand to shape (1, height, width)
-            arr = np.expand_dims(arr, axis=0)
-        return arr
+        return np.asarray(dataset_to_volume(read_deferred(file)))
+    except Exception as e:
+        raise IOError(f"Failed to load DICOM: {e}")
+
+def dataset_to_volume(dcm):
+    """
+    Opens the pixel data of an already parsed DICOM dataset.
+    Returns a LazyVolume of shape (depth, height, width): uncompressed data is
+    viewed in place and frames are converted to float32 (with slope/intercept)
+    only when accessed.
+    """
+    try:
+        with timed("decode"):
+            return open_volume(dcm)
     except Exception as e:
         raise IOError(f"Failed to load DICOM: {e}")
 
@@ -103,17 +290,6 @@ def preprocess_slice_2d(slice_2d, target_size=(128, 128)):
     input_4d = np.expand_dims(normalized, axis=(0, -1))  # shape: (1, 128, 128, 1)
     return input_4d
 
-# define a function to extract from the predicted mask the largest connected component
-def largest_connected_component(mask):
-    # find all connected components (0: background, 1: connected component)
-    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=4)
-    # find the largest connected component
-    largest_label = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
-    # create a mask with only the largest connected component
-    mask = np.zeros_like(mask)
-    mask[labels == largest_label] = 1
-    return mask
-
 def ensemble_predict_slice(models, slice_2d):
     """
     Generate ensemble prediction for a single 2D slice.
@@ -122,83 +298,658 @@ def ensemble_predict_slice(models, slice_2d):
     3) Return the binarized mask (0/1).
     """
     inp = preprocess_slice_2d(slice_2d, target_size=(128, 128))
-    preds = []
-    for model in models:
-        p = model.predict(inp)  # Expect shape: (1, 128, 128, 1)
-        preds.append(p)
-    avg_pred = np.mean(preds, axis=0)  # shape: (1, 128, 128, 1)
-    mask_2d = (avg_pred[0, :, :, 0] > 0.5).astype(np.uint8)  # shape: (128,128)
+    avg_pred = ensemble_predict_batch(models, inp)  # shape: (1, 128, 128)
+    return postprocess_mask(avg_pred[0])  # shape: (128,128)
+
+def preprocess_volume_2d(volume, target_size=(128, 128), out=None):
+    """
+    Vectorized preprocess_slice_2d over a whole volume (depth, H, W):
+      - Resize every slice straight into one preallocated float32 batch
+      - Per-slice (img - mean) / std computed across the batch, in place
+    Returns the batch of shape (depth, 128, 128, 1); pass `out` to fill an
+    existing buffer (e.g. a slice of a larger multi-volume batch).
+    """
+    with timed("preprocess"):
+        return _preprocess_volume_2d(volume, target_size, out)
+
+def _preprocess_volume_2d(volume, target_size, out):
+    width, height = target_size
+    depth = len(volume)
+    if out is None:
+        out = np.empty((depth, height, width, 1), dtype=np.float32)
+
+    for idx, slice_2d in enumerate(volume):
+        if slice_2d.dtype != np.float32:
+            slice_2d = slice_2d.astype(np.float32)
+        cv2.resize(slice_2d, target_size, dst=out[idx, :, :, 0], interpolation=cv2.INTER_LINEAR)
+
+    # Normalization statistics for all slices at once, without float64 temporaries
+    flat = out.reshape(depth, -1)
+    mean = flat.mean(axis=1, keepdims=True)
+    flat -= mean
+    std = np.sqrt(np.einsum('ij,ij->i', flat, flat) / flat.shape[1])[:, None]
+    std += 1e-8
+    flat /= std
+    return out
+
+def postprocess_mask(avg_pred_2d):
+    """
+    Binarize an averaged probability map (H, W) and keep only the
+    largest connected component.
+    """
+    mask_2d = (avg_pred_2d > 0.5).astype(np.uint8)
     # If mask is empty, return it as is
     if np.sum(mask_2d) == 0:
         return mask_2d
-    mask_2d = largest_connected_component(mask_2d)
-    return mask_2d
+    return largest_connected_component(mask_2d)
 
-def create_overlay(original_slice, predicted_mask, target_size=(128, 128)):
+def ensemble_predict_batch(models, batch, max_batch_size=PREDICT_BATCH_SIZE):
     """
-    Create an overlay image by placing `predicted_mask` (red) on top of `original_slice`.
-    Both are 2D arrays (H, W).
-    Return base64-encoded PNG of shape (H, W, 3).
+    Run every ensemble member once on a preprocessed batch (N, 128, 128, 1)
+    and return the averaged probability maps, shape (N, 128, 128).
+    A FusedEnsemble returns already-thresholded masks in the same shape.
+    Anything other than a list of members (FusedEnsemble, InferenceScheduler)
+    is expected to expose predict(batch, max_batch_size).
     """
-    
-    # Resize the predicted mask to match the original slice size, use the smoothest interpolation
-    predicted_mask = cv2.resize(predicted_mask, original_slice.shape[::-1], interpolation=cv2.INTER_LINEAR)
-    
-    # Normalize to 0-255 for display
-    original_8u = cv2.normalize(original_slice, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    if not isinstance(models, (list, tuple)):
+        return models.predict(batch, max_batch_size)
+
+    avg_pred = np.zeros(batch.shape[:3], dtype=np.float32)
+    for model in models:
+        start = time.perf_counter()
+        p = model.predict(batch, batch_size=max_batch_size, verbose=0)
+        MODEL_SECONDS.observe(time.perf_counter() - start, model=member_name(model))
+        avg_pred += p[..., 0]
+    avg_pred /= len(models)
+    return avg_pred
+
+def predict_triaged(models, batch, bounds, triage=None, max_batch_size=PREDICT_BATCH_SIZE):
+    """
+    ensemble_predict_batch over the slices of several volumes, stacked in batch
+    at bounds [(start, end), ...], running the full ensemble only on the slice
+    range each volume's triage pass keeps. Skipped slices predict nothing.
+    """
+    SLICES.inc(len(batch), source="inferred")
+    with timed("infer"):
+        return _predict_triaged(models, batch, bounds, triage, max_batch_size)
+
+def _predict_triaged(models, batch, bounds, triage, max_batch_size):
+    if triage is None:
+        return ensemble_predict_batch(models, batch, max_batch_size)
+
+    # One triage call for the sampled slices of every volume
+    sampled = [triage.samples(end - start) for start, end in bounds]
+    offsets = np.concatenate([start + idx for (start, _), idx in zip(bounds, sampled)])
+    probs = np.zeros((0,) + batch.shape[1:3], dtype=np.float32)
+    if len(offsets):
+        probs = ensemble_predict_batch(triage.model if triage.model is not None else models,
+                                       batch[offsets], max_batch_size)
+
+    keep = []
+    pos = 0
+    for (start, end), idx in zip(bounds, sampled):
+        keep.append(start + triage.keep(end - start, idx, probs[pos:pos + len(idx)]))
+        pos += len(idx)
+    keep = np.concatenate(keep) if keep else np.zeros(0, dtype=int)
+    triage.record(len(batch), len(batch) - len(keep))
+
+    if len(keep) == len(batch):
+        return ensemble_predict_batch(models, batch, max_batch_size)
+    avg_pred = np.zeros(batch.shape[:3], dtype=np.float32)
+    if len(keep):
+        avg_pred[keep] = ensemble_predict_batch(models, batch[keep], max_batch_size)
+    return avg_pred
+
+def ensemble_predict_volume(models, volume, max_batch_size=PREDICT_BATCH_SIZE, postprocess='2d'):
+    """
+    Generate ensemble predictions for all slices of a volume (depth, H, W)
+    at once. Returns binarized masks of shape (depth, 128, 128).
+    """
+    batch = preprocess_volume_2d(volume, target_size=(128, 128))
+    avg_pred = ensemble_predict_batch(models, batch, max_batch_size)
+    return postprocess_volume(avg_pred, mode=postprocess)
+
+def to_display_8u(original_slice):
+    """
+    Normalize a 2D slice to 0-255 for display.
+    """
+    return cv2.normalize(original_slice, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+
+def volume_to_display(volume):
+    """
+    Normalize every slice of a volume (depth, H, W) to 8-bit display values.
+    """
+    with timed("display"):
+        return np.stack([to_display_8u(s) for s in volume])
+
+def compose_overlay(original_8u, predicted_mask, scale_factor=1, interpolation=cv2.INTER_LANCZOS4):
+    """
+    Draw the red mask overlay on top of an 8-bit display slice (H, W) at
+    (H * scale_factor, W * scale_factor) and return the BGR image.
+    The mask may be at model resolution or already upsampled to the final size.
+    """
+    original_8u = upscale_image(original_8u, scale_factor, interpolation)
     
     # Convert grayscale to BGR
     overlay_img = cv2.cvtColor(original_8u, cv2.COLOR_GRAY2BGR)
-    # Color mask in red
-    overlay_img[predicted_mask == 1] = (0, 0, 255)
 
-    # Encode to PNG base64
-    _, buffer = cv2.imencode('.png', overlay_img)
-    overlay_bytes = buffer.tobytes()
-    overlay_base64 = "data:image/png;base64," + base64.b64encode(overlay_bytes).decode('utf-8')
-    return overlay_base64
+    if predicted_mask.any():
+        # Resize the predicted mask to match the final overlay size, use the smoothest interpolation
+        if predicted_mask.shape != original_8u.shape:
+            predicted_mask = cv2.resize(predicted_mask, original_8u.shape[::-1], interpolation=cv2.INTER_LINEAR)
+        # Color mask in red
+        overlay_img[predicted_mask == 1] = (0, 0, 255)
+    return overlay_img
+
+def render_overlay(original_8u, predicted_mask, scale_factor=1, interpolation=cv2.INTER_LANCZOS4):
+    """
+    Render the overlay of one slice (see compose_overlay) and encode it once as base64 PNG.
+    """
+    return encode_png_base64(compose_overlay(original_8u, predicted_mask, scale_factor, interpolation))
+
+def render_slice(original_8u, predicted_mask, scale_factor=1, image_format='png', interpolation=cv2.INTER_LANCZOS4):
+    """
+    Render the overlay of one slice as raw PNG, JPEG or WebP bytes, for
+    slices served one at a time from a stored study.
+    """
+    return encode_image(compose_overlay(original_8u, predicted_mask, scale_factor, interpolation), image_format)
+
+def render_study(display, masks, scale_factor=1, interpolation=cv2.INTER_LANCZOS4, chunk_size=PREDICT_BATCH_SIZE):
+    """
+    Yield the base64 overlay of every slice of a study. Masks are upsampled to
+    the final overlay size chunk by chunk in batched OpenCV calls.
+    """
+    for start in range(0, len(display), chunk_size):
+        chunk = display[start:start + chunk_size]
+        size = (chunk.shape[2] * scale_factor, chunk.shape[1] * scale_factor)
+        with timed("upsample"):
+            upsampled = upsample_masks(masks[start:start + chunk_size], size)
+        for original_8u, predicted_mask in zip(chunk, upsampled):
+            yield render_overlay(original_8u, predicted_mask, scale_factor, interpolation)
+
+def create_overlay(original_slice, predicted_mask, target_size=(128, 128),
+                   scale_factor=1, interpolation=cv2.INTER_LANCZOS4):
+    """
+    Create an overlay image by placing `predicted_mask` (red) on top of `original_slice`.
+    Both are 2D arrays (H, W).
+    The overlay is rendered directly at (H * scale_factor, W * scale_factor) and
+    encoded exactly once.
+    Return base64-encoded PNG of shape (H * scale_factor, W * scale_factor, 3).
+    """
+    return render_overlay(to_display_8u(original_slice), predicted_mask, scale_factor, interpolation)
 
 #######################
 # Main Prediction Logic
 #######################
 
-def get_prediction(files, ensemble_models):
+def iter_datasets(files):
+    """
+    Yield (file_index, filename, dataset) for every parseable DICOM upload.
+    Pixel data is not decoded here. Unsupported or unreadable files are
+    reported and skipped.
+    """
+    for file_idx, file in enumerate(files):
+        dcm = read_dataset(file)
+        if dcm is not None:
+            yield file_idx, file.filename, dcm
+
+def read_dataset(file):
+    """
+    Parse one DICOM upload without decoding its pixel data.
+    Returns None (after reporting) for unsupported or unreadable files.
+    """
+    filename = file.filename.lower()
+    if not filename.endswith('.dcm'):
+        print(bcolors.FAIL + f"Unsupported file format for '{filename}'" + bcolors.ENDC)
+        FILES.inc(result="unsupported")
+        return None
+    
+    try:
+        with timed("parse"):
+            dcm = read_deferred(file)
+    except Exception as e:
+        print(bcolors.FAIL + f"Could not read DICOM file: {e}" + bcolors.ENDC)
+        FILES.inc(result="unreadable")
+        return None
+    FILES.inc(result="ok")
+    return dcm
+
+def count_slices(files):
+    """
+    Count the slices of the DICOM uploads from their headers only,
+    without decoding pixel data. Unreadable files count as zero.
+    """
+    total = 0
+    for file in files:
+        if not file.filename.lower().endswith('.dcm'):
+            continue
+        try:
+            total += read_header(file).frames
+        except IOError:
+            pass
+    return total
+
+def iter_volumes(files):
+    """
+    Yield (file_index, filename, volume) for every readable DICOM upload.
+    Unsupported or unreadable files are reported and skipped.
+    """
+    for file_idx, filename, dcm in iter_datasets(files):
+        try:
+            volume = dataset_to_volume(dcm)  # shape: (depth, height, width)
+        except Exception as e:
+            print(bcolors.FAIL + f"Could not read DICOM file: {e}" + bcolors.ENDC)
+            continue
+
+        yield file_idx, filename, volume
+
+def predict_volumes(volumes, ensemble_models, max_batch_size=PREDICT_BATCH_SIZE, postprocess='2d', triage=None):
+    """
+    Run the ensemble on several volumes with one stacked batch and return
+    a list of binarized mask volumes, each of shape (depth, 128, 128).
+    With a SliceTriage, only the slice range it keeps is fully inferred.
+    """
+    # Preprocess the slices of every volume into one batch: (total_slices, 128, 128, 1)
+    batch = np.empty((sum(len(v) for v in volumes), 128, 128, 1), dtype=np.float32)
+    bounds = []
+    offset = 0
+    for volume in volumes:
+        preprocess_volume_2d(volume, target_size=(128, 128), out=batch[offset:offset + len(volume)])
+        bounds.append((offset, offset + len(volume)))
+        offset += len(volume)
+    avg_pred = predict_triaged(ensemble_models, batch, bounds, triage, max_batch_size)
+    del batch
+
+    masks = []
+    offset = 0
+    for volume in volumes:
+        depth = volume.shape[0]
+        masks.append(postprocess_volume(avg_pred[offset:offset + depth], mode=postprocess))
+        offset += depth
+    return masks
+
+def cache_key(dcm, cache, postprocess='2d'):
+    """
+    Content-addressed cache key of a dataset for the current preprocessing setup.
+    """
+    return dicom_cache_key(dcm, namespace=cache.namespace, pixel_data=pixel_view(dcm),
+                           target_size=(128, 128), threshold=0.5, postprocess=postprocess)
+
+def series_key(series, cache, postprocess='2d'):
+    """
+    Cache key of an assembled series, see utils.series.Series.
+    """
+    return series_cache_key([cache_key(dcm, cache, postprocess) for dcm in series.datasets], cache.namespace)
+
+def lookup_cache(dcm, filename, cache, postprocess='2d', key_fn=cache_key):
+    """
+    Return (key, entry) for a dataset (or a series with key_fn=series_key);
+    both are None without a cache, entry is None on a miss.
+    """
+    if cache is None:
+        return None, None
+    with timed("cache"):
+        try:
+            key = key_fn(dcm, cache, postprocess)
+        except Exception as e:
+            print(bcolors.WARNING + f"Could not compute cache key for '{filename}': {e}" + bcolors.ENDC)
+            return None, None
+        entry = cache.get(key)
+    if entry is not None:
+        SLICES.inc(len(entry['masks']), source="cached")
+    return key, entry
+
+def iter_studies(files, ensemble_models, max_batch_size=PREDICT_BATCH_SIZE, cache=None, batch_files=True,
+                 postprocess='2d', triage=None):
+    """
+    Yield (file_index, filename, display, masks) per readable upload, where
+    display holds the 8-bit slices (depth, H, W) and masks the binarized
+    predictions (depth, 128, 128).
+
+    Studies found in the cache skip pixel decoding and inference. With
+    batch_files=True the remaining studies are inferred as one batch;
+    otherwise each file is inferred and yielded as soon as it is ready.
+    """
+    pending = []
+
+    def flush():
+        results = predict_volumes([volume for *_, volume in pending], ensemble_models, max_batch_size, postprocess,
+                                  triage)
+        for (file_idx, filename, key, volume), masks in zip(pending, results):
+            display = volume_to_display(volume)
+            if key is not None:
+                cache.put(key, masks, display)
+            yield file_idx, filename, display, masks
+        pending.clear()
+
+    for file_idx, filename, dcm in iter_datasets(files):
+        key, entry = lookup_cache(dcm, filename, cache, postprocess)
+        if entry is not None:
+            yield file_idx, filename, entry['display'], entry['masks']
+            continue
+
+        try:
+            volume = dataset_to_volume(dcm)  # shape: (depth, height, width)
+        except Exception as e:
+            print(bcolors.FAIL + f"Could not read DICOM file: {e}" + bcolors.ENDC)
+            continue
+        del dcm
+
+        pending.append((file_idx, filename, key, volume))
+        if not batch_files:
+            yield from flush()
+
+    if pending:
+        yield from flush()
+
+def iter_predictions(files, ensemble_models, max_batch_size=PREDICT_BATCH_SIZE,
+                     scale_factor=1, interpolation=cv2.INTER_LANCZOS4, cache=None, pipeline=None,
+                     postprocess='2d', triage=None):
+    """
+    Generator version of get_prediction: every file is inferred as one batch and
+    each slice's overlay is yielded as soon as it is rendered, so callers can
+    stream results without holding the whole study in memory.
+    With a PipelineConfig, files are processed concurrently and come out in
+    completion order.
+    
+    Yields:
+        dict with keys 'file', 'file_index', 'slice_index' and 'overlay'.
+    """
+    if pipeline is not None:
+        rendered = iter_rendered_studies(files, ensemble_models, pipeline, max_batch_size,
+                                         scale_factor, interpolation, cache, postprocess, triage)
+        for file_idx, filename, overlays in rendered:
+            for slice_idx, overlay_base64 in enumerate(overlays):
+                yield {
+                    "file": filename,
+                    "file_index": file_idx,
+                    "slice_index": slice_idx,
+                    "overlay": overlay_base64,
+                }
+        return
+
+    studies = iter_studies(files, ensemble_models, max_batch_size, cache=cache, batch_files=False,
+                           postprocess=postprocess, triage=triage)
+    for file_idx, filename, display, masks in studies:
+        overlays = render_study(display, masks, scale_factor, interpolation)
+        for slice_idx, overlay_base64 in enumerate(overlays):
+            yield {
+                "file": filename,
+                "file_index": file_idx,
+                "slice_index": slice_idx,
+                "overlay": overlay_base64,
+            }
+
+###########################
+# Pipelined Prediction Logic
+###########################
+
+class PipelineConfig:
+    """
+    Per-stage concurrency of the pipelined prediction path.
+    OpenCV and pydicom release the GIL for most of their work, so decode,
+    preprocess and render threads overlap with inference.
+    """
+
+    def __init__(self, decode_workers=2, preprocess_workers=2, infer_workers=1, render_workers=2, queue_size=4):
+        self.decode_workers = decode_workers
+        self.preprocess_workers = preprocess_workers
+        self.infer_workers = infer_workers
+        self.render_workers = render_workers
+        self.queue_size = queue_size
+
+def iter_rendered_studies(files, ensemble_models, pipeline, max_batch_size=PREDICT_BATCH_SIZE,
+                          scale_factor=1, interpolation=cv2.INTER_LANCZOS4, cache=None, postprocess='2d',
+                          triage=None):
+    """
+    Run decode -> preprocess -> infer -> render as concurrent stages connected by
+    bounded queues. Yields (file_index, filename, overlays) in completion order.
+    """
+    def decode(item):
+        file_idx, file = item
+        dcm = read_dataset(file)
+        if dcm is None:
+            return None
+        study = {"file_idx": file_idx, "filename": file.filename}
+        study["key"], entry = lookup_cache(dcm, file.filename, cache, postprocess)
+        if entry is not None:
+            study["display"], study["masks"] = entry["display"], entry["masks"]
+            return study
+        try:
+            study["volume"] = dataset_to_volume(dcm)  # shape: (depth, height, width)
+        except Exception as e:
+            print(bcolors.FAIL + f"Could not read DICOM file: {e}" + bcolors.ENDC)
+            return None
+        return study
+
+    def preprocess(study):
+        if "volume" in study:
+            study["batch"] = preprocess_volume_2d(study["volume"], target_size=(128, 128))
+        return study
+
+    def infer(study):
+        if "batch" in study:
+            batch = study.pop("batch")
+            study["avg_pred"] = predict_triaged(ensemble_models, batch, [(0, len(batch))], triage, max_batch_size)
+        return study
+
+    def render(study):
+        if "avg_pred" in study:
+            study["masks"] = postprocess_volume(study.pop("avg_pred"), mode=postprocess)
+            study["display"] = volume_to_display(study.pop("volume"))
+            if study["key"] is not None:
+                cache.put(study["key"], study["masks"], study["display"])
+        overlays = list(render_study(study["display"], study["masks"], scale_factor, interpolation))
+        return study["file_idx"], study["filename"], overlays
+
+    stages = [
+        Stage("decode", decode, pipeline.decode_workers),
+        Stage("preprocess", preprocess, pipeline.preprocess_workers),
+        Stage("infer", infer, pipeline.infer_workers),
+        Stage("render", render, pipeline.render_workers),
+    ]
+    yield from run_pipeline(enumerate(files), stages, queue_size=pipeline.queue_size)
+
+def get_prediction(files, ensemble_models, max_batch_size=PREDICT_BATCH_SIZE,
+                   scale_factor=1, interpolation=cv2.INTER_LANCZOS4, cache=None, pipeline=None,
+                   postprocess='2d', triage=None):
     """
     Use ensemble_models to predict segmentation on DICOM files (single or multi-slice).
     Return an array of overlay base64 strings, one per slice across all files.
+
+    The slices of all uploaded files are preprocessed into one stacked batch,
+    so each ensemble member is invoked once per request instead of once per slice.
     
     Args:
         files: list of file-like objects (Flask file uploads).
-        ensemble_models: list of loaded Keras models for ensemble.
+        ensemble_models: list of loaded Keras models for ensemble, or a FusedEnsemble.
+        max_batch_size: maximum number of slices per model call.
+        scale_factor: upscaling factor applied when rendering each overlay.
+        interpolation: OpenCV interpolation flag used for upscaling.
+        cache: optional PredictionCache used to skip decode and inference for known studies.
+        pipeline: optional PipelineConfig; when given, files are processed by
+            concurrent per-file stages instead of one stacked batch.
+        postprocess: '2d' keeps the largest component per slice, '3d' across the volume.
+        triage: optional SliceTriage; slices outside the range it estimates are not inferred.
     
     Returns:
         overlays: list of base64-encoded PNG images (the overlay of each slice).
     """
+    if pipeline is not None:
+        rendered = iter_rendered_studies(files, ensemble_models, pipeline, max_batch_size,
+                                         scale_factor, interpolation, cache, postprocess, triage)
+        return [overlay for _, _, overlays in sorted(rendered, key=lambda study: study[0])
+                for overlay in overlays]
+
+    studies = sorted(iter_studies(files, ensemble_models, max_batch_size, cache=cache, postprocess=postprocess,
+                                  triage=triage),
+                     key=lambda study: study[0])
+
     overlays = []
+    for _, _, display, masks in studies:
+        # Create overlays
+        overlays.extend(render_study(display, masks, scale_factor, interpolation))
     
-    for file in files:
-        filename = file.filename.lower()
-        if not filename.endswith('.dcm'):
-            print(bcolors.FAIL + f"Unsupported file format for '{filename}'" + bcolors.ENDC)
+    return overlays
+
+def get_compact_prediction(files, ensemble_models, max_batch_size=PREDICT_BATCH_SIZE, mask_format='rle',
+                           include_images=True, cache=None, postprocess='2d', triage=None):
+    """
+    Like get_prediction, but return the masks in a compact encoding instead of
+    rendered overlays, so the client composites the red overlay itself.
+
+    Returns:
+        list of dicts, one per readable file, with keys 'file', 'file_index',
+        'shape' (depth, H, W of the images), 'mask_shape' (depth, 128, 128),
+        'pixel_spacing', 'slice_spacing', 'masks' (see utils.maskcodec) and,
+        with include_images, 'images' (grayscale PNGs, one per slice).
+    """
+    headers = {}
+    for file_idx, file in enumerate(files):
+        if file.filename.lower().endswith('.dcm'):
+            try:
+                headers[file_idx] = read_header(file)
+            except IOError:
+                pass  # Reported when the file is processed
+
+    studies = sorted(iter_studies(files, ensemble_models, max_batch_size, cache=cache, postprocess=postprocess,
+                                  triage=triage),
+                     key=lambda study: study[0])
+
+    results = []
+    for file_idx, filename, display, masks in studies:
+        header = headers.get(file_idx)
+        study = {
+            "file": filename,
+            "file_index": file_idx,
+            "shape": list(display.shape),
+            "mask_shape": list(masks.shape),
+            "pixel_spacing": header.pixel_spacing if header else None,
+            "slice_spacing": header.slice_spacing if header else None,
+            "masks": encode_masks(masks, mask_format),
+        }
+        if include_images:
+            study["images"] = encode_display(display)
+        results.append(study)
+    return results
+
+###########################
+# Series Prediction Logic
+###########################
+
+def iter_series(series_list, ensemble_models, max_batch_size=PREDICT_BATCH_SIZE, cache=None, postprocess='2d',
+                triage=None):
+    """
+    Yield (series_index, series, display, masks) for every utils.series.Series.
+    Each series is assembled into one volume so postprocessing and triage see
+    the whole stack; series missing from the cache are inferred as one batch.
+    """
+    pending = []
+    for series_idx, series in enumerate(series_list):
+        key, entry = lookup_cache(series, series.uid, cache, postprocess, key_fn=series_key)
+        if entry is not None:
+            yield series_idx, series, entry['display'], entry['masks']
             continue
-        
         try:
-            volume = load_dicom(file)  # shape: (depth, height, width)
+            with timed("decode"):
+                volume = series.volume()  # shape: (depth, height, width)
         except Exception as e:
-            print(bcolors.FAIL + f"Could not read DICOM file: {e}" + bcolors.ENDC)
+            print(bcolors.FAIL + f"Could not assemble series '{series.uid}': {e}" + bcolors.ENDC)
             continue
-        
-        depth = volume.shape[0]
-        for slice_idx in range(depth):
-            original_slice = volume[slice_idx]  # shape: (height, width)
-            
-            # Ensemble Predict on 2D slice
-            predicted_mask_2d = ensemble_predict_slice(ensemble_models, original_slice)
-            
-            # Create overlay
-            overlay_base64 = create_overlay(original_slice, predicted_mask_2d, target_size=(128, 128))
-            overlays.append(overlay_base64)
-            
-            
-    
-    return overlays
\ No newline at end of file
+        pending.append((series_idx, series, key, volume))
+
+    if not pending:
+        return
+    results = predict_volumes([volume for *_, volume in pending], ensemble_models, max_batch_size, postprocess,
+                              triage)
+    for (series_idx, series, key, volume), masks in zip(pending, results):
+        display = volume_to_display(volume)
+        if key is not None:
+            cache.put(key, masks, display)
+        yield series_idx, series, display, masks
+
+def get_series_prediction(series_list, ensemble_models, max_batch_size=PREDICT_BATCH_SIZE,
+                          scale_factor=1, interpolation=cv2.INTER_LANCZOS4, cache=None, postprocess='2d',
+                          triage=None):
+    """
+    Predict every series of a grouped upload (see utils.series.group_series).
+
+    Returns:
+        list of dicts, one per series in upload order, with keys 'series_index',
+        'series_uid', 'description' and 'slices': one dict per slice in slice
+        order with 'slice_index', 'instance_number', 'sop_instance_uid', 'file'
+        and 'overlay' (base64 PNG).
+    """
+    results = []
+    for series_idx, series, display, masks in sorted(iter_series(series_list, ensemble_models, max_batch_size,
+                                                                 cache, postprocess, triage),
+                                                     key=lambda item: item[0]):
+        overlays = render_study(display, masks, scale_factor, interpolation)
+        results.append({
+            "series_index": series_idx,
+            "series_uid": series.uid,
+            "description": series.description,
+            "slices": [{**instance, "overlay": overlay_base64}
+                       for instance, overlay_base64 in zip(series_instances(series), overlays)],
+        })
+    return results
+
+def series_instances(series):
+    """
+    Identifiers of every slice of a series in slice order: dicts with
+    'slice_index', 'instance_number', 'sop_instance_uid' and 'file'.
+    """
+    # Multi-frame instances contribute several slices with the same identifiers
+    instances = [(number, sop_uid, filename)
+                 for dcm, number, sop_uid, filename in zip(series.datasets, series.instance_numbers,
+                                                           series.sop_instance_uids, series.filenames)
+                 for _ in range(DicomHeader(dcm).frames)]
+    return [{
+        "slice_index": slice_idx,
+        "instance_number": number,
+        "sop_instance_uid": sop_uid,
+        "file": filename,
+    } for slice_idx, (number, sop_uid, filename) in enumerate(instances)]
+
+def iter_series_predictions(series_list, ensemble_models, max_batch_size=PREDICT_BATCH_SIZE,
+                            scale_factor=1, interpolation=cv2.INTER_LANCZOS4, cache=None, postprocess='2d',
+                            triage=None):
+    """
+    Generator version of get_series_prediction for streaming: yields one dict
+    per slice with 'series_index', 'series_uid', the keys of series_instances
+    and 'overlay', as soon as it is rendered.
+    """
+    for series_idx, series, display, masks in iter_series(series_list, ensemble_models, max_batch_size,
+                                                          cache, postprocess, triage):
+        overlays = render_study(display, masks, scale_factor, interpolation)
+        for instance, overlay_base64 in zip(series_instances(series), overlays):
+            yield {"series_index": series_idx, "series_uid": series.uid, **instance, "overlay": overlay_base64}
+
+def get_compact_series_prediction(series_list, ensemble_models, max_batch_size=PREDICT_BATCH_SIZE,
+                                  mask_format='rle', include_images=True, cache=None, postprocess='2d',
+                                  triage=None):
+    """
+    get_compact_prediction for grouped series: one dict per series with
+    'series_index', 'series_uid', 'description', 'instances' (see
+    series_instances) and the shape, spacing, 'masks' and 'images' keys of
+    get_compact_prediction.
+    """
+    results = []
+    for series_idx, series, display, masks in sorted(iter_series(series_list, ensemble_models, max_batch_size,
+                                                                 cache, postprocess, triage),
+                                                     key=lambda item: item[0]):
+        study = {
+            "series_index": series_idx,
+            "series_uid": series.uid,
+            "description": series.description,
+            "instances": series_instances(series),
+            "shape": list(display.shape),
+            "mask_shape": list(masks.shape),
+            "pixel_spacing": series.header.pixel_spacing,
+            "slice_spacing": series.header.slice_spacing,
+            "masks": encode_masks(masks, mask_format),
+        }
+        if include_images:
+            study["images"] = encode_display(display)
+        results.append(study)
+    return results
@@ -0,0 +1,279 @@
+import io
+import mmap
+import tempfile
+
+import numpy as np
+import pydicom
+from flask import Request
+from pydicom.uid import ImplicitVRLittleEndian, ExplicitVRLittleEndian
+
+# Transfer syntaxes whose pixel data can be viewed in place
+UNCOMPRESSED_SYNTAXES = {ImplicitVRLittleEndian, ExplicitVRLittleEndian}
+
+# Elements larger than this are not read until accessed (keeps PixelData out of memory)
+DEFER_SIZE = 1024
+
+PIXEL_DATA_TAG = 0x7FE00010
+
+# Requests up to this size keep their uploads in memory, larger ones go to an unnamed temporary file
+UPLOAD_MEMORY_BYTES = 64 * 1024 * 1024
+
+# Attribute under which pixel_view memoizes its result on a dataset
+_VIEW_ATTR = '_zero_copy_view'
+
+####################
+#  Header Parsing  #
+####################
+
+class DicomHeader:
+    """
+    Geometry and encoding of a DICOM upload, parsed without its pixel data.
+    """
+
+    def __init__(self, dcm):
+        self.rows = int(getattr(dcm, 'Rows', 0) or 0)
+        self.columns = int(getattr(dcm, 'Columns', 0) or 0)
+        self.frames = int(getattr(dcm, 'NumberOfFrames', 1) or 1)
+        self.bits_allocated = int(getattr(dcm, 'BitsAllocated', 16) or 16)
+        self.bits_stored = int(getattr(dcm, 'BitsStored', self.bits_allocated) or self.bits_allocated)
+        self.pixel_representation = int(getattr(dcm, 'PixelRepresentation', 0) or 0)
+        self.samples_per_pixel = int(getattr(dcm, 'SamplesPerPixel', 1) or 1)
+        self.transfer_syntax = getattr(getattr(dcm, 'file_meta', None), 'TransferSyntaxUID', None)
+        pixel_spacing = getattr(dcm, 'PixelSpacing', None)
+        self.pixel_spacing = [float(v) for v in pixel_spacing] if pixel_spacing else None
+        slice_spacing = getattr(dcm, 'SpacingBetweenSlices', None) or getattr(dcm, 'SliceThickness', None)
+        self.slice_spacing = float(slice_spacing) if slice_spacing else None
+
+    @property
+    def pixels(self):
+        return self.rows * self.columns * self.frames * self.samples_per_pixel
+
+    @property
+    def stored_bytes(self):
+        """
+        Size of the uncompressed pixel data as stored.
+        """
+        return self.pixels * self.bits_allocated // 8
+
+    @property
+    def decoded_bytes(self):
+        """
+        Size of the whole volume once converted to float32.
+        """
+        return self.pixels * 4
+
+    @property
+    def uncompressed(self):
+        return self.transfer_syntax in UNCOMPRESSED_SYNTAXES
+
+    def to_dict(self):
+        return {
+            "rows": self.rows,
+            "columns": self.columns,
+            "frames": self.frames,
+            "bits_allocated": self.bits_allocated,
+            "transfer_syntax": str(self.transfer_syntax),
+            "pixel_spacing": self.pixel_spacing,
+            "slice_spacing": self.slice_spacing,
+        }
+
+def read_header(file):
+    """
+    Parse only the header of a DICOM upload and rewind it.
+    Raises IOError if the header cannot be parsed.
+    """
+    try:
+        dcm = pydicom.dcmread(file, force=True, stop_before_pixels=True)
+    except Exception as e:
+        raise IOError(f"Failed to read DICOM header: {e}")
+    finally:
+        file.seek(0)
+    return DicomHeader(dcm)
+
+def read_deferred(file):
+    """
+    Parse a DICOM upload with large elements (PixelData) left on the source,
+    so nothing is copied until pixels are actually needed.
+    """
+    return pydicom.dcmread(file, force=True, defer_size=DEFER_SIZE)
+
+##########################
+#  Upload Streams
+##########################
+
+def upload_stream(total_content_length, max_memory=UPLOAD_MEMORY_BYTES):
+    """
+    Stream an upload is written to: a BytesIO for requests up to max_memory,
+    otherwise an unnamed temporary file. Both can be viewed without copying
+    (getbuffer() or a memory map of fileno()), unlike werkzeug's default
+    SpooledTemporaryFile.
+    """
+    if total_content_length is not None and total_content_length <= max_memory:
+        return io.BytesIO()
+    return tempfile.TemporaryFile('w+b')
+
+class UploadRequest(Request):
+    """
+    Flask request whose file uploads are stored by upload_stream, so
+    pixel_view can map their pixel data in place. Set as app.request_class.
+    """
+    max_memory = UPLOAD_MEMORY_BYTES
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return upload_stream(total_content_length, self.max_memory)
+
+##########################
+#  Zero-copy Pixel Access
+##########################
+
+def _source_bytes(dcm):
+    """
+    Byte view of the data a dataset was read from: the in-memory buffer of
+    an upload, a read-only memory map of an upload stored in a file or of a
+    file on disk, or a copy for streams that support neither.
+    """
+    source = getattr(dcm, 'buffer', None)
+    if source is not None:
+        stream = getattr(source, 'stream', source)  # werkzeug FileStorage
+        if hasattr(stream, 'getbuffer'):
+            view = np.frombuffer(stream.getbuffer(), dtype=np.uint8)
+            view.flags.writeable = False  # Read-only like the memory maps
+            return view
+        # fileno() would roll a SpooledTemporaryFile over to disk, read it instead
+        if not isinstance(stream, tempfile.SpooledTemporaryFile):
+            try:
+                fileno = stream.fileno()
+            except (AttributeError, OSError, io.UnsupportedOperation):
+                fileno = None
+            if fileno is not None:
+                return np.frombuffer(mmap.mmap(fileno, 0, access=mmap.ACCESS_READ), dtype=np.uint8)
+        position = stream.tell()
+        try:
+            stream.seek(0)
+            return np.frombuffer(stream.read(), dtype=np.uint8)
+        finally:
+            stream.seek(position)
+    filename = getattr(dcm, 'filename', None)
+    if isinstance(filename, str):
+        return np.memmap(filename, dtype=np.uint8, mode='r')
+    return None
+
+def pixel_view(dcm):
+    """
+    Zero-copy view (frames, rows, cols) of uncompressed, single-channel pixel
+    data in its stored dtype, or None when the data has to be decoded.
+    Bits above BitsStored are left as stored, see stored_bits_mask.
+    The view is computed once per dataset, the cache key and the volume share it.
+    """
+    try:
+        return object.__getattribute__(dcm, _VIEW_ATTR)
+    except AttributeError:
+        pass
+    view = _pixel_view(dcm)
+    object.__setattr__(dcm, _VIEW_ATTR, view)
+    return view
+
+def _pixel_view(dcm):
+    header = DicomHeader(dcm)
+    if not header.uncompressed or header.samples_per_pixel != 1:
+        return None
+    if header.bits_allocated not in (8, 16, 32):
+        return None
+    if header.pixel_representation == 1 and header.bits_stored != header.bits_allocated:
+        return None  # needs sign extension
+
+    element = dcm.get_item(PIXEL_DATA_TAG, keep_deferred=True)
+    value_tell = getattr(element, 'value_tell', None)
+    if value_tell is None or element.length < header.stored_bytes:
+        return None
+
+    try:
+        source = _source_bytes(dcm)
+    except Exception:
+        return None
+    if source is None or len(source) < value_tell + header.stored_bytes:
+        return None
+
+    kind = 'i' if header.pixel_representation == 1 else 'u'
+    dtype = np.dtype(f"<{kind}{header.bits_allocated // 8}")
+    raw = source[value_tell:value_tell + header.stored_bytes].view(dtype)
+    return raw.reshape(header.frames, header.rows, header.columns)
+
+def stored_bits_mask(header):
+    """
+    Mask of the BitsStored low bits of unsigned pixel data whose unused high
+    bits may hold overlays or garbage, or None when every bit is used.
+    """
+    if header.pixel_representation == 0 and header.bits_stored < header.bits_allocated:
+        return (1 << header.bits_stored) - 1
+    return None
+
+class LazyVolume:
+    """
+    Volume of shape (depth, height, width) that converts frames to float32
+    one slice at a time, applying the rescale slope/intercept in place.
+
+    The stored frames are either a zero-copy view of the upload or, for
+    compressed data, the array decoded by pydicom. bits_mask is applied to
+    the stored values of a view (see stored_bits_mask).
+    """
+
+    def __init__(self, raw, slope=1.0, intercept=0.0, bits_mask=None):
+        self.raw = raw
+        self.slope = float(slope)
+        self.intercept = float(intercept)
+        self.bits_mask = bits_mask
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def ndim(self):
+        return 3
+
+    def __len__(self):
+        return self.raw.shape[0]
+
+    def _convert(self, frames):
+        if self.bits_mask is not None:
+            frames = frames & self.bits_mask
+        out = frames.astype(np.float32)
+        if self.slope != 1.0:
+            out *= self.slope
+        if self.intercept != 0.0:
+            out += self.intercept
+        return out
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return self._convert(self.raw[idx])
+        if isinstance(idx, slice):
+            return self._convert(self.raw[idx])
+        raise TypeError("LazyVolume supports integer and slice indexing only")
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self._convert(self.raw)
+        return arr if dtype is None else arr.astype(dtype)
+
+def open_volume(dcm):
+    """
+    Build a LazyVolume for a dataset, memory-mapping uncompressed pixel data
+    and falling back to pydicom decoding otherwise.
+    """
+    slope = getattr(dcm, 'RescaleSlope', 1.0)
+    intercept = getattr(dcm, 'RescaleIntercept', 0.0)
+
+    raw = pixel_view(dcm)
+    if raw is not None:
+        return LazyVolume(raw, slope, intercept, stored_bits_mask(DicomHeader(dcm)))
+
+    raw = dcm.pixel_array
+    # If single slice, shape = (height, width).
+    if raw.ndim == 2:
+        raw = np.expand_dims(raw, axis=0)
+    return LazyVolume(raw, slope, intercept)
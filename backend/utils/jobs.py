@@ -0,0 +1,150 @@
+import io
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.bcolors import bcolors
+
+class BufferedUpload(io.BytesIO):
+    """
+    In-memory copy of a Flask file upload that outlives the request.
+    Exposes the same `filename` attribute as werkzeug's FileStorage.
+    """
+
+    def __init__(self, filename, data):
+        super().__init__(data)
+        self.filename = filename
+
+    @classmethod
+    def from_storage(cls, storage):
+        return cls(storage.filename, storage.read())
+
+class QueueFullError(Exception):
+    """
+    Raised when a job is submitted while the queue is at capacity.
+    """
+
+class Job:
+    """
+    State of a single asynchronous prediction job.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, files):
+        self.id = uuid.uuid4().hex
+        self.files = files
+        self.status = Job.PENDING
+        self.slices_done = 0
+        self.slices_total = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._changed = threading.Condition()
+
+    def update(self, **fields):
+        """
+        Update job fields and wake up any long-polling clients.
+        """
+        with self._changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self._changed.notify_all()
+
+    def wait(self, timeout):
+        """
+        Block until the job changes state or progress, or timeout expires.
+        """
+        with self._changed:
+            if self.status in (Job.DONE, Job.FAILED):
+                return
+            self._changed.wait(timeout)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "slices_done": self.slices_done,
+            "slices_total": self.slices_total,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+class JobManager:
+    """
+    Runs prediction jobs on a pool of worker threads that share the models
+    loaded once by the server.
+
+    Args:
+        run_job: callable(job) returning the job result; it may call
+                 job.update(slices_done=..., slices_total=...) to report progress.
+        workers: number of concurrent inference workers.
+        max_queued: maximum number of pending + running jobs.
+        ttl: seconds a finished job (and its result) is kept before cleanup.
+    """
+
+    def __init__(self, run_job, workers=1, max_queued=16, ttl=600):
+        self.run_job = run_job
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference-worker")
+
+    def _active(self):
+        return sum(1 for job in self._jobs.values() if job.status in (Job.PENDING, Job.RUNNING))
+
+    def cleanup(self):
+        """
+        Drop finished jobs older than the TTL.
+        """
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished is not None and now - job.finished > self.ttl]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+    def submit(self, files):
+        """
+        Queue a new job for the given uploads and return it immediately.
+        Raises QueueFullError if max_queued jobs are already pending or running.
+        """
+        self.cleanup()
+        with self._lock:
+            if self._active() >= self.max_queued:
+                raise QueueFullError(f"{self.max_queued} jobs already queued")
+            job = Job(files)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        self.cleanup()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job):
+        job.update(status=Job.RUNNING)
+        try:
+            result = self.run_job(job)
+        except Exception as e:
+            print(bcolors.FAIL + f"[Jobs] Job {job.id} failed: {e}" + bcolors.ENDC)
+            job.update(status=Job.FAILED, error=str(e), files=None, finished=time.time())
+            return
+        job.update(status=Job.DONE, result=result, files=None, finished=time.time())
+        print(bcolors.OKGREEN + f"[Jobs] Job {job.id} completed" + bcolors.ENDC)
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {"jobs": counts, "max_queued": self.max_queued}
@@ -0,0 +1,64 @@
+import base64
+import cv2
+import numpy as np
+
+# Compact mask encodings understood by the frontend viewer
+MASK_FORMATS = ('rle', 'bitpack')
+
+def rle_encode(mask):
+    """
+    Run-length encode a binary mask (H, W) in row-major order.
+    Counts alternate between 0-runs and 1-runs and always start with a 0-run
+    (possibly of length 0), so an empty mask is [H * W].
+    """
+    flat = mask.ravel().astype(np.int8)
+    # Positions where the value changes, plus both ends
+    changes = np.flatnonzero(np.diff(flat)) + 1
+    bounds = np.concatenate(([0], changes, [flat.size]))
+    counts = np.diff(bounds)
+    if flat.size and flat[0] == 1:
+        counts = np.concatenate(([0], counts))
+    return counts.tolist()
+
+def rle_decode(counts, shape):
+    """
+    Inverse of rle_encode.
+    """
+    values = np.zeros(len(counts), dtype=np.uint8)
+    values[1::2] = 1
+    return np.repeat(values, counts).reshape(shape)
+
+def bitpack_encode(masks):
+    """
+    Pack a stack of binary masks (N, H, W) into one base64 string, 8 pixels
+    per byte in row-major order (most significant bit first).
+    """
+    return base64.b64encode(np.packbits(masks.astype(bool), axis=None).tobytes()).decode('ascii')
+
+def bitpack_decode(data, shape):
+    """
+    Inverse of bitpack_encode.
+    """
+    bits = np.unpackbits(np.frombuffer(base64.b64decode(data), dtype=np.uint8))
+    return bits[:int(np.prod(shape))].reshape(shape)
+
+def encode_masks(masks, mask_format='rle'):
+    """
+    Encode the masks (N, H, W) of one study in the requested compact format.
+    """
+    if mask_format == 'rle':
+        return [rle_encode(mask) for mask in masks]
+    if mask_format == 'bitpack':
+        return bitpack_encode(masks)
+    raise ValueError(f"Unknown mask format '{mask_format}'")
+
+def encode_display(display):
+    """
+    Encode the window-leveled 8-bit slices (N, H, W) as grayscale PNGs,
+    once per study, so the client can composite the masks itself.
+    """
+    images = []
+    for original_8u in display:
+        _, buffer = cv2.imencode('.png', original_8u)
+        images.append("data:image/png;base64," + base64.b64encode(buffer.tobytes()).decode('utf-8'))
+    return images
@@ -0,0 +1,223 @@
+import time
+import uuid
+import bisect
+import threading
+import contextvars
+
+# Histogram buckets in seconds, from a single PNG encode to a whole large study
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """
+    Monotonic counter with optional labels. Nothing is recorded while the
+    registry it belongs to is disabled.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if self.registry is not None and not self.registry.enabled:
+            return
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labelnames, key), value) for key, value in sorted(self._values.items())]
+
+class Histogram:
+    """
+    Cumulative-bucket histogram with optional labels, Prometheus style.
+    Like Counter, it records nothing while its registry is disabled.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.registry = registry
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if self.registry is not None and not self.registry.enabled:
+            return
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][idx] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                out.append((f"{self.name}_bucket", _labels(self.labelnames, key, [("le", _number(bound))]), cumulative))
+            out.append((f"{self.name}_sum", _labels(self.labelnames, key), total))
+            out.append((f"{self.name}_count", _labels(self.labelnames, key), count))
+        return out
+
+class Registry:
+    """
+    Metrics of the server, rendered in the Prometheus text format.
+    Collectors are callables returning [(name, kind, documentation, {labels: value})]
+    and are evaluated at scrape time, e.g. for cache or queue statistics.
+    enabled=False turns off recording in every metric of the registry.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames, registry=self)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets, registry=self)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in metric.samples())
+        for collector in self._collectors:
+            for name, kind, documentation, values in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in values.items():
+                    names = [label for label, _ in labels]
+                    lines.append(f"{name}{_labels(names, [v for _, v in labels])} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "segmentation_stage_duration_seconds", "Time spent in each stage of the prediction path.", ["stage"])
+MODEL_SECONDS = REGISTRY.histogram(
+    "segmentation_model_inference_seconds", "Time of one ensemble member call on a batch.", ["model"])
+REQUEST_SECONDS = REGISTRY.histogram(
+    "segmentation_request_duration_seconds", "Time to produce the response of an HTTP request.", ["endpoint"])
+REQUESTS = REGISTRY.counter(
+    "segmentation_requests_total", "HTTP requests by endpoint and status code.", ["endpoint", "status"])
+FILES = REGISTRY.counter(
+    "segmentation_files_total", "Uploaded files by outcome.", ["result"])
+SLICES = REGISTRY.counter(
+    "segmentation_slices_total", "Predicted slices by source (inferred or cached).", ["source"])
+
+######################
+#  Per-request Timing
+######################
+
+class RequestTiming:
+    """
+    Stage durations of one request, reported in its Server-Timing header.
+    """
+
+    def __init__(self, request_id=None):
+        self.id = request_id or uuid.uuid4().hex
+        self.start = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self):
+        with self._lock:
+            entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(entries)
+
+_current = contextvars.ContextVar("request_timing", default=None)
+
+def begin_request(request_id=None):
+    """
+    Start timing a request in the current context; returns its RequestTiming.
+    """
+    timing = RequestTiming(request_id)
+    _current.set(timing)
+    return timing
+
+def end_request():
+    _current.set(None)
+
+def current_request():
+    return _current.get()
+
+def observe_stage(name, seconds):
+    """
+    Record a stage duration in the histogram and the current request's timing.
+    """
+    if not REGISTRY.enabled:
+        return
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timing = _current.get()
+    if timing is not None:
+        timing.add(name, seconds)
+
+class StageTimer:
+    """
+    Context manager timing a block as one stage, see timed().
+    """
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe_stage(self.name, time.perf_counter() - self.start)
+        return False
+
+def timed(name):
+    """
+    Time a block as one stage of the current request: `with timed("decode"): ...`
+    """
+    return StageTimer(name)
@@ -0,0 +1,94 @@
+import queue
+import threading
+import contextvars
+
+# Marks the end of a stage's input
+_DONE = object()
+
+class Stage:
+    """
+    One step of a pipeline: fn(item) -> item, or None to drop the item.
+    Runs on `workers` threads reading from a bounded input queue.
+    """
+
+    def __init__(self, name, fn, workers=1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+
+class _StageError:
+    def __init__(self, stage, error):
+        self.stage = stage
+        self.error = error
+
+def run_pipeline(items, stages, queue_size=4):
+    """
+    Run items through stages connected by bounded queues, each stage on its
+    own thread pool, and yield the outputs of the last stage as they complete.
+
+    Output order is completion order, not input order. An exception raised by
+    a stage function stops the pipeline and is re-raised to the consumer.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    stop = threading.Event()
+
+    def put(q, item):
+        # Bounded put that gives up once the pipeline is stopped
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def feed():
+        for item in items:
+            if not put(queues[0], item):
+                return
+        put(queues[0], _DONE)
+
+    def work(stage, inbox, outbox, remaining):
+        while not stop.is_set():
+            try:
+                item = inbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                # Pass the marker on to sibling workers, the last one closes the stage
+                with remaining[1]:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                put(inbox if not last else outbox, _DONE)
+                return
+            try:
+                result = stage.fn(item)
+            except Exception as e:
+                put(queues[-1], _StageError(stage.name, e))
+                stop.set()
+                return
+            if result is not None:
+                put(outbox, result)
+
+    # Workers run in copies of the caller's context (e.g. its request timing)
+    threads = [threading.Thread(target=contextvars.copy_context().run, args=(feed,),
+                                name="pipeline-feed", daemon=True)]
+    for idx, stage in enumerate(stages):
+        remaining = [stage.workers, threading.Lock()]
+        for n in range(stage.workers):
+            threads.append(threading.Thread(target=contextvars.copy_context().run,
+                                            args=(work, stage, queues[idx], queues[idx + 1], remaining),
+                                            name=f"pipeline-{stage.name}-{n}", daemon=True))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                return
+            if isinstance(item, _StageError):
+                raise RuntimeError(f"Pipeline stage '{item.stage}' failed: {item.error}") from item.error
+            yield item
+    finally:
+        stop.set()
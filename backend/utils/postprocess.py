@@ -0,0 +1,78 @@
+import numpy as np
+import cv2
+from scipy import ndimage
+
+from utils.metrics import timed
+
+# Post-processing modes: keep the largest component per slice, or across the volume
+POSTPROCESS_MODES = ('2d', '3d')
+
+# OpenCV resizes at most this many channels in one call
+_MAX_RESIZE_CHANNELS = 512
+
+# define a function to extract from the predicted mask the largest connected component
+def largest_connected_component(mask):
+    # find all connected components (0: background, 1: connected component)
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=4)
+    # find the largest connected component
+    largest_label = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
+    # create a mask with only the largest connected component
+    mask = np.zeros_like(mask)
+    mask[labels == largest_label] = 1
+    return mask
+
+def largest_connected_component_3d(masks):
+    """
+    Keep only the largest 6-connected component of a binary volume (depth, H, W),
+    so the prostate mask stays anatomically consistent across slices.
+    """
+    labels, num_labels = ndimage.label(masks, structure=ndimage.generate_binary_structure(3, 1))
+    if num_labels <= 1:
+        return masks
+    sizes = np.bincount(labels.ravel())
+    sizes[0] = 0
+    return (labels == np.argmax(sizes)).astype(np.uint8)
+
+def postprocess_volume(avg_pred, mode='2d', threshold=0.5):
+    """
+    Binarize a stacked prediction volume (depth, 128, 128) in one pass and
+    keep the largest connected component, per slice ('2d', the original
+    behavior) or across the whole volume ('3d'). Empty slices are skipped.
+    """
+    if mode not in POSTPROCESS_MODES:
+        raise ValueError(f"Unknown post-processing mode '{mode}'")
+
+    with timed("postprocess"):
+        return _postprocess_volume(avg_pred, mode, threshold)
+
+def _postprocess_volume(avg_pred, mode, threshold):
+    masks = (np.asarray(avg_pred) > threshold).astype(np.uint8)
+    nonempty = np.flatnonzero(masks.reshape(len(masks), -1).any(axis=1))
+    if len(nonempty) == 0:
+        return masks
+
+    if mode == '3d':
+        # Only the slab holding predictions needs labeling
+        lo, hi = nonempty[0], nonempty[-1] + 1
+        masks[lo:hi] = largest_connected_component_3d(masks[lo:hi])
+        return masks
+
+    for idx in nonempty:
+        masks[idx] = largest_connected_component(masks[idx])
+    return masks
+
+def upsample_masks(masks, size):
+    """
+    Resize a stack of binary masks (N, h, w) to size=(width, height) with as
+    few OpenCV calls as possible, by treating slices as channels.
+    Empty slices are not resized. Returns uint8 masks (N, height, width).
+    """
+    width, height = size
+    out = np.zeros((len(masks), height, width), dtype=np.uint8)
+    nonempty = np.flatnonzero(masks.reshape(len(masks), -1).any(axis=1))
+    for start in range(0, len(nonempty), _MAX_RESIZE_CHANNELS):
+        idx = nonempty[start:start + _MAX_RESIZE_CHANNELS]
+        stacked = np.ascontiguousarray(np.moveaxis(masks[idx], 0, -1))  # (h, w, n)
+        resized = cv2.resize(stacked, size, interpolation=cv2.INTER_LINEAR)
+        out[idx] = np.moveaxis(resized.reshape(height, width, -1), -1, 0)
+    return out
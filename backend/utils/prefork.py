@@ -0,0 +1,171 @@
+import itertools
+import threading
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utils.bcolors import bcolors
+
+##################################
+#  Shared Memory Slice Transport
+##################################
+
+def _attach(name):
+    """
+    Attach to a segment created by a worker. The parent starts the resource
+    tracker before forking so every process shares it, the worker's unlink()
+    is then the only cleanup needed.
+    """
+    return shared_memory.SharedMemory(name=name)
+
+class RemoteEnsemble:
+    """
+    Worker-side stand-in for the ensemble.
+
+    Batches are copied once into a shared memory segment, the inference
+    process is notified through request_queue and writes the averaged
+    predictions back into the same segment, so slice arrays never go
+    through pickling. Safe to call from several request threads at once.
+
+    Exposes predict(batch, max_batch_size) like FusedEnsemble and
+    InferenceScheduler, so it can be passed to get_prediction directly.
+    Other models served by the parent (e.g. the triage model) are reached
+    through endpoint(target), which shares this transport.
+    """
+
+    def __init__(self, worker_id, request_queue, response_queue):
+        self.worker_id = worker_id
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._receiver = threading.Thread(target=self._receive, name="inference-responses", daemon=True)
+        self._receiver.start()
+
+    def _receive(self):
+        while True:
+            message = self.response_queue.get()
+            if message is None:
+                return
+            req_id, error = message
+            with self._lock:
+                future = self._pending.pop(req_id, None)
+            if future is None:
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(RuntimeError(error))
+
+    def close(self):
+        """
+        Stop the response receiver, call once the HTTP server has drained.
+        """
+        self.response_queue.put(None)
+        self._receiver.join()
+
+    def endpoint(self, target):
+        return RemoteEndpoint(self, target)
+
+    def predict(self, batch, max_batch_size=None, target="ensemble"):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        if len(batch) == 0:
+            return np.zeros(batch.shape[:3], dtype=np.float32)
+
+        shm = shared_memory.SharedMemory(create=True, size=batch.nbytes)
+        try:
+            np.ndarray(batch.shape, dtype=np.float32, buffer=shm.buf)[...] = batch
+            future = Future()
+            with self._lock:
+                req_id = next(self._ids)
+                self._pending[req_id] = future
+            self.request_queue.put((self.worker_id, req_id, shm.name, batch.shape, target))
+            future.result()
+            # Outputs (N, H, W) were written in place over the inputs (N, H, W, 1)
+            return np.ndarray(batch.shape[:3], dtype=np.float32, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+class RemoteEndpoint:
+    """
+    predict() of a named model held by the parent other than the ensemble,
+    sent over the worker's RemoteEnsemble.
+    """
+
+    def __init__(self, remote, target):
+        self.remote = remote
+        self.target = target
+
+    def predict(self, batch, max_batch_size=None):
+        return self.remote.predict(batch, max_batch_size, target=self.target)
+
+class InferenceServer:
+    """
+    Inference-side loop run by the parent process that owns the models.
+
+    Requests from every HTTP worker are fed into an InferenceScheduler, so
+    slices from different workers are batched together, and results are
+    written back into the worker's shared memory segment. endpoints maps
+    further targets (e.g. "triage") to their own schedulers.
+    """
+
+    def __init__(self, scheduler, request_queue, endpoints=None):
+        self.scheduler = scheduler
+        self.schedulers = {"ensemble": scheduler, **(endpoints or {})}
+        self.request_queue = request_queue
+        self.response_queues = {}
+        self._thread = threading.Thread(target=self._loop, name="inference-server", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.request_queue.put(None)
+        self._thread.join()
+
+    def _loop(self):
+        while True:
+            message = self.request_queue.get()
+            if message is None:
+                return
+            worker_id, req_id, shm_name, shape, target = message
+            try:
+                self._handle(worker_id, req_id, shm_name, shape, target)
+            except Exception as e:
+                print(bcolors.FAIL + f"[Prefork] Request from worker {worker_id} failed: {e}" + bcolors.ENDC)
+                self._respond(worker_id, req_id, str(e))
+
+    def _respond(self, worker_id, req_id, error=None):
+        response_queue = self.response_queues.get(worker_id)
+        if response_queue is not None:
+            response_queue.put((req_id, error))
+
+    def _handle(self, worker_id, req_id, shm_name, shape, target):
+        if target not in self.schedulers:
+            raise ValueError(f"Unknown inference target '{target}'")
+        shm = _attach(shm_name)
+        # Copy out so no view of the segment outlives this call
+        batch = np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+        futures = self.schedulers[target].submit(batch)
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            error = next((str(f.exception()) for f in futures if f.exception() is not None), None)
+            if error is None:
+                outputs = np.concatenate([f.result() for f in futures], axis=0)
+                view = np.ndarray(outputs.shape, dtype=np.float32, buffer=shm.buf)
+                view[...] = outputs
+                del view
+            shm.close()
+            self._respond(worker_id, req_id, error)
+
+        for future in futures:
+            future.add_done_callback(done)
@@ -0,0 +1,163 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+from utils.bcolors import bcolors
+
+class InferenceScheduler:
+    """
+    Dynamic micro-batching in front of the ensemble.
+
+    Request threads submit preprocessed slices; a single scheduler thread
+    collects pending slices from all in-flight requests until max_batch_size
+    slices are gathered or max_wait_ms has passed since the oldest one,
+    runs the ensemble once and scatters the outputs back to the owners.
+
+    Exposes predict(batch, max_batch_size) so it can be passed anywhere a
+    FusedEnsemble or list of models is accepted.
+
+    With batch_sizes, every ensemble call has one of those sizes: collected
+    batches are split into pieces of the largest one and each piece is
+    zero-padded to the next size, so only warmed-up shapes are ever traced.
+
+    Args:
+        predict_fn: callable(batch) -> array with one output per input slice.
+        max_batch_size: maximum number of slices per ensemble call.
+        max_wait_ms: longest time a slice waits for a batch to fill up.
+        batch_sizes: optional sizes of the ensemble calls, e.g. WARMUP_BATCH_SIZES.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=5, batch_sizes=None):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.buckets = sorted({size for size in batch_sizes or () if 0 < size <= max_batch_size})
+        self._queue = queue.Queue()
+        self._pending = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.slices = 0
+        self.padded = 0
+        self.chunks = 0
+        self.total_wait = 0.0
+        self.max_observed_wait = 0.0
+        self.batch_sizes = {}
+        self._thread = threading.Thread(target=self._loop, name="inference-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, batch):
+        """
+        Queue a preprocessed batch (N, 128, 128, 1) and return a Future per
+        chunk of at most max_batch_size slices.
+        """
+        futures = []
+        for i in range(0, len(batch), self.max_batch_size):
+            future = Future()
+            self._queue.put((batch[i:i + self.max_batch_size], future, time.perf_counter()))
+            futures.append(future)
+        return futures
+
+    def predict(self, batch, max_batch_size=None):
+        """
+        Blocking helper: submit the batch and wait for all its outputs.
+        max_batch_size is ignored, batching is decided by the scheduler.
+        """
+        if len(batch) == 0:
+            return self.predict_fn(batch)
+        return np.concatenate([future.result() for future in self.submit(batch)], axis=0)
+
+    def _collect(self):
+        # Block for the first request, then gather more until the batch is full or the wait expires.
+        # A chunk that would overflow the batch is held over as the first one of the next batch.
+        items = [self._pending if self._pending is not None else self._queue.get()]
+        self._pending = None
+        size = len(items[0][0])
+        deadline = items[0][2] + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if size + len(item[0]) > self.max_batch_size:
+                self._pending = item
+                break
+            items.append(item)
+            size += len(item[0])
+        return items
+
+    def _call_sizes(self, n):
+        # Sizes of the ensemble calls running n slices
+        if not self.buckets:
+            return [n]
+        largest = self.buckets[-1]
+        sizes = [largest] * (n // largest)
+        if n % largest:
+            sizes.append(next(size for size in self.buckets if size >= n % largest))
+        return sizes
+
+    def _run(self, batch):
+        if not self.buckets:
+            return self.predict_fn(batch)
+        outputs = []
+        offset = 0
+        for size in self._call_sizes(len(batch)):
+            piece = batch[offset:offset + size]
+            if len(piece) < size:
+                piece = np.concatenate([piece, np.zeros((size - len(piece),) + piece.shape[1:], dtype=piece.dtype)])
+            outputs.append(self.predict_fn(piece)[:len(batch) - offset])
+            offset += size
+        return np.concatenate(outputs, axis=0)
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            started = time.perf_counter()
+            batch = np.concatenate([chunk for chunk, _, _ in items], axis=0)
+            try:
+                outputs = self._run(batch)
+            except Exception as e:
+                print(bcolors.FAIL + f"[Scheduler] Batch of {len(batch)} slices failed: {e}" + bcolors.ENDC)
+                for _, future, _ in items:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for chunk, future, _ in items:
+                future.set_result(outputs[offset:offset + len(chunk)])
+                offset += len(chunk)
+
+            with self._lock:
+                self.batches += 1
+                self.slices += len(batch)
+                for size in self._call_sizes(len(batch)):
+                    self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+                self.padded += sum(self._call_sizes(len(batch))) - len(batch)
+                self.chunks += len(items)
+                for _, _, enqueued in items:
+                    waited = started - enqueued
+                    self.total_wait += waited
+                    self.max_observed_wait = max(self.max_observed_wait, waited)
+
+    def stats(self):
+        """
+        Return batch-size and queue-wait statistics.
+        """
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "slices": self.slices,
+                "mean_batch_size": self.slices / self.batches if self.batches else 0.0,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "padded_slices": self.padded,
+                "mean_queue_wait_ms": 1000.0 * self.total_wait / max(self.chunks, 1),
+                "max_queue_wait_ms": 1000.0 * self.max_observed_wait,
+                "queued": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": 1000.0 * self.max_wait,
+            }
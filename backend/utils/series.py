@@ -0,0 +1,201 @@
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.bcolors import bcolors
+from utils.ingest import read_header, read_deferred, open_volume, DicomHeader
+from utils.jobs import BufferedUpload
+
+# Bytes 128-131 of a DICOM Part 10 file
+DICOM_MAGIC = b'DICM'
+
+class ArchiveTooLargeError(Exception):
+    """
+    Raised when the members of an uploaded archive exceed the size budget.
+    """
+
+######################
+#  Upload Expansion  #
+######################
+
+def is_dicom(file):
+    """
+    True if the file carries the DICOM preamble, whatever its name. Rewinds the file.
+    """
+    head = file.read(132)
+    file.seek(0)
+    return len(head) == 132 and head[128:132] == DICOM_MAGIC
+
+def is_archive(file):
+    return file.filename.lower().endswith('.zip')
+
+def expand_uploads(files, max_bytes=None):
+    """
+    Flatten the uploads into DICOM instances. Zip archives are read member by
+    member straight into memory (nothing is extracted to disk); files are kept
+    when they end in .dcm or start like a DICOM file, since exported series
+    often have no extension.
+
+    Raises ArchiveTooLargeError when the uncompressed members of the archives
+    exceed max_bytes, and zipfile.BadZipFile for corrupt archives.
+    """
+    instances = []
+    total = 0
+    for file in files:
+        if not is_archive(file):
+            if file.filename.lower().endswith('.dcm') or is_dicom(file):
+                instances.append(file)
+            else:
+                print(bcolors.FAIL + f"Unsupported file format for '{file.filename}'" + bcolors.ENDC)
+            continue
+
+        with zipfile.ZipFile(file) as archive:
+            members = archive_members(archive)
+            total += sum(m.file_size for m in members)
+            if max_bytes is not None and total > max_bytes:
+                raise ArchiveTooLargeError(f"Archives expand to more than {max_bytes // (1024 * 1024)} MB")
+            for member in members:
+                with archive.open(member) as source:
+                    upload = BufferedUpload(f"{file.filename}/{member.filename}", source.read())
+                if member.filename.lower().endswith('.dcm') or is_dicom(upload):
+                    instances.append(upload)
+    return instances
+
+def archive_members(archive):
+    return [m for m in archive.infolist() if not m.is_dir() and not m.filename.startswith('__MACOSX/')]
+
+def upload_headers(files):
+    """
+    Headers of the DICOM instances expand_uploads would return, so the cost
+    of a request is known before anything is expanded. Archive members are
+    listed from the zip central directory and only their headers are
+    decompressed. Unreadable files and members are skipped.
+    """
+    for file in files:
+        if not is_archive(file):
+            if file.filename.lower().endswith('.dcm') or is_dicom(file):
+                try:
+                    yield read_header(file)
+                except IOError:
+                    pass  # Reported when the file is processed
+            continue
+
+        try:
+            with zipfile.ZipFile(file) as archive:
+                for member in archive_members(archive):
+                    with archive.open(member) as source:
+                        if not member.filename.lower().endswith('.dcm') and not is_dicom(source):
+                            continue
+                        try:
+                            yield read_header(source)
+                        except IOError:
+                            pass
+        except zipfile.BadZipFile:
+            pass  # Reported by expand_uploads
+        finally:
+            file.seek(0)
+
+######################
+#  Series Assembly   #
+######################
+
+class Series:
+    """
+    Instances of one series in slice order, assembled into a single volume
+    before inference.
+    """
+
+    def __init__(self, uid, description=""):
+        self.uid = uid
+        self.description = description
+        self.datasets = []
+        self.filenames = []
+        self.header = None
+
+    def __len__(self):
+        return sum(DicomHeader(dcm).frames for dcm in self.datasets)
+
+    @property
+    def instance_numbers(self):
+        return [_int_or_none(getattr(dcm, 'InstanceNumber', None)) for dcm in self.datasets]
+
+    @property
+    def sop_instance_uids(self):
+        return [str(getattr(dcm, 'SOPInstanceUID', '')) for dcm in self.datasets]
+
+    @property
+    def decoded_bytes(self):
+        return len(self) * self.header.rows * self.header.columns * 4
+
+    def sort(self):
+        """
+        Order the instances along the slice normal when every instance has a
+        position and orientation, otherwise by InstanceNumber (upload order breaks ties).
+        """
+        positions = [_slice_position(dcm) for dcm in self.datasets]
+        if all(p is not None for p in positions):
+            order = np.argsort(positions, kind='stable')
+        else:
+            numbers = [n if n is not None else 0 for n in self.instance_numbers]
+            order = np.argsort(numbers, kind='stable')
+        self.datasets = [self.datasets[i] for i in order]
+        self.filenames = [self.filenames[i] for i in order]
+
+    def volume(self):
+        """
+        float32 volume (slices, rows, columns) with every instance's rescale applied.
+        """
+        volume = np.empty((len(self), self.header.rows, self.header.columns), dtype=np.float32)
+        pos = 0
+        for dcm in self.datasets:
+            frames = np.asarray(open_volume(dcm))
+            volume[pos:pos + len(frames)] = frames
+            pos += len(frames)
+        return volume
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _slice_position(dcm):
+    # Distance of the slice along the normal of its image plane
+    position = getattr(dcm, 'ImagePositionPatient', None)
+    orientation = getattr(dcm, 'ImageOrientationPatient', None)
+    if position is None or orientation is None or len(orientation) != 6:
+        return None
+    normal = np.cross([float(v) for v in orientation[:3]], [float(v) for v in orientation[3:]])
+    return float(np.dot(normal, [float(v) for v in position]))
+
+def group_series(instances):
+    """
+    Group DICOM instances by SeriesInstanceUID (and image size) into sorted
+    Series. Multi-frame files and files without a series UID stay on their own.
+    Unreadable files are reported and skipped.
+    """
+    groups = OrderedDict()
+    for idx, upload in enumerate(instances):
+        try:
+            dcm = read_deferred(upload)
+        except Exception as e:
+            print(bcolors.FAIL + f"Could not read DICOM file '{upload.filename}': {e}" + bcolors.ENDC)
+            continue
+        header = DicomHeader(dcm)
+        uid = str(getattr(dcm, 'SeriesInstanceUID', '') or '')
+        if not uid or header.frames > 1:
+            key = (uid, idx)
+        else:
+            key = (uid, header.rows, header.columns)
+
+        series = groups.get(key)
+        if series is None:
+            series = groups[key] = Series(uid or upload.filename, str(getattr(dcm, 'SeriesDescription', '') or ''))
+            series.header = header
+        series.datasets.append(dcm)
+        series.filenames.append(upload.filename)
+
+    for series in groups.values():
+        series.sort()
+    return list(groups.values())
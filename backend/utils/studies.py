@@ -0,0 +1,267 @@
+import os
+import re
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.bcolors import bcolors
+
+# Study ids are uuid4 hex strings; anything else is rejected before touching the disk tier
+STUDY_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+class Study:
+    """
+    Inference result of one study kept for on-demand rendering: the 8-bit
+    display slices (depth, H, W), the binarized masks (depth, 128, 128) and
+    JSON-serializable metadata (file name, series uid, ...).
+    """
+
+    def __init__(self, study_id, display, masks, meta=None):
+        self.id = study_id
+        self.display = display
+        self.masks = masks
+        self.meta = meta or {}
+        self.accessed = time.time()
+
+    def __len__(self):
+        return len(self.display)
+
+    @property
+    def nbytes(self):
+        return self.display.nbytes + self.masks.nbytes
+
+    def to_dict(self, ttl):
+        return {
+            "study_id": self.id,
+            "slices": len(self),
+            "shape": list(self.display.shape),
+            "expires_in": max(0, round(self.accessed + ttl - time.time())),
+            **self.meta,
+        }
+
+class StudyStore:
+    """
+    Studies kept after inference under a random id, so their overlays can be
+    rendered slice by slice when the viewer asks for them.
+
+    A study expires ttl seconds after it was last accessed. Memory is bounded
+    by max_bytes, least recently used studies are dropped first. With disk_dir
+    studies are also written there and read back on a miss, so every worker
+    of the pre-fork server sees the studies stored by the others.
+    """
+
+    def __init__(self, ttl=900, max_bytes=512 * 1024 * 1024, disk_dir=None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._studies = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.stored = 0
+        self.expired = 0
+        self.evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, study_id):
+        return os.path.join(self.disk_dir, f"{study_id}.npz")
+
+    def put(self, display, masks, **meta):
+        """
+        Store a study and return it; its id is study.id.
+        """
+        study = Study(uuid.uuid4().hex, np.ascontiguousarray(display, dtype=np.uint8),
+                      np.ascontiguousarray(masks, dtype=np.uint8), meta)
+        self.cleanup()
+        with self._lock:
+            self.stored += 1
+            self._insert(study)
+
+        if self.disk_dir:
+            tmp_path = self._disk_path(study.id) + ".tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    np.savez(f, display=study.display, masks=study.masks, meta=np.array(json.dumps(meta)))
+                os.replace(tmp_path, self._disk_path(study.id))
+            except Exception as e:
+                print(bcolors.WARNING + f"[Studies] Could not write '{study.id}' to disk: {e}" + bcolors.ENDC)
+        return study
+
+    def get(self, study_id):
+        """
+        Return the Study and refresh its TTL, or None if it is unknown or expired.
+        """
+        if not STUDY_ID_PATTERN.fullmatch(study_id):
+            return None
+        now = time.time()
+        with self._lock:
+            study = self._studies.get(study_id)
+            if study is not None and now - study.accessed > self.ttl:
+                self._remove(study_id)
+                self.expired += 1
+                study = None
+            if study is not None:
+                study.accessed = now
+                self._studies.move_to_end(study_id)
+                self._touch(study_id)
+                return study
+
+        if not self.disk_dir or not os.path.exists(self._disk_path(study_id)):
+            return None
+        path = self._disk_path(study_id)
+        try:
+            if now - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with np.load(path) as data:
+                study = Study(study_id, data['display'], data['masks'], json.loads(str(data['meta'])))
+        except Exception as e:
+            print(bcolors.WARNING + f"[Studies] Could not read '{study_id}' from disk: {e}" + bcolors.ENDC)
+            return None
+        with self._lock:
+            self._insert(study)
+            self._touch(study_id)
+        return study
+
+    def delete(self, study_id):
+        """
+        Drop a study from memory and disk. Returns whether it existed.
+        """
+        if not STUDY_ID_PATTERN.fullmatch(study_id):
+            return False
+        with self._lock:
+            found = self._remove(study_id)
+        if self.disk_dir:
+            try:
+                os.remove(self._disk_path(study_id))
+                found = True
+            except FileNotFoundError:
+                pass
+        return found
+
+    def cleanup(self):
+        """
+        Drop the studies not accessed within the TTL, in memory and on disk.
+        """
+        now = time.time()
+        with self._lock:
+            expired = [study_id for study_id, study in self._studies.items() if now - study.accessed > self.ttl]
+            for study_id in expired:
+                self._remove(study_id)
+            self.expired += len(expired)
+
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                path = os.path.join(self.disk_dir, name)
+                try:
+                    if name.endswith('.npz') and now - os.path.getmtime(path) > self.ttl:
+                        os.remove(path)
+                except OSError:
+                    pass  # Removed by another worker
+        return len(expired)
+
+    def _touch(self, study_id):
+        # Caller holds the lock; the file's mtime is the TTL shared with other workers
+        if self.disk_dir:
+            try:
+                os.utime(self._disk_path(study_id))
+            except OSError:
+                pass
+
+    def _insert(self, study):
+        # Caller holds the lock
+        self._remove(study.id)
+        if study.nbytes > self.max_bytes:
+            return
+        self._studies[study.id] = study
+        self._size += study.nbytes
+        while self._size > self.max_bytes:
+            _, evicted = self._studies.popitem(last=False)
+            self._size -= evicted.nbytes
+            self.evictions += 1
+
+    def _remove(self, study_id):
+        # Caller holds the lock
+        study = self._studies.pop(study_id, None)
+        if study is None:
+            return False
+        self._size -= study.nbytes
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "studies": len(self._studies),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "stored": self.stored,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+class TileCache:
+    """
+    Bounded LRU of encoded slice overlays keyed by
+    (study id, slice index, scale, format), so slices the viewer returns to
+    or that were prefetched are not rendered again.
+    """
+
+    def __init__(self, max_bytes=128 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._tiles = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._tiles
+
+    def get(self, key):
+        with self._lock:
+            data = self._tiles.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            if key in self._tiles:
+                self._size -= len(self._tiles.pop(key))
+            if len(data) > self.max_bytes:
+                return
+            self._tiles[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._tiles.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def discard(self, study_id):
+        """
+        Drop every tile of a study.
+        """
+        with self._lock:
+            for key in [key for key in self._tiles if key[0] == study_id]:
+                self._size -= len(self._tiles.pop(key))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "tiles": len(self._tiles),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,109 @@
+import io
+import os
+
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+from tensorflow.keras import layers, Input, Model, utils
+
+# MR Image Storage
+MR_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.4'
+
+###########################
+#  Synthetic DICOM Studies
+###########################
+
+def synthetic_volume(frames, rows=256, columns=256, gland_fraction=0.4, seed=0):
+    """
+    uint16 volume (frames, rows, columns) of noisy soft tissue with a brighter
+    ellipsoid in the middle gland_fraction of the slices, roughly where a
+    prostate sits in an axial series.
+    """
+    rng = np.random.default_rng(seed)
+    volume = rng.normal(300, 40, size=(frames, rows, columns))
+
+    z, y, x = np.ogrid[:frames, :rows, :columns]
+    rz = max(1.0, frames * gland_fraction / 2)
+    gland = (((z - (frames - 1) / 2) / rz) ** 2 + ((y - rows / 2) / (rows / 8)) ** 2
+             + ((x - columns / 2) / (columns / 7)) ** 2) <= 1
+    volume[gland] += 400
+    return np.clip(volume, 0, 4095).astype(np.uint16)
+
+def synthetic_dataset(pixels, series_uid=None, instance_number=1, pixel_spacing=0.5, slice_thickness=3.0):
+    """
+    Uncompressed MR dataset holding pixels (frames, rows, columns); a single
+    frame is stored without NumberOfFrames like a classic one-file-per-slice series.
+    """
+    meta = FileMetaDataset()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    meta.MediaStorageSOPClassUID = MR_IMAGE_STORAGE
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = MR_IMAGE_STORAGE
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Modality = 'MR'
+    ds.SeriesInstanceUID = series_uid or generate_uid()
+    ds.InstanceNumber = instance_number
+    ds.Rows, ds.Columns = pixels.shape[1:]
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+    ds.PixelSpacing = [pixel_spacing, pixel_spacing]
+    ds.SliceThickness = slice_thickness
+    if len(pixels) > 1:
+        ds.NumberOfFrames = len(pixels)
+    ds.PixelData = np.ascontiguousarray(pixels).tobytes()
+    return ds
+
+def to_bytes(ds):
+    buffer = io.BytesIO()
+    ds.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+def synthetic_study(frames, rows=256, columns=256, multi_frame=True, seed=0):
+    """
+    Encoded DICOM files of one synthetic series: a single multi-frame file,
+    or one single-frame file per slice. Returns a list of (filename, bytes).
+    """
+    volume = synthetic_volume(frames, rows, columns, seed=seed)
+    series_uid = generate_uid()
+    if multi_frame:
+        return [(f"study_{seed}.dcm", to_bytes(synthetic_dataset(volume, series_uid)))]
+    return [(f"study_{seed}_{idx:04d}.dcm", to_bytes(synthetic_dataset(volume[idx:idx + 1], series_uid, idx + 1)))
+            for idx in range(frames)]
+
+#########################
+#  Random-weight Models #
+#########################
+
+def stub_model(seed=0, filters=8, input_shape=(128, 128, 1)):
+    """
+    Small random-weight encoder/decoder with the I/O shape of the real members:
+    (N, 128, 128, 1) -> sigmoid probabilities (N, 128, 128, 1).
+    """
+    utils.set_random_seed(seed)
+    inp = Input(shape=input_shape)
+    x = layers.Conv2D(filters, 3, padding='same', activation='relu')(inp)
+    x = layers.MaxPooling2D()(x)
+    x = layers.Conv2D(filters * 2, 3, padding='same', activation='relu')(x)
+    x = layers.UpSampling2D()(x)
+    x = layers.Conv2D(filters, 3, padding='same', activation='relu')(x)
+    out = layers.Conv2D(1, 1, activation='sigmoid')(x)
+    return Model(inp, out)
+
+def write_stub_models(directory, paths, filters=8):
+    """
+    Save one stub model per entry of paths (e.g. MODEL_PATHS) into directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    written = []
+    for seed, path in enumerate(paths):
+        target = os.path.join(directory, os.path.basename(path))
+        stub_model(seed, filters).save(target)
+        written.append(target)
+    return written
@@ -0,0 +1,101 @@
+import threading
+
+import numpy as np
+
+class TriageUsage:
+    """
+    Counts the slices the triage let through and the ones it skipped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.slices = 0
+        self.skipped = 0
+
+    def add(self, slices, skipped):
+        with self._lock:
+            self.slices += slices
+            self.skipped += skipped
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "slices": self.slices,
+                "skipped_slices": self.skipped,
+                "skipped_fraction": round(self.skipped / self.slices, 4) if self.slices else 0.0,
+            }
+
+class SliceTriage:
+    """
+    Cheap pass that estimates which slices of a volume contain the gland.
+
+    Every `stride`-th slice (and the last one) is run through `model`, e.g. a
+    list holding only the cheapest ensemble member, or through the full
+    ensemble when model is None. The full ensemble then only runs on the range
+    between the first and last slice with at least min_pixels predicted
+    pixels, widened by the unsampled neighbours and `margin` slices on each
+    side. When nothing is found the whole volume is kept.
+
+    Args:
+        model: models used for the triage pass, None to use the request's ensemble.
+        stride: spacing of the sampled slices.
+        margin: extra slices kept on both sides of the estimated range.
+        min_pixels: predicted pixels for a sampled slice to count as positive.
+        min_depth: volumes with fewer slices are not triaged.
+    """
+
+    def __init__(self, model=None, stride=2, margin=2, min_pixels=20, min_depth=8, threshold=0.5, parent=None):
+        self.model = model
+        self.stride = max(1, stride)
+        self.margin = margin
+        self.min_pixels = min_pixels
+        self.min_depth = min_depth
+        self.threshold = threshold
+        self.parent = parent
+        self.usage = TriageUsage()
+
+    @property
+    def signature(self):
+        """
+        Triage parameters, part of the cache namespace since they change the output.
+        """
+        return f"triage:{self.stride}:{self.margin}:{self.min_pixels}:{self.min_depth}"
+
+    def track(self):
+        """
+        Per-request copy whose usage only counts its own slices (totals still
+        go to this instance).
+        """
+        return SliceTriage(self.model, self.stride, self.margin, self.min_pixels, self.min_depth,
+                           self.threshold, parent=self)
+
+    def record(self, slices, skipped):
+        self.usage.add(slices, skipped)
+        if self.parent is not None:
+            self.parent.record(slices, skipped)
+
+    def samples(self, depth):
+        """
+        Indices of the slices of a volume run through the triage pass.
+        """
+        if depth < self.min_depth:
+            return np.zeros(0, dtype=int)
+        idx = np.arange(0, depth, self.stride)
+        if idx[-1] != depth - 1:
+            idx = np.append(idx, depth - 1)
+        return idx
+
+    def keep(self, depth, sampled, probs):
+        """
+        Indices of the slices of a volume the full ensemble must run on, given
+        the triage predictions probs (len(sampled), 128, 128).
+        """
+        if len(sampled) == 0:
+            return np.arange(depth)
+        region = np.count_nonzero(probs.reshape(len(probs), -1) > self.threshold, axis=1)
+        positive = sampled[region >= self.min_pixels]
+        if len(positive) == 0:
+            return np.arange(depth)
+        lo = max(0, positive[0] - (self.stride - 1) - self.margin)
+        hi = min(depth, positive[-1] + self.stride + self.margin)
+        return np.arange(lo, hi)
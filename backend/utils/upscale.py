@@ -3,9 +3,61 @@ import cv2
 import numpy as np
 from typing import List
 
+from utils.metrics import timed
+
+def upscale_image(img: np.ndarray, scale_factor: int = 4, interpolation: int = cv2.INTER_LANCZOS4) -> np.ndarray:
+    """
+    Upscale an in-memory image (H, W) or (H, W, C) by the given scale factor.
+    
+    Args:
+        img: The image array to resize.
+        scale_factor: The integer factor by which to upscale each dimension.
+        interpolation: OpenCV interpolation flag (default is Lanczos).
+    
+    Returns:
+        The resized image of shape (H * scale_factor, W * scale_factor[, C]).
+    """
+    if scale_factor == 1:
+        return img
+    height, width = img.shape[:2]
+    with timed("upscale"):
+        return cv2.resize(img, (width * scale_factor, height * scale_factor), interpolation=interpolation)
+
+# Encodings of rendered overlays: format name -> (OpenCV extension, MIME type)
+IMAGE_FORMATS = {
+    'png': ('.png', 'image/png'),
+    'jpeg': ('.jpg', 'image/jpeg'),
+    'webp': ('.webp', 'image/webp'),
+}
+
+def encode_image(img: np.ndarray, image_format: str = 'png', quality: int = 90) -> bytes:
+    """
+    Encode an image array as PNG, JPEG or WebP bytes (see IMAGE_FORMATS);
+    quality applies to the lossy formats.
+    """
+    extension, _ = IMAGE_FORMATS[image_format]
+    params = []
+    if image_format == 'jpeg':
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif image_format == 'webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    with timed("encode"):
+        _, buffer = cv2.imencode(extension, img, params)
+        return buffer.tobytes()
+
+def encode_png_base64(img: np.ndarray) -> str:
+    """
+    Encode an image array as a "data:image/png;base64,..." string.
+    """
+    with timed("encode"):
+        _, buffer = cv2.imencode('.png', img)
+        return "data:image/png;base64," + base64.b64encode(buffer.tobytes()).decode('utf-8')
+
 def upscale_overlays(overlays: List[str], scale_factor: int = 4) -> List[str]:
     """
     Upscale each base64-encoded overlay image by the given scale factor using Lanczos interpolation.
+    Prefer rendering at the final size with create_overlay(..., scale_factor=...),
+    which avoids decoding and re-encoding every PNG.
     
     Args:
         overlays: A list of base64-encoded PNG images (e.g., shape (128,128,3)).
@@ -35,21 +87,12 @@ def upscale_overlays(overlays: List[str], scale_factor: int = 4) -> List[str]:
             upscaled_overlays.append(overlay_base64)
             continue
         
-        # 2) Determine new size based on scale_factor
-        height, width = img.shape[:2]
-        new_width = width * scale_factor
-        new_height = height * scale_factor
-        
         # 3) Resize using Lanczos interpolation (cv2.INTER_LANCZOS4)
-        upscaled_img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_LANCZOS4)
+        upscaled_img = upscale_image(img, scale_factor, cv2.INTER_LANCZOS4)
         
         # 4) Encode back to PNG base64
-        _, buffer = cv2.imencode('.png', upscaled_img)
-        upscaled_bytes = buffer.tobytes()
-        # Reattach prefix if desired
-        # Typically: "data:image/png;base64,<encoded>"
-        upscaled_b64 = base64.b64encode(upscaled_bytes).decode('utf-8')
-        upscaled_overlay = f"data:image/png;base64,{upscaled_b64}"
+        #    Typically: "data:image/png;base64,<encoded>"
+        upscaled_overlay = encode_png_base64(upscaled_img)
         
         # 5) Append to results
         upscaled_overlays.append(upscaled_overlay)
@@ -10,4 +10,53 @@ export const runSegmentation = async (file, config) => {
   return await API.post('/predict', file, config);
 };
 
-export const fetchDataList = () => API.get('/data/list');
\ No newline at end of file
+export const fetchDataList = () => API.get('/data/list');
+// Streams /predict results as NDJSON, calling onSlice for every slice as soon as it arrives
+export const streamSegmentation = async (formData, onSlice) => {
+  const response = await fetch(`${API.defaults.baseURL}/predict?stream=1`, {
+    method: 'POST',
+    body: formData,
+    headers: { Accept: 'application/x-ndjson' },
+  });
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let summary = null;
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split('\n');
+    buffer = lines.pop();
+    for (const line of lines) {
+      if (!line.trim()) continue;
+      const message = JSON.parse(line);
+      if (message.error) throw new Error(message.error);
+      if (message.done) summary = message;
+      else onSlice(message);
+    }
+  }
+  return summary;
+};
+
+// Requests compact masks (format: 'rle' or 'bitpack') to be composited client-side with services/masks.js
+export const runCompactSegmentation = async (formData, format = 'rle', config) => {
+  return await API.post(`/predict?format=${format}`, formData, config);
+};
+
+// Predicts without rendering and keeps the masks on the server; returns { studies: [{ study_id, slices, ... }] }
+export const runStoredSegmentation = async (formData, config) => {
+  return await API.post('/predict?store=1', formData, config);
+};
+
+// Image URL of one rendered slice, usable as an <img> src; neighbours are prefetched on the server
+export const sliceOverlayUrl = (studyId, sliceIndex, { scale = 2, format = 'png', prefetch = 2 } = {}) =>
+  `${API.defaults.baseURL}/studies/${studyId}/slices/${sliceIndex}?scale=${scale}&format=${format}&prefetch=${prefetch}`;
+
+// Overlays of the slices [start, end) as data URIs
+export const fetchSliceRange = async (studyId, start, end, { scale = 2, format = 'png' } = {}) => {
+  return await API.get(`/studies/${studyId}/slices`, { params: { start, end, scale, format } });
+};
+
+export const deleteStudy = (studyId) => API.delete(`/studies/${studyId}`);
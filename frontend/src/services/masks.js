@@ -0,0 +1,77 @@
+// Decoding and compositing of the compact mask formats returned by /predict?format=rle|bitpack
+
+// Counts alternate 0-runs and 1-runs, starting with a 0-run, in row-major order
+export const decodeRle = (counts, height, width) => {
+  const mask = new Uint8Array(height * width);
+  let pos = 0;
+  counts.forEach((count, idx) => {
+    if (idx % 2 === 1) mask.fill(1, pos, pos + count);
+    pos += count;
+  });
+  return mask;
+};
+
+// One base64 string for the whole study, 8 pixels per byte, most significant bit first
+export const decodeBitpack = (data, depth, height, width) => {
+  const bytes = Uint8Array.from(atob(data), (c) => c.charCodeAt(0));
+  const size = height * width;
+  const masks = [];
+  for (let slice = 0; slice < depth; slice++) {
+    const mask = new Uint8Array(size);
+    for (let i = 0; i < size; i++) {
+      const bit = slice * size + i;
+      mask[i] = (bytes[bit >> 3] >> (7 - (bit & 7))) & 1;
+    }
+    masks.push(mask);
+  }
+  return masks;
+};
+
+// Returns one Uint8Array (height * width) per slice of a study
+export const decodeStudyMasks = (format, study) => {
+  const [depth, height, width] = study.mask_shape;
+  if (format === 'bitpack') return decodeBitpack(study.masks, depth, height, width);
+  return study.masks.map((counts) => decodeRle(counts, height, width));
+};
+
+const loadImage = (src) =>
+  new Promise((resolve, reject) => {
+    const img = new Image();
+    img.onload = () => resolve(img);
+    img.onerror = reject;
+    img.src = src;
+  });
+
+// Draws the grayscale slice with the mask in red (alpha 0.5) and returns a PNG data URL
+export const compositeOverlay = async (imageSrc, mask, maskHeight, maskWidth, alpha = 0.5) => {
+  const img = await loadImage(imageSrc);
+  const canvas = document.createElement('canvas');
+  canvas.width = img.width;
+  canvas.height = img.height;
+  const ctx = canvas.getContext('2d');
+  ctx.drawImage(img, 0, 0);
+
+  // Paint the mask at its own resolution, then let the canvas scale it up
+  const maskCanvas = document.createElement('canvas');
+  maskCanvas.width = maskWidth;
+  maskCanvas.height = maskHeight;
+  const maskCtx = maskCanvas.getContext('2d');
+  const pixels = maskCtx.createImageData(maskWidth, maskHeight);
+  for (let i = 0; i < mask.length; i++) {
+    if (!mask[i]) continue;
+    pixels.data[i * 4] = 255;
+    pixels.data[i * 4 + 3] = 255;
+  }
+  maskCtx.putImageData(pixels, 0, 0);
+
+  ctx.globalAlpha = alpha;
+  ctx.drawImage(maskCanvas, 0, 0, img.width, img.height);
+  return canvas.toDataURL('image/png');
+};
+
+// Renders every slice of a study returned with images, in slice order
+export const compositeStudy = async (format, study) => {
+  const [, height, width] = study.mask_shape;
+  const masks = decodeStudyMasks(format, study);
+  return Promise.all(study.images.map((src, idx) => compositeOverlay(src, masks[idx], height, width)));
+};